@@ -3,16 +3,51 @@ Agent Routes
 MT5 Agent management and pairing
 """
 
+import asyncio
+import logging
 import secrets
 from datetime import datetime, timezone
-from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
 from pydantic import BaseModel
 from passlib.hash import bcrypt
 from app.core.auth import get_current_user, AuthenticatedUser
-from app.core.agent_auth import get_current_agent, AgentRecord
+from app.core.agent_auth import (
+    get_current_agent,
+    issue_agent_session,
+    revoke_agent_sessions,
+    verify_agent_key,
+    AgentRecord,
+)
+from app.core.config import get_settings
+from app.core.metrics import observe_job_claimed, observe_job_finished
 from app.core.supabase import get_supabase_client
-
+from app.services.account_state import store_account_state
+from app.services.job_outputs import offload_job_output
+from app.services.job_queue import get_job_queue
+from app.services.jobs import (
+    job_age,
+    job_expires_in,
+    job_lane,
+    job_wakeups,
+    publish_job_result,
+)
+from app.services.price_ingest import (
+    PriceIngestError,
+    decode_price_payload,
+    write_ticks,
+)
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -26,13 +61,19 @@ class PairAgentResponse(BaseModel):
     pairing_key: str
 
 
+class AgentSessionResponse(BaseModel):
+    session_token: str
+    expires_at: int  # epoch seconds
+
+
 class HeartbeatRequest(BaseModel):
     status: str
     metrics: dict
 
 
-class PriceUpdateRequest(BaseModel):
-    instrument: dict  # {"EURUSD": {"bid": 1.0845, "ask": 1.0847}}
+class AccountStateRequest(BaseModel):
+    account: dict
+    positions: List[dict]
 
 
 class AgentStatus(BaseModel):
@@ -45,15 +86,30 @@ class AgentStatus(BaseModel):
 
 class JobResponse(BaseModel):
     job_id: str
-    no_jobs: Optional[bool] = None
+    job_type: Optional[str] = None
+    input_data: Optional[dict] = None
+    expires_in: Optional[float] = None  # seconds until the job's deadline
+    age: Optional[float] = None  # seconds since the job was enqueued
+
+
+class JobBatchResponse(BaseModel):
+    jobs: List[JobResponse]
 
 
 class JobResultRequest(BaseModel):
-    status: str  # "completed" or "failed"
+    status: str  # "completed", "failed" or "expired"
     output_data: Optional[dict] = None
     error_message: Optional[str] = None
 
 
+class JobResultItem(JobResultRequest):
+    job_id: str
+
+
+class JobResultBatchRequest(BaseModel):
+    results: List[JobResultItem]
+
+
 @router.post("/pair", response_model=PairAgentResponse)
 async def pair_agent(
     request: PairAgentRequest,
@@ -129,6 +185,77 @@ async def pair_agent(
         )
 
 
+@router.post("/{agent_id}/session", response_model=AgentSessionResponse)
+async def open_agent_session(
+    agent_id: str,
+    x_agent_key: str = Header(..., alias="X-Agent-Key"),
+) -> AgentSessionResponse:
+    """Exchange the pairing key for a short-lived session token (bcrypt runs once)."""
+    agent = await verify_agent_key(x_agent_key, agent_id)
+    token, expires_at = await issue_agent_session(agent)
+
+    return AgentSessionResponse(session_token=token, expires_at=expires_at)
+
+
+def _require_owned_agent(supabase, agent_id: str, user_id: str):
+    """404 unless the agent exists and belongs to the user."""
+    response = (
+        supabase.table("mt5_agents")
+        .select("id")
+        .eq("id", agent_id)
+        .eq("user_id", user_id)
+        .execute()
+    )
+
+    if not response.data:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Agent not found",
+        )
+
+
+def _require_path_agent(agent_id: str, agent: AgentRecord):
+    """403 unless the URL's agent id is the authenticated agent."""
+    if agent_id != agent.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Agent ID mismatch",
+        )
+
+
+@router.delete("/{agent_id}/session")
+async def revoke_agent_session(
+    agent_id: str,
+    current_user: AuthenticatedUser = Depends(get_current_user),
+) -> dict:
+    """
+    Revoke all outstanding session tokens for one of the user's agents.
+
+    The pairing key is revoked too, so the agent must be paired again.
+    """
+    supabase = get_supabase_client()
+    _require_owned_agent(supabase, agent_id, current_user.id)
+
+    await revoke_agent_sessions(agent_id)
+
+    return {"revoked": True}
+
+
+@router.delete("/{agent_id}")
+async def delete_agent(
+    agent_id: str,
+    current_user: AuthenticatedUser = Depends(get_current_user),
+) -> dict:
+    """Delete one of the user's agents, revoking its key and sessions first."""
+    supabase = get_supabase_client()
+    _require_owned_agent(supabase, agent_id, current_user.id)
+
+    await revoke_agent_sessions(agent_id)
+    supabase.table("mt5_agents").delete().eq("id", agent_id).execute()
+
+    return {"deleted": True}
+
+
 @router.post("/{agent_id}/heartbeat")
 async def heartbeat(
     agent_id: str,
@@ -136,6 +263,7 @@ async def heartbeat(
     agent: AgentRecord = Depends(get_current_agent),
 ) -> dict:
     """Update agent heartbeat and status."""
+    _require_path_agent(agent_id, agent)
     supabase = get_supabase_client()
 
     # Update agent status with proper timestamp
@@ -150,37 +278,149 @@ async def heartbeat(
     return {"acknowledged": True}
 
 
-@router.get("/{agent_id}/jobs/next", response_model=JobResponse)
+async def _claim_jobs(agent: AgentRecord, agent_id: str, limit: int) -> List[dict]:
+    """Atomically claim up to `limit` jobs, in lane order, oldest first."""
+    jobs = await get_job_queue().claim(agent_id, agent.user_id, limit)
+
+    for job in jobs:
+        _record_claim(job)
+
+    return jobs
+
+
+def _record_claim(job: dict):
+    """Report enqueue -> claim latency for the job's type and lane."""
+    lane = job_lane(job.get("priority"))
+    waited = observe_job_claimed(job, lane)
+
+    if waited is not None:
+        logger.info(
+            f"Job {job['id']} claimed: lane={lane} type={job.get('job_type')} "
+            f"queue_wait_ms={waited * 1000:.0f}"
+        )
+
+
+async def _wait_for_jobs(
+    agent_id: str,
+    agent: AgentRecord,
+    limit: int,
+    wait: Optional[int],
+) -> List[dict]:
+    """
+    Long-poll claim: park until a job is enqueued for the agent's user
+    (signalled over Redis by enqueue_job) or `wait` seconds elapse.
+    """
+    settings = get_settings()
+    timeout = settings.JOB_LONG_POLL_SECONDS if wait is None else wait
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    # Register before the first claim so a job enqueued in between still wakes us
+    wakeup = job_wakeups.register(agent.user_id)
+    try:
+        while True:
+            wakeup.clear()
+            jobs = await _claim_jobs(agent, agent_id, limit)
+
+            if jobs:
+                return jobs
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return []
+
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return []
+    finally:
+        job_wakeups.unregister(agent.user_id, wakeup)
+
+
+def _job_response(job: dict) -> JobResponse:
+    # Relative times so agent clock skew does not matter
+    return JobResponse(
+        job_id=job["id"],
+        job_type=job.get("job_type"),
+        input_data=job.get("input_data"),
+        expires_in=job_expires_in(job),
+        age=job_age(job),
+    )
+
+
+@router.get(
+    "/{agent_id}/jobs/next",
+    response_model=JobResponse,
+    responses={204: {"description": "No job became available before the wait expired"}},
+)
 async def get_next_job(
     agent_id: str,
+    wait: Optional[int] = Query(None, ge=0, le=60),
     agent: AgentRecord = Depends(get_current_agent),
-) -> dict:
-    """Atomic job claim - get next pending job."""
-    supabase = get_supabase_client()
+):
+    """Long-poll job claim - get next pending job, or 204 after `wait` seconds."""
+    _require_path_agent(agent_id, agent)
+    jobs = await _wait_for_jobs(agent_id, agent, 1, wait)
 
-    # Use RPC for atomic claim with FOR UPDATE SKIP LOCKED
-    response = supabase.rpc(
-        "claim_next_job",
-        {
-            "p_agent_id": agent_id,
-        },
-    ).execute()
-
-    # RPC returns a SETOF jobs (PostgreSQL) - may be list or single dict
-    job = None
-    if isinstance(response.data, list) and response.data:
-        job = response.data[0]
-    elif isinstance(response.data, dict):
-        job = response.data
-
-    if job and job.get("id"):
-        return {
-            "job_id": job["id"],
-            "job_type": job.get("job_type"),
-            "input_data": job.get("input_data"),
-        }
+    if not jobs:
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
 
-    return {"no_jobs": True}
+    return _job_response(jobs[0])
+
+
+@router.get(
+    "/{agent_id}/jobs/batch",
+    response_model=JobBatchResponse,
+    responses={204: {"description": "No job became available before the wait expired"}},
+)
+async def get_job_batch(
+    agent_id: str,
+    limit: int = Query(10, ge=1, le=50),
+    wait: Optional[int] = Query(None, ge=0, le=60),
+    agent: AgentRecord = Depends(get_current_agent),
+):
+    """Long-poll batch claim - atomically claim up to `limit` pending jobs, oldest first."""
+    _require_path_agent(agent_id, agent)
+    jobs = await _wait_for_jobs(agent_id, agent, limit, wait)
+
+    if not jobs:
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    return JobBatchResponse(jobs=[_job_response(job) for job in jobs])
+
+
+async def _finish_job(job_id: str, agent_id: str, result: JobResultRequest):
+    """
+    Record a job result and notify waiters.
+
+    With the Postgres backends, the finish_job RPC applies the job_type
+    propagation (ea_versions, ea_deployments, tv_signals) in the same
+    transaction, in a single round trip.
+    """
+    # Large read payloads (candles, positions) go to Redis; the row keeps a
+    # reference. Which outputs may go is decided by the stored job's type,
+    # never by what the agent reports.
+    output_data = result.output_data
+    if output_data:
+        stored = await get_job_queue().get(job_id)
+        output_data = await offload_job_output(
+            job_id, stored and stored.get("job_type"), output_data
+        )
+
+    job = await get_job_queue().finish(
+        job_id, agent_id, result.status, output_data, result.error_message
+    )
+
+    if not job:
+        logger.warning(f"Result for unknown job {job_id} from agent {agent_id}")
+        return
+
+    observe_job_finished(job)
+
+    # Resolve any route awaiting this job, on whichever worker it runs
+    await publish_job_result(
+        job_id, job["status"], job.get("output_data"), job.get("error_message")
+    )
 
 
 @router.post("/{agent_id}/jobs/{job_id}/result")
@@ -191,100 +431,76 @@ async def submit_job_result(
     agent: AgentRecord = Depends(get_current_agent),
 ) -> dict:
     """Submit job execution result."""
-    supabase = get_supabase_client()
+    _require_path_agent(agent_id, agent)
+    await _finish_job(job_id, agent.id, request)
 
-    # Update job status
-    supabase.table("jobs").update(
-        {
-            "status": request.status,
-            "output_data": request.output_data,
-            "error_message": request.error_message,
-            "completed_at": datetime.now(timezone.utc).isoformat(),
-        }
-    ).eq("id", job_id).execute()
+    return {"acknowledged": True}
 
-    # Propagate result based on job_type
-    job_response = (
-        supabase.table("jobs").select("job_type, input_data").eq("id", job_id).execute()
-    )
 
-    if job_response.data:
-        job_type = job_response.data[0].get("job_type")
-        input_data = job_response.data[0].get("input_data", {})
-
-        if job_type == "compile":
-            version_id = input_data.get("version_id")
-            if version_id:
-                supabase.table("ea_versions").update(
-                    {
-                        "status": "compiled"
-                        if request.status == "completed"
-                        else "failed",
-                    }
-                ).eq("id", version_id).execute()
-
-        elif job_type in ["deploy", "run", "stop"]:
-            deployment_id = input_data.get("deployment_id")
-            if deployment_id:
-                status_map = {
-                    "deploy": "running" if request.status == "completed" else "error",
-                    "run": "running",
-                    "stop": "stopped",
-                }
-                supabase.table("ea_deployments").update(
-                    {
-                        "status": status_map.get(job_type, "error"),
-                    }
-                ).eq("id", deployment_id).execute()
-
-        elif job_type == "trade":
-            signal_id = input_data.get("signal_id")
-            if signal_id:
-                supabase.table("tv_signals").update(
-                    {
-                        "status": "executed"
-                        if request.status == "completed"
-                        else "failed",
-                        "fill_price": request.output_data.get("fill_price")
-                        if request.output_data
-                        else None,
-                        "broker_order_id": request.output_data.get("order_id")
-                        if request.output_data
-                        else None,
-                        "error_message": request.error_message,
-                        "resolved_at": datetime.now(timezone.utc).isoformat(),
-                    }
-                ).eq("id", signal_id).execute()
+@router.post("/{agent_id}/jobs/results")
+async def submit_job_results(
+    agent_id: str,
+    request: JobResultBatchRequest,
+    agent: AgentRecord = Depends(get_current_agent),
+) -> dict:
+    """Submit results for a batch of claimed jobs in one call."""
+    _require_path_agent(agent_id, agent)
+    for result in request.results:
+        await _finish_job(result.job_id, agent.id, result)
 
-    return {"acknowledged": True}
+    return {"acknowledged": len(request.results)}
 
 
 @router.post("/{agent_id}/prices")
 async def update_prices(
     agent_id: str,
-    request: PriceUpdateRequest,
+    request: Request,
     agent: AgentRecord = Depends(get_current_agent),
 ) -> dict:
-    """Update price data from agent."""
+    """
+    Update price data from agent.
+
+    Highest-frequency endpoint: the raw body is decoded straight into tick
+    tuples (no pydantic models) and written to Redis in one pipeline.
+    Body: {"EURUSD": {"bid": 1.0845, "ask": 1.0847}, ...} as JSON or msgpack.
+    """
+    _require_path_agent(agent_id, agent)
     from app.core.redis import get_redis
-    import json
+
+    try:
+        ticks, rejected = decode_price_payload(
+            await request.body(), request.headers.get("content-type", "")
+        )
+    except PriceIngestError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e),
+        )
 
     redis = await get_redis()
-    count = 0
+    count = await write_ticks(redis, ticks)
 
-    for instrument, data in request.instrument.items():
-        price_data = {
-            "bid": data.get("bid"),
-            "ask": data.get("ask"),
-            "ts": datetime.now(timezone.utc).isoformat(),
-        }
+    return {"received": count, "rejected": rejected}
 
-        # Store in Redis
-        await redis.set(f"prices:{instrument}", json.dumps(price_data))
-        await redis.publish(f"prices:{instrument}", json.dumps(price_data))
-        count += 1
 
-    return {"received": count}
+@router.post("/{agent_id}/state")
+async def update_account_state(
+    agent_id: str,
+    request: AccountStateRequest,
+    agent: AgentRecord = Depends(get_current_agent),
+) -> dict:
+    """
+    Store the agent's account and positions snapshot.
+
+    Pushed whenever the snapshot changes (plus a keepalive); GET
+    /trading/account and /trading/positions answer from it.
+    """
+    _require_path_agent(agent_id, agent)
+    updated_at = await store_account_state(
+        agent.user_id, agent_id, request.account, request.positions
+    )
+
+    return {"acknowledged": True, "updated_at": updated_at}
 
 
 @router.get("/{agent_id}/status", response_model=AgentStatus)
@@ -295,7 +511,13 @@ async def get_agent_status(
     """Get agent connection status."""
     supabase = get_supabase_client()
 
-    response = supabase.table("mt5_agents").select("*").eq("id", agent_id).execute()
+    response = (
+        supabase.table("mt5_agents")
+        .select("*")
+        .eq("id", agent_id)
+        .eq("user_id", current_user.id)
+        .execute()
+    )
 
     if not response.data:
         raise HTTPException(
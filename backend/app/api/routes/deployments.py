@@ -8,6 +8,8 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
 from app.core.auth import get_current_user, AuthenticatedUser
 from app.core.supabase import get_supabase_client
+from app.services.job_outputs import resolve_job_output
+from app.services.jobs import enqueue_job
 
 
 router = APIRouter()
@@ -136,26 +138,19 @@ async def create_deployment(
     deployment_id = deployment_response.data[0]["id"]
 
     # Create deploy job
-    job_response = (
-        supabase.table("jobs")
-        .insert(
-            {
-                "user_id": current_user.id,
-                "job_type": "deploy",
-                "input_data": {
-                    "deployment_id": deployment_id,
-                    "symbol": request.symbol,
-                    "timeframe": request.timeframe,
-                },
-                "status": "pending",
-            }
-        )
-        .execute()
+    job = await enqueue_job(
+        current_user.id,
+        "deploy",
+        {
+            "deployment_id": deployment_id,
+            "symbol": request.symbol,
+            "timeframe": request.timeframe,
+        },
     )
 
     return {
         "deployment_id": deployment_id,
-        "job_id": job_response.data[0]["id"],
+        "job_id": job["id"],
     }
 
 
@@ -168,14 +163,7 @@ async def run_deployment(
     supabase = get_supabase_client()
 
     # Create run job
-    supabase.table("jobs").insert(
-        {
-            "user_id": current_user.id,
-            "job_type": "run",
-            "input_data": {"deployment_id": deployment_id},
-            "status": "pending",
-        }
-    ).execute()
+    await enqueue_job(current_user.id, "run", {"deployment_id": deployment_id})
 
     # Update status
     supabase.table("ea_deployments").update(
@@ -196,14 +184,7 @@ async def stop_deployment(
     supabase = get_supabase_client()
 
     # Create stop job
-    supabase.table("jobs").insert(
-        {
-            "user_id": current_user.id,
-            "job_type": "stop",
-            "input_data": {"deployment_id": deployment_id},
-            "status": "pending",
-        }
-    ).execute()
+    await enqueue_job(current_user.id, "stop", {"deployment_id": deployment_id})
 
     # Update status
     supabase.table("ea_deployments").update(
@@ -215,36 +196,58 @@ async def stop_deployment(
     return DeploymentStatus(status="stopping")
 
 
+DEPLOYMENT_LOG_COLUMNS = (
+    "id, job_type, status, output_data, error_message, created_at, completed_at, claimed_at"
+)
+
+
+def _query_deployment_jobs(
+    table: str, user_id: str, deployment_id: str, limit: int
+) -> list:
+    supabase = get_supabase_client()
+
+    response = (
+        supabase.table(table)
+        .select(DEPLOYMENT_LOG_COLUMNS)
+        .eq("user_id", user_id)
+        .filter("input_data->>deployment_id", "eq", deployment_id)
+        .order("created_at", desc=True)
+        .limit(limit)
+        .execute()
+    )
+
+    return response.data or []
+
+
 @router.get("/{deployment_id}/logs")
 async def get_deployment_logs(
     deployment_id: str,
     limit: int = 100,
+    include_archived: bool = True,
     current_user: AuthenticatedUser = Depends(get_current_user),
 ) -> dict:
-    """Get deployment logs."""
-    supabase = get_supabase_client()
+    """
+    Get deployment logs.
 
+    Recent jobs come from the live `jobs` table; older ones are read from
+    `jobs_archive` only when the live table does not fill `limit`.
+    """
     # Get jobs for this deployment (filtered by deployment_id in input_data)
-    response = (
-        supabase.table("jobs")
-        .select(
-            "id, job_type, status, output_data, error_message, created_at, completed_at, claimed_at"
+    jobs = _query_deployment_jobs("jobs", current_user.id, deployment_id, limit)
+
+    if include_archived and len(jobs) < limit:
+        jobs += _query_deployment_jobs(
+            "jobs_archive", current_user.id, deployment_id, limit - len(jobs)
         )
-        .eq("user_id", current_user.id)
-        .filter("input_data->>deployment_id", "eq", deployment_id)
-        .order("created_at", desc=True)
-        .limit(limit)
-        .execute()
-    )
 
     logs = []
-    for job in response.data:
+    for job in jobs:
         logs.append(
             {
                 "id": job["id"],
                 "type": job.get("job_type"),
                 "status": job.get("status"),
-                "output": job.get("output_data"),
+                "output": await resolve_job_output(job.get("output_data")),
                 "error": job.get("error_message"),
                 "created_at": str(job.get("created_at")),
                 "completed_at": str(job.get("completed_at"))
@@ -9,6 +9,7 @@ from pydantic import BaseModel
 from app.core.auth import get_current_user, AuthenticatedUser
 from app.core.supabase import get_supabase_client
 from app.services.ea_generator import generate_mql5
+from app.services.jobs import enqueue_job
 
 
 router = APIRouter()
@@ -235,20 +236,13 @@ async def compile_version(
         )
 
     # Create job
-    job_response = (
-        supabase.table("jobs")
-        .insert(
-            {
-                "user_id": current_user.id,
-                "job_type": "compile",
-                "input_data": {
-                    "version_id": version_id,
-                    "storage_path": f"ea-projects/{current_user.id}/{version_id}",
-                },
-                "status": "pending",
-            }
-        )
-        .execute()
+    job = await enqueue_job(
+        current_user.id,
+        "compile",
+        {
+            "version_id": version_id,
+            "storage_path": f"ea-projects/{current_user.id}/{version_id}",
+        },
     )
 
     # Update version status
@@ -258,13 +252,13 @@ async def compile_version(
         }
     ).eq("id", version_id).execute()
 
-    if not job_response.data:
+    if not job:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Failed to create compile job",
         )
 
-    return CompileResponse(job_id=job_response.data[0]["id"])
+    return CompileResponse(job_id=job["id"])
 
 
 @router.get("/versions/{version_id}")
@@ -3,19 +3,47 @@ Trading Routes
 Orders, Positions, Account, Candles
 """
 
-import asyncio
 import time
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status
-from pydantic import BaseModel
+from datetime import datetime, timezone
+from typing import List, Optional, Union
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
 from app.core.auth import get_current_user, AuthenticatedUser
+from app.core.config import get_settings
 from app.core.supabase import get_supabase_client
-from app.core.redis import get_redis
-import json
+from app.services.account_state import get_account_state
+from app.services.candle_cache import (
+    fetch_candle_bars,
+    fetch_candle_range,
+    fetch_candles_before,
+    forming_open_time,
+)
+from app.services.candles import (
+    OPEN_TIME,
+    TIMEFRAME_SECONDS,
+    bar_to_candle,
+    bars_to_columns,
+    candle_aggregator,
+)
+from app.services.jobs import (
+    IdempotencyKeyConflict,
+    enqueue_job,
+    job_results,
+    run_read_job,
+)
 
 
 router = APIRouter()
 
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+MAX_BATCH_ORDERS = 20
+ORDER_SIDES = ("buy", "sell")
+# Agent leg status -> BatchOrderFill.status
+BATCH_LEG_STATUSES = {"completed": "filled", "expired": "expired"}
+CLOSE_LEG_STATUSES = {"completed": "closed", "expired": "expired"}
+CANDLE_FORMATS = ("columns", "rows")
+
 
 class OrderRequest(BaseModel):
     symbol: str
@@ -31,6 +59,53 @@ class OrderResponse(BaseModel):
     status: str  # "filled", "pending", "error"
 
 
+class BatchOrderRequest(BaseModel):
+    orders: List[OrderRequest] = Field(..., min_length=1, max_length=MAX_BATCH_ORDERS)
+
+
+class BatchOrderFill(BaseModel):
+    symbol: str
+    side: str
+    volume: float
+    status: str  # "filled", "error", "expired", "pending"
+    order_id: Optional[str] = None
+    fill_price: Optional[float] = None
+    error: Optional[str] = None
+
+
+class BatchOrderResponse(BaseModel):
+    batch_id: str
+    status: str  # "filled", "partial", "error", "pending"
+    orders: List[BatchOrderFill]
+
+
+class ClosePositionsRequest(BaseModel):
+    all: bool = False
+    symbol: Optional[str] = None
+    side: Optional[str] = None  # "buy" or "sell"
+    magic: Optional[int] = None
+
+
+class ClosedPosition(BaseModel):
+    ticket: str
+    symbol: str
+    side: str
+    volume: float
+    status: str  # "closed", "error", "expired"
+    closed_price: Optional[float] = None
+    pnl: Optional[float] = None
+    error: Optional[str] = None
+
+
+class ClosePositionsResponse(BaseModel):
+    batch_id: str
+    status: str  # "closed", "partial", "error", "pending"
+    closed: int
+    failed: int
+    total_pnl: float
+    positions: List[ClosedPosition]
+
+
 class Position(BaseModel):
     id: str
     ticket: str
@@ -62,19 +137,51 @@ class Candle(BaseModel):
     volume: float
 
 
-@router.post("/orders", response_model=OrderResponse)
-async def place_order(
-    request: OrderRequest,
-    current_user: AuthenticatedUser = Depends(get_current_user),
-) -> OrderResponse:
-    """Place a manual trading order."""
-    supabase = get_supabase_client()
-    user_id = current_user.id
+class CandleColumns(BaseModel):
+    """Candles as parallel arrays; t is the bar open time in broker server epoch seconds."""
+
+    t: List[int]
+    o: List[float]
+    h: List[float]
+    l: List[float]  # noqa: E741
+    c: List[float]
+    v: List[float]
+
+
+def _validate_idempotency_key(idempotency_key: Optional[str]):
+    if idempotency_key is not None and not (
+        0 < len(idempotency_key) <= MAX_IDEMPOTENCY_KEY_LENGTH
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="invalid_idempotency_key",
+        )
+
+
+async def _enqueue_order_job(
+    user_id: str, job_type: str, input_data: dict, idempotency_key: Optional[str]
+) -> dict:
+    """Enqueue a trade job; 409 if the key was used for a different order."""
+    try:
+        return await enqueue_job(
+            user_id,
+            job_type,
+            input_data,
+            idempotency_key=idempotency_key,
+            verify_payload=True,
+        )
+    except IdempotencyKeyConflict:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="idempotency_key_conflict",
+        )
+
 
-    # Check for connected agent
+def _require_online_agent(supabase, user_id: str) -> dict:
+    """Return the user's connected agent, or 503 if none has a recent heartbeat."""
     agents = (
         supabase.table("mt5_agents")
-        .select("id")
+        .select("id, last_heartbeat")
         .eq("user_id", user_id)
         .eq("is_connected", True)
         .execute()
@@ -86,26 +193,48 @@ async def place_order(
             detail="agent_offline",
         )
 
-    # Check agent heartbeat
-    agent = (
-        supabase.table("mt5_agents")
-        .select("last_heartbeat")
-        .eq("id", agents.data[0]["id"])
-        .execute()
-    )
-    if agent.data:
-        from datetime import datetime, timedelta
-
-        last_hb = agent.data[0].get("last_heartbeat")
-        if last_hb:
-            if isinstance(last_hb, str):
-                last_hb = datetime.fromisoformat(last_hb.replace("Z", "+00:00"))
-            minutes_since = (datetime.now() - last_hb).total_seconds() / 60
-            if minutes_since > 10:
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail="agent_offline",
-                )
+    agent = agents.data[0]
+    last_hb = agent.get("last_heartbeat")
+    if last_hb:
+        if isinstance(last_hb, str):
+            last_hb = datetime.fromisoformat(last_hb.replace("Z", "+00:00"))
+        minutes_since = (datetime.now(last_hb.tzinfo) - last_hb).total_seconds() / 60
+        if minutes_since > 10:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="agent_offline",
+            )
+
+    return agent
+
+
+def _order_input(order: OrderRequest) -> dict:
+    return {
+        "symbol": order.symbol,
+        "side": order.side,
+        "volume": order.volume,
+        "sl_pips": order.sl_pips,
+        "tp_pips": order.tp_pips,
+    }
+
+
+@router.post("/orders", response_model=OrderResponse)
+async def place_order(
+    request: OrderRequest,
+    current_user: AuthenticatedUser = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+) -> OrderResponse:
+    """
+    Place a manual trading order.
+
+    Retrying with the same Idempotency-Key returns the original order
+    instead of sending another one to the agent.
+    """
+    supabase = get_supabase_client()
+    user_id = current_user.id
+
+    _validate_idempotency_key(idempotency_key)
+    _require_online_agent(supabase, user_id)
 
     # Check margin (simplified)
     account = (
@@ -117,52 +246,30 @@ async def place_order(
     # For demo, allow all orders
 
     # Create trade job
-    job_response = (
-        supabase.table("jobs")
-        .insert(
-            {
-                "user_id": user_id,
-                "job_type": "trade",
-                "input_data": {
-                    "symbol": request.symbol,
-                    "side": request.side,
-                    "volume": request.volume,
-                    "sl_pips": request.sl_pips,
-                    "tp_pips": request.tp_pips,
-                },
-                "status": "pending",
-            }
-        )
-        .execute()
+    job = await _enqueue_order_job(
+        user_id,
+        "trade",
+        _order_input(request),
+        f"order:{idempotency_key}" if idempotency_key else None,
     )
-
-    job_id = job_response.data[0]["id"]
+    job_id = job["id"]
 
     # Wait for job completion (up to 10s)
-    for _ in range(20):  # 20 * 0.5s = 10s
-        await asyncio.sleep(0.5)
-        job = (
-            supabase.table("jobs")
-            .select("status, output_data")
-            .eq("id", job_id)
-            .execute()
+    result = await job_results.wait(job_id, timeout=10)
+
+    if result:
+        if result["status"] == "completed":
+            output = result.get("output_data") or {}
+            return OrderResponse(
+                order_id=job_id,
+                fill_price=output.get("fill_price"),
+                status="filled",
+            )
+        return OrderResponse(
+            order_id=job_id,
+            status="error",
         )
 
-        if job.data:
-            job_status = job.data[0]["status"]
-            if job_status == "completed":
-                output = job.data[0].get("output_data", {})
-                return OrderResponse(
-                    order_id=job_id,
-                    fill_price=output.get("fill_price"),
-                    status="filled",
-                )
-            elif job_status == "failed":
-                return OrderResponse(
-                    order_id=job_id,
-                    status="error",
-                )
-
     # Timeout - still pending
     return OrderResponse(
         order_id=job_id,
@@ -170,11 +277,111 @@ async def place_order(
     )
 
 
+@router.post("/orders/batch", response_model=BatchOrderResponse)
+async def place_order_batch(
+    request: BatchOrderRequest,
+    current_user: AuthenticatedUser = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+) -> BatchOrderResponse:
+    """
+    Place a basket of market orders in one agent round trip.
+
+    The orders are validated together and sent as a single trade_batch job;
+    the agent submits them back-to-back and reports a fill per order, in
+    request order.
+    """
+    supabase = get_supabase_client()
+    user_id = current_user.id
+
+    _validate_idempotency_key(idempotency_key)
+
+    for index, order in enumerate(request.orders):
+        if order.side not in ORDER_SIDES or order.volume <= 0:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"invalid_order:{index}",
+            )
+
+    _require_online_agent(supabase, user_id)
+
+    job = await _enqueue_order_job(
+        user_id,
+        "trade_batch",
+        {"orders": [_order_input(order) for order in request.orders]},
+        f"order_batch:{idempotency_key}" if idempotency_key else None,
+    )
+    job_id = job["id"]
+
+    result = await job_results.wait(job_id, timeout=10)
+
+    if not result:
+        return BatchOrderResponse(
+            batch_id=job_id,
+            status="pending",
+            orders=[
+                BatchOrderFill(
+                    symbol=order.symbol,
+                    side=order.side,
+                    volume=order.volume,
+                    status="pending",
+                )
+                for order in request.orders
+            ],
+        )
+
+    legs = (result.get("output_data") or {}).get("orders") or []
+    fills = []
+    for index, order in enumerate(request.orders):
+        leg = legs[index] if index < len(legs) else {}
+        fills.append(
+            BatchOrderFill(
+                symbol=order.symbol,
+                side=order.side,
+                volume=order.volume,
+                status=BATCH_LEG_STATUSES.get(leg.get("status"), "error"),
+                order_id=leg.get("order_id"),
+                fill_price=leg.get("fill_price"),
+                error=leg.get("error_message") or result.get("error_message"),
+            )
+        )
+
+    filled = sum(1 for fill in fills if fill.status == "filled")
+    if filled == len(fills):
+        batch_status = "filled"
+    elif filled:
+        batch_status = "partial"
+    else:
+        batch_status = "error"
+
+    return BatchOrderResponse(batch_id=job_id, status=batch_status, orders=fills)
+
+
+def _set_state_headers(response: Response, source: str, updated_at: float):
+    response.headers["X-State-Source"] = source
+    response.headers["X-State-Updated-At"] = datetime.fromtimestamp(
+        updated_at, timezone.utc
+    ).isoformat()
+
+
 @router.get("/positions", response_model=List[Position])
 async def get_positions(
+    response: Response,
+    refresh: bool = False,
     current_user: AuthenticatedUser = Depends(get_current_user),
 ) -> list:
-    """Get open positions."""
+    """
+    Get open positions.
+
+    Served from the agent-pushed snapshot (X-State-Source: cache, with its
+    X-State-Updated-At); `refresh=true` or a missing snapshot asks the agent
+    through a get_positions job instead.
+    """
+    if not refresh:
+        state = await get_account_state(current_user.id)
+        if state is not None:
+            _set_state_headers(response, "cache", state["updated_at"])
+            return state["positions"]
+
     supabase = get_supabase_client()
 
     # Find connected agent
@@ -189,41 +396,15 @@ async def get_positions(
     if not agents.data:
         return []
 
-    # Create job
-    job_response = (
-        supabase.table("jobs")
-        .insert(
-            {
-                "user_id": current_user.id,
-                "job_type": "get_positions",
-                "input_data": {},
-                "status": "pending",
-            }
-        )
-        .execute()
-    )
+    # Run (or join an identical in-flight) job and wait up to 5s
+    result = await run_read_job(current_user.id, "get_positions", {}, timeout=5)
 
-    job_id = job_response.data[0]["id"]
-
-    # Poll for completion (up to 5s)
-    for _ in range(10):  # 10 * 0.5s = 5s
-        await asyncio.sleep(0.5)
-        job = (
-            supabase.table("jobs")
-            .select("status, output_data")
-            .eq("id", job_id)
-            .execute()
-        )
+    if result and result["status"] == "completed":
+        output = result.get("output_data") or {}
+        _set_state_headers(response, "agent", time.time())
+        return output.get("positions", [])
 
-        if job.data:
-            job_status = job.data[0]["status"]
-            if job_status == "completed":
-                output = job.data[0].get("output_data", {})
-                return output.get("positions", [])
-            elif job_status == "failed":
-                return []
-
-    # Timeout
+    # Failed or timed out
     return []
 
 
@@ -233,59 +414,140 @@ async def close_position(
     current_user: AuthenticatedUser = Depends(get_current_user),
 ) -> dict:
     """Close a position."""
-    supabase = get_supabase_client()
-
     # Create close job
-    job_response = (
-        supabase.table("jobs")
-        .insert(
-            {
-                "user_id": current_user.id,
-                "job_type": "close_position",
-                "input_data": {"ticket": position_id},
-                "status": "pending",
+    job = await enqueue_job(
+        current_user.id,
+        "close_position",
+        {"ticket": position_id},
+    )
+    job_id = job["id"]
+
+    # Wait for completion (up to 10s)
+    result = await job_results.wait(job_id, timeout=10)
+
+    if result:
+        if result["status"] == "completed":
+            output = result.get("output_data") or {}
+            return {
+                "closed_price": output.get("closed_price"),
+                "pnl": output.get("pnl"),
             }
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Failed to close position",
         )
-        .execute()
+
+    raise HTTPException(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        detail="Position close timeout",
     )
 
-    job_id = job_response.data[0]["id"]
 
-    # Wait for completion
-    for _ in range(20):
-        await asyncio.sleep(0.5)
-        job = (
-            supabase.table("jobs")
-            .select("status, output_data")
-            .eq("id", job_id)
-            .execute()
+@router.post("/positions/close", response_model=ClosePositionsResponse)
+async def close_positions(
+    request: ClosePositionsRequest,
+    current_user: AuthenticatedUser = Depends(get_current_user),
+) -> ClosePositionsResponse:
+    """
+    Close every open position matching the filters in one agent job.
+
+    Filters (symbol, side, magic) combine; `all` must be set explicitly to
+    flatten the whole account. The agent closes the matches back-to-back
+    from a single positions snapshot.
+    """
+    has_filter = request.symbol or request.side or request.magic is not None
+    if not request.all and not has_filter:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="close_filter_required",
+        )
+    if request.side is not None and request.side not in ORDER_SIDES:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="invalid_side",
         )
 
-        if job.data:
-            job_status = job.data[0]["status"]
-            if job_status == "completed":
-                output = job.data[0].get("output_data", {})
-                return {
-                    "closed_price": output.get("closed_price"),
-                    "pnl": output.get("pnl"),
-                }
-            elif job_status == "failed":
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Failed to close position",
-                )
+    _require_online_agent(get_supabase_client(), current_user.id)
 
-    raise HTTPException(
-        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
-        detail="Position close timeout",
+    job = await enqueue_job(
+        current_user.id,
+        "close_positions",
+        {
+            "symbol": request.symbol,
+            "side": request.side,
+            "magic": request.magic,
+        },
+    )
+    job_id = job["id"]
+
+    result = await job_results.wait(job_id, timeout=10)
+
+    if not result:
+        return ClosePositionsResponse(
+            batch_id=job_id,
+            status="pending",
+            closed=0,
+            failed=0,
+            total_pnl=0.0,
+            positions=[],
+        )
+
+    output = result.get("output_data") or {}
+    positions = [
+        ClosedPosition(
+            ticket=str(leg.get("ticket")),
+            symbol=leg.get("symbol", ""),
+            side=leg.get("side", ""),
+            volume=leg.get("volume", 0.0),
+            status=CLOSE_LEG_STATUSES.get(leg.get("status"), "error"),
+            closed_price=leg.get("closed_price"),
+            pnl=leg.get("pnl"),
+            error=leg.get("error_message"),
+        )
+        for leg in output.get("positions") or []
+    ]
+
+    closed = sum(1 for position in positions if position.status == "closed")
+    failed = len(positions) - closed
+    if result["status"] != "completed" and not positions:
+        batch_status = "error"
+    elif not failed:
+        batch_status = "closed"
+    elif closed:
+        batch_status = "partial"
+    else:
+        batch_status = "error"
+
+    return ClosePositionsResponse(
+        batch_id=job_id,
+        status=batch_status,
+        closed=closed,
+        failed=failed,
+        total_pnl=sum(
+            position.pnl or 0.0 for position in positions if position.status == "closed"
+        ),
+        positions=positions,
     )
 
 
 @router.get("/account", response_model=AccountInfo)
 async def get_account(
+    response: Response,
+    refresh: bool = False,
     current_user: AuthenticatedUser = Depends(get_current_user),
 ) -> AccountInfo:
-    """Get account information."""
+    """
+    Get account information.
+
+    Served from the agent-pushed snapshot unless `refresh=true` or no
+    snapshot exists; see get_positions.
+    """
+    if not refresh:
+        state = await get_account_state(current_user.id)
+        if state is not None:
+            _set_state_headers(response, "cache", state["updated_at"])
+            return AccountInfo(**state["account"])
+
     supabase = get_supabase_client()
 
     # Find connected agent
@@ -303,113 +565,232 @@ async def get_account(
             detail="agent_offline",
         )
 
-    # Create job
-    job_response = (
-        supabase.table("jobs")
-        .insert(
-            {
-                "user_id": current_user.id,
-                "job_type": "get_account",
-                "input_data": {},
-                "status": "pending",
-            }
-        )
-        .execute()
-    )
-
-    job_id = job_response.data[0]["id"]
-
-    # Poll for completion (up to 5s)
-    for _ in range(10):  # 10 * 0.5s = 5s
-        await asyncio.sleep(0.5)
-        job = (
-            supabase.table("jobs")
-            .select("status, output_data")
-            .eq("id", job_id)
-            .execute()
+    # Run (or join an identical in-flight) job and wait up to 5s
+    result = await run_read_job(current_user.id, "get_account", {}, timeout=5)
+
+    if result:
+        if result["status"] == "completed":
+            output = result.get("output_data") or {}
+            _set_state_headers(response, "agent", time.time())
+            return AccountInfo(
+                balance=output.get("balance", 0.0),
+                equity=output.get("equity", 0.0),
+                margin_used=output.get("margin_used", 0.0),
+                margin_available=output.get("margin_available", 0.0),
+                currency=output.get("currency", "USD"),
+                leverage=output.get("leverage", 100),
+            )
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="agent_error",
         )
 
-        if job.data:
-            job_status = job.data[0]["status"]
-            if job_status == "completed":
-                output = job.data[0].get("output_data", {})
-                return AccountInfo(
-                    balance=output.get("balance", 0.0),
-                    equity=output.get("equity", 0.0),
-                    margin_used=output.get("margin_used", 0.0),
-                    margin_available=output.get("margin_available", 0.0),
-                    currency=output.get("currency", "USD"),
-                    leverage=output.get("leverage", 100),
-                )
-            elif job_status == "failed":
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail="agent_error",
-                )
-
     raise HTTPException(
         status_code=status.HTTP_504_GATEWAY_TIMEOUT,
         detail="Account info timeout",
     )
 
 
-@router.get("/candles/{instrument}", response_model=List[Candle])
+@router.get(
+    "/candles/{instrument}",
+    responses={200: {"model": Union[CandleColumns, List[Candle]]}},
+)
 async def get_candles(
     instrument: str,
     timeframe: str = "H1",
     count: int = 200,
+    include_forming: bool = True,
+    candle_format: str = Query("columns", alias="format"),
+    range_from: Optional[int] = Query(None, alias="from"),
+    range_to: Optional[int] = Query(None, alias="to"),
+    before: Optional[int] = None,
     current_user: AuthenticatedUser = Depends(get_current_user),
-) -> List[Candle]:
-    """Get OHLCV candles for instrument."""
-    redis = await get_redis()
+) -> JSONResponse:
+    """
+    Get OHLCV candles for instrument.
+
+    By default the latest `count` bars, served from the tick-built candle
+    buffers when they hold them, otherwise assembled from the closed-bar
+    segment cache, which an agent backfill refills when a segment is
+    missing. With include_forming=false only closed bars are returned and
+    the response is cacheable until the forming bar closes.
+
+    For scrolling back, `from`/`to` select closed bars by open time and
+    `before` returns the `count` closed bars opening before it (times in
+    broker server epoch seconds, as in the t column). X-Candles-Next-Before
+    is the cursor for the next older page; historical pages are immutable.
+
+    The body is columnar (CandleColumns) unless format=rows asks for the
+    older list of Candle objects.
+    """
+    settings = get_settings()
+
+    if timeframe not in TIMEFRAME_SECONDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="unsupported_timeframe",
+        )
+    if not 0 < count <= settings.CANDLE_MAX_PAGE_BARS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="invalid_count",
+        )
+    if candle_format not in CANDLE_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="unsupported_format",
+        )
 
-    # Check cache
-    cache_key = f"candles:{instrument}:{timeframe}"
-    cached = await redis.get(cache_key)
+    if range_from is not None or range_to is not None or before is not None:
+        return await _get_candle_history(
+            current_user.id,
+            instrument,
+            timeframe,
+            count,
+            candle_format,
+            range_from,
+            range_to,
+            before,
+        )
 
-    if cached:
-        return json.loads(cached)
+    # The forming bar is dropped below, so ask for one more
+    wanted = count + (0 if include_forming else 1)
+
+    if wanted <= settings.CANDLE_BUFFER_SIZE:
+        fresh = candle_aggregator.is_fresh(instrument, timeframe, wanted)
+        if not fresh:
+            # Served straight from the backfill if seeding does not take
+            backfill = max(wanted, settings.CANDLE_BACKFILL_COUNT)
+            bars, server_offset = await fetch_candle_bars(
+                current_user.id, instrument, timeframe, backfill
+            )
+            if bars:
+                candle_aggregator.seed(
+                    instrument, timeframe, bars, backfill, server_offset
+                )
+                fresh = candle_aggregator.is_fresh(instrument, timeframe, wanted)
+
+        if fresh:
+            bars = candle_aggregator.get(instrument, timeframe, wanted)
+            server_offset = candle_aggregator.server_offsets.get(instrument, 0)
+    else:
+        bars, server_offset = await fetch_candle_bars(
+            current_user.id, instrument, timeframe, wanted
+        )
 
-    # Create job to get candles
-    supabase = get_supabase_client()
+    forming_at = forming_open_time(timeframe, server_offset)
+    closed = [bar for bar in bars if bar[OPEN_TIME] < forming_at]
+    headers = {}
 
-    job_response = (
-        supabase.table("jobs")
-        .insert(
-            {
-                "user_id": current_user.id,
-                "job_type": "get_candles",
-                "input_data": {
-                    "symbol": instrument,
-                    "timeframe": timeframe,
-                    "count": count,
-                },
-                "status": "pending",
-            }
+    if closed:
+        headers["X-Candles-Closed-Through"] = bar_to_candle(closed[-1])["time"]
+
+    if include_forming or not bars:
+        # An empty answer is a failed backfill, not a closed market
+        headers["Cache-Control"] = "no-store"
+        bars = bars[-count:]
+    else:
+        headers["Cache-Control"] = _closed_bars_cache_control(
+            timeframe, forming_at, server_offset
         )
-        .execute()
-    )
+        bars = closed[-count:]
 
-    job_id = job_response.data[0]["id"]
+    if bars:
+        headers["X-Candles-Next-Before"] = str(bars[0][OPEN_TIME])
 
-    # Wait for completion (up to 10s)
-    for _ in range(20):
-        await asyncio.sleep(0.5)
-        job = (
-            supabase.table("jobs")
-            .select("status, output_data")
-            .eq("id", job_id)
-            .execute()
+    return _candles_response(bars, candle_format, headers)
+
+
+async def _get_candle_history(
+    user_id: str,
+    instrument: str,
+    timeframe: str,
+    count: int,
+    candle_format: str,
+    range_from: Optional[int],
+    range_to: Optional[int],
+    before: Optional[int],
+) -> JSONResponse:
+    """Closed bars by time range or before a cursor."""
+    settings = get_settings()
+    seconds = TIMEFRAME_SECONDS[timeframe]
+
+    if before is not None:
+        if range_from is not None or range_to is not None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="before_with_range",
+            )
+        bars, server_offset, complete = await fetch_candles_before(
+            user_id, instrument, timeframe, before, count
+        )
+        end = before
+        # A short page is the end of history only if the agent said so
+        has_older = bars is not None and (len(bars) == count or not complete)
+    else:
+        if range_from is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="from_required",
+            )
+        # Without `to`, one full page forward from `from` (clamped to now)
+        if range_to is None:
+            end = range_from + settings.CANDLE_MAX_PAGE_BARS * seconds
+        else:
+            end = range_to + 1
+        if end <= range_from:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="invalid_range",
+            )
+        if (end - range_from) // seconds > settings.CANDLE_MAX_PAGE_BARS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="range_too_large",
+            )
+        bars, server_offset, complete = await fetch_candle_range(
+            user_id, instrument, timeframe, range_from, end
+        )
+        has_older = True
+
+    forming_at = forming_open_time(timeframe, server_offset)
+    headers = {}
+
+    if bars is None:
+        # The agent did not answer: nothing here may be cached
+        headers["Cache-Control"] = "no-store"
+        return _candles_response([], candle_format, headers)
+
+    if not complete:
+        # Older bars the agent did not vouch for may still fill in
+        headers["Cache-Control"] = "no-store"
+    elif end <= forming_at:
+        # Entirely closed history: never changes
+        headers["Cache-Control"] = (
+            f"private, max-age={settings.CANDLE_SEGMENT_TTL_SECONDS}, immutable"
+        )
+    else:
+        headers["Cache-Control"] = _closed_bars_cache_control(
+            timeframe, forming_at, server_offset
         )
 
-        if job.data and job.data[0]["status"] == "completed":
-            output = job.data[0].get("output_data", {})
-            candles = output.get("candles", [])
+    if bars:
+        headers["X-Candles-Closed-Through"] = bar_to_candle(bars[-1])["time"]
+        if has_older:
+            headers["X-Candles-Next-Before"] = str(bars[0][OPEN_TIME])
 
-            # Cache for 30s
-            await redis.setex(cache_key, 30, json.dumps(candles))
+    return _candles_response(bars, candle_format, headers)
 
-            return candles
 
-    # Return empty array on timeout instead of mock data
-    return []
+def _closed_bars_cache_control(timeframe: str, forming_at: int, server_offset: int) -> str:
+    # Closed bars only change when the forming bar closes
+    closes_in = forming_at + TIMEFRAME_SECONDS[timeframe] - (time.time() + server_offset)
+    return f"private, max-age={max(int(closes_in), 0)}"
+
+
+def _candles_response(bars: List[list], candle_format: str, headers: dict) -> JSONResponse:
+    # Returned directly: validating thousands of rows through the response
+    # model would cost more than building them
+    if candle_format == "rows":
+        return JSONResponse([bar_to_candle(bar) for bar in bars], headers=headers)
+    return JSONResponse(bars_to_columns(bars), headers=headers)
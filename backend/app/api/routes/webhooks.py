@@ -3,13 +3,79 @@ Webhook Routes
 TradingView Webhook Receiver
 """
 
+import hashlib
+import json
+import time
 from fastapi import APIRouter, HTTPException, Request, status
 from pydantic import BaseModel
+from app.core.redis import get_redis
 from app.core.supabase import get_supabase_client
+from app.services.jobs import enqueue_job
 
 
 router = APIRouter()
 
+# Alerts without their own id or timestamp are treated as duplicates when
+# an identical body arrives within this window (TradingView redelivery)
+TV_SIGNAL_DEDUP_WINDOW_SECONDS = 60
+TV_SIGNAL_RECENT_PREFIX = "tv_signals:recent:"
+
+
+def _is_untimed(payload: dict) -> bool:
+    """An alert with neither its own id nor a timestamp."""
+    return not (
+        payload.get("idempotency_key")
+        or payload.get("alert_id")
+        or "time" in payload
+        or "timenow" in payload
+    )
+
+
+def signal_idempotency_key(strategy_id: str, body: bytes, payload: dict) -> str:
+    """
+    Derive the trade job idempotency key for a TradingView alert.
+
+    Uses the alert's own `idempotency_key` / `alert_id` when present,
+    otherwise a hash of the raw body - bucketed by time unless the alert
+    carries `time` / `timenow`, so a repeated strategy signal on a later
+    bar still trades.
+    """
+    explicit = payload.get("idempotency_key") or payload.get("alert_id")
+    if explicit:
+        return f"tv:{strategy_id}:{explicit}"
+
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    if _is_untimed(payload):
+        digest += f":{int(time.time() // TV_SIGNAL_DEDUP_WINDOW_SECONDS)}"
+
+    return f"tv:{strategy_id}:{digest}"
+
+
+async def seen_recently(strategy_id: str, body: bytes, payload: dict) -> bool:
+    """
+    Whether an identical untimed alert arrived in the last
+    TV_SIGNAL_DEDUP_WINDOW_SECONDS.
+
+    The idempotency key's time bucket misses a redelivery that crosses a
+    bucket boundary; this SET NX on the plain body hash does not. If Redis
+    is down, the bucketed key still catches most redeliveries.
+    """
+    if not _is_untimed(payload):
+        return False
+
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    try:
+        redis = await get_redis()
+        first = await redis.set(
+            f"{TV_SIGNAL_RECENT_PREFIX}{strategy_id}:{digest}",
+            1,
+            nx=True,
+            ex=TV_SIGNAL_DEDUP_WINDOW_SECONDS,
+        )
+    except Exception:
+        return False
+    return not first
+
 
 @router.post("/tv/{webhook_secret}")
 async def receive_tv_webhook(webhook_secret: str, request: Request):
@@ -45,10 +111,13 @@ async def receive_tv_webhook(webhook_secret: str, request: Request):
         return {"status": "ok"}
 
     # Parse payload
+    body = await request.body()
     try:
-        payload = await request.json()
+        payload = json.loads(body)
     except Exception:
         payload = {}
+    if not isinstance(payload, dict):
+        payload = {}
 
     symbol = payload.get("symbol")
     action = payload.get("action", "").lower()
@@ -129,20 +198,29 @@ async def receive_tv_webhook(webhook_secret: str, request: Request):
 
     signal_id = signal_response.data[0]["id"]
 
-    # Create trade job
-    supabase.table("jobs").insert(
+    if await seen_recently(strategy["id"], body, payload):
+        supabase.table("tv_signals").update(
+            {"status": "discarded", "error_message": "duplicate_signal"}
+        ).eq("id", signal_id).execute()
+        return {"status": "ok"}
+
+    # Create trade job (a redelivered alert maps to the original job)
+    job = await enqueue_job(
+        user_id,
+        "trade",
         {
-            "user_id": user_id,
-            "job_type": "trade",
-            "input_data": {
-                "symbol": symbol,
-                "side": action,
-                "volume": volume,
-                "source": "tv_signal",
-                "signal_id": signal_id,
-            },
-            "status": "pending",
-        }
-    ).execute()
+            "symbol": symbol,
+            "side": action,
+            "volume": volume,
+            "source": "tv_signal",
+            "signal_id": signal_id,
+        },
+        idempotency_key=signal_idempotency_key(strategy["id"], body, payload),
+    )
+
+    if job and job.get("replayed"):
+        supabase.table("tv_signals").update(
+            {"status": "discarded", "error_message": "duplicate_signal"}
+        ).eq("id", signal_id).execute()
 
     return {"status": "ok"}
@@ -1,21 +1,207 @@
 """
 MT5 Agent Authentication
-Verifies agent pairing keys via X-Agent-Key header
+Verifies agent pairing keys via X-Agent-Key header and issues short-lived
+HMAC session tokens (X-Agent-Session) so the bcrypt check runs once per session
 """
-from typing import Optional
+import base64
+import hashlib
+import hmac
+import time
+from typing import Dict, Optional, Tuple
 from fastapi import Depends, HTTPException, status, Header
 from pydantic import BaseModel
 from app.core.config import get_settings
 from app.core.supabase import get_supabase_client
 
 
+SESSION_TOKEN_VERSION = "v2"
+SESSION_GENERATIONS_KEY = "agent_sessions:generation"
+REVOKED_SESSIONS_KEY = "agent_sessions:revoked"
+
+
 class AgentRecord(BaseModel):
     """MT5 Agent record."""
     id: str
     user_id: str
-    pairing_key_hash: str
-    pairing_key_prefix: str
-    is_connected: bool
+    pairing_key_hash: Optional[str] = None
+    pairing_key_prefix: Optional[str] = None
+    is_connected: bool = True
+
+
+# Cached deny-list: agent_id -> current session generation.
+# Each revoke bumps the generation; sessions minted under an older one
+# are rejected.
+_revoked_cache: Dict[str, int] = {}
+_revoked_cache_loaded_at: float = 0.0
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _session_secret() -> bytes:
+    """
+    The agent session signing key: AGENT_SESSION_SECRET, else a key derived
+    from the Supabase JWT secret for this purpose only, so an agent token
+    and a user JWT are never signed with the same key.
+    """
+    settings = get_settings()
+    if settings.AGENT_SESSION_SECRET:
+        return settings.AGENT_SESSION_SECRET.encode("utf-8")
+
+    if not settings.SUPABASE_JWT_SECRET:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Agent session secret not configured",
+        )
+    return hmac.new(
+        settings.SUPABASE_JWT_SECRET.encode("utf-8"), b"agent-session", hashlib.sha256
+    ).digest()
+
+
+def _sign(payload: bytes) -> bytes:
+    return hmac.new(_session_secret(), payload, hashlib.sha256).digest()
+
+
+async def issue_agent_session(agent: AgentRecord) -> Tuple[str, int]:
+    """
+    Issue a signed session token for an agent.
+
+    Token format: v2.<base64url(agent_id:user_id:gen:iat:exp)>.<base64url(hmac)>
+    where gen is the agent's session generation at issue time.
+
+    Returns:
+        (token, expires_at epoch seconds)
+    """
+    from app.core.redis import get_redis
+
+    settings = get_settings()
+    issued_at = int(time.time())
+    expires_at = issued_at + settings.AGENT_SESSION_TTL_SECONDS
+
+    redis = await get_redis()
+    generation = int(await redis.hget(SESSION_GENERATIONS_KEY, agent.id) or 0)
+
+    payload = (
+        f"{agent.id}:{agent.user_id}:{generation}:{issued_at}:{expires_at}"
+    ).encode("utf-8")
+    token = f"{SESSION_TOKEN_VERSION}.{_b64encode(payload)}.{_b64encode(_sign(payload))}"
+    return token, expires_at
+
+
+async def _load_revocations() -> Dict[str, int]:
+    """Refresh the in-process deny-list from Redis at most every few seconds."""
+    global _revoked_cache, _revoked_cache_loaded_at
+
+    settings = get_settings()
+    now = time.monotonic()
+    if now - _revoked_cache_loaded_at < settings.AGENT_REVOCATION_REFRESH_SECONDS:
+        return _revoked_cache
+
+    from app.core.redis import get_redis
+
+    try:
+        redis = await get_redis()
+        entries = await redis.hgetall(SESSION_GENERATIONS_KEY)
+        _revoked_cache = {agent_id: int(gen) for agent_id, gen in entries.items()}
+    except Exception:
+        # Keep serving the last known deny-list if Redis is unavailable
+        pass
+
+    _revoked_cache_loaded_at = now
+    return _revoked_cache
+
+
+async def revoke_agent_sessions(agent_id: str) -> None:
+    """
+    Revoke every session issued to an agent and its pairing key.
+
+    Bumping the session generation invalidates outstanding tokens;
+    clearing the key hash stops the agent from opening a new session, so
+    it has to be paired again.
+    """
+    from app.core.redis import get_redis
+
+    settings = get_settings()
+    now = int(time.time())
+
+    supabase = get_supabase_client()
+    supabase.table("mt5_agents").update(
+        {"pairing_key_hash": None, "is_connected": False}
+    ).eq("id", agent_id).execute()
+
+    redis = await get_redis()
+    generation = await redis.hincrby(SESSION_GENERATIONS_KEY, agent_id, 1)
+    await redis.zadd(REVOKED_SESSIONS_KEY, {agent_id: now})
+
+    # Once every token of the old generation has expired the entry is moot:
+    # the key is gone, so no newer session can exist. Prune to keep it small.
+    stale = await redis.zrangebyscore(
+        REVOKED_SESSIONS_KEY, 0, now - settings.AGENT_SESSION_TTL_SECONDS
+    )
+    if stale:
+        await redis.hdel(SESSION_GENERATIONS_KEY, *stale)
+        await redis.zrem(REVOKED_SESSIONS_KEY, *stale)
+
+    _revoked_cache[agent_id] = generation
+
+
+async def verify_agent_session(
+    token: str,
+    agent_id: Optional[str] = None,
+) -> AgentRecord:
+    """
+    Verify an agent session token.
+
+    Constant-time HMAC comparison with no database access; revocation is
+    checked against the cached deny-list.
+    """
+    invalid = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid agent session",
+    )
+
+    try:
+        version, payload_b64, signature_b64 = token.split(".")
+        payload = _b64decode(payload_b64)
+        signature = _b64decode(signature_b64)
+    except Exception:
+        raise invalid
+
+    if version != SESSION_TOKEN_VERSION or not hmac.compare_digest(
+        signature, _sign(payload)
+    ):
+        raise invalid
+
+    try:
+        session_agent_id, user_id, generation, issued_at, expires_at = (
+            payload.decode("utf-8").split(":")
+        )
+        generation, expires_at = int(generation), int(expires_at)
+    except ValueError:
+        raise invalid
+
+    if expires_at <= time.time():
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Agent session expired",
+        )
+
+    if agent_id and agent_id != session_agent_id:
+        raise invalid
+
+    revoked = await _load_revocations()
+    if generation < revoked.get(session_agent_id, 0):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Agent session revoked",
+        )
+
+    return AgentRecord(id=session_agent_id, user_id=user_id)
 
 
 async def verify_agent_key(
@@ -24,46 +210,51 @@ async def verify_agent_key(
 ) -> AgentRecord:
     """
     Verify agent key from X-Agent-Key header.
-    
+
     Looks up the agent by agent_id (if provided) and verifies the key
     using bcrypt hash comparison.
     """
     from passlib.hash import bcrypt
-    
+
     supabase = get_supabase_client()
     settings = get_settings()
-    
+
     # If agent_id provided, look up directly
     if agent_id:
         response = supabase.table("mt5_agents").select("*").eq("id", agent_id).execute()
-        
+
         if not response.data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Agent not found",
             )
-        
+
         agent = response.data[0]
-        
+
         # Verify the key matches (support both raw key and hash for backward compat)
-        stored_hash = agent.get("pairing_key_hash", "")
-        
+        stored_hash = agent.get("pairing_key_hash")
+        if not stored_hash:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Agent key revoked",
+            )
+
         # Try bcrypt verification first
         try:
             if bcrypt.verify(x_agent_key, stored_hash):
                 return AgentRecord(**agent)
         except Exception:
             pass
-        
+
         # Fallback: plain text comparison (temporary, remove after migration)
         if stored_hash == x_agent_key:
             return AgentRecord(**agent)
-        
+
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid agent key",
         )
-    
+
     # If no agent_id, we need to find the agent by key prefix
     # This is used for initial pairing - search all agents
     raise HTTPException(
@@ -73,8 +264,23 @@ async def verify_agent_key(
 
 
 async def get_current_agent(
-    x_agent_key: str = Header(..., alias="X-Agent-Key"),
+    x_agent_session: Optional[str] = Header(None, alias="X-Agent-Session"),
+    x_agent_key: Optional[str] = Header(None, alias="X-Agent-Key"),
     x_agent_id: Optional[str] = Header(None, alias="X-Agent-Id"),
 ) -> AgentRecord:
-    """FastAPI dependency to get current authenticated agent."""
+    """
+    FastAPI dependency to get current authenticated agent.
+
+    Prefers the HMAC session token; falls back to the bcrypt pairing key for
+    agents that have not yet opened a session.
+    """
+    if x_agent_session:
+        return await verify_agent_session(x_agent_session, x_agent_id)
+
+    if not x_agent_key:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Agent credentials required",
+        )
+
     return await verify_agent_key(x_agent_key, x_agent_id)
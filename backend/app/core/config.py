@@ -43,6 +43,69 @@ class Settings(BaseSettings):
     # Base URL for webhook construction
     BASE_URL: str = "http://localhost:8000"
 
+    # MT5 agent sessions (when unset, a key derived from SUPABASE_JWT_SECRET)
+    AGENT_SESSION_SECRET: str = ""
+    AGENT_SESSION_TTL_SECONDS: int = 900
+    AGENT_REVOCATION_REFRESH_SECONDS: int = 5
+
+    # Bearer token Prometheus sends to GET /metrics; unset, it is not served
+    METRICS_TOKEN: str = ""
+
+    # Job queue backend: "postgres", "redis" (hot queue + Postgres record)
+    # or "memory" (local stand-in without Supabase)
+    JOB_QUEUE_BACKEND: str = "postgres"
+    JOB_QUEUE_VISIBILITY_TIMEOUT_SECONDS: int = 120
+
+    # Job outputs larger than this are kept in Redis, not jobs.output_data
+    JOB_OUTPUT_INLINE_MAX_BYTES: int = 8192
+    JOB_OUTPUT_TTL_SECONDS: int = 600
+
+    # Idempotency-Key -> job id fast path; the unique index outlives it
+    JOB_IDEMPOTENCY_TTL_SECONDS: int = 86400
+
+    # Agent job long-poll
+    JOB_LONG_POLL_SECONDS: int = 25
+    JOB_SWEEP_INTERVAL_SECONDS: int = 30
+
+    # Finished jobs move to jobs_archive after this many days
+    JOB_ARCHIVE_AFTER_DAYS: int = 7
+    JOB_ARCHIVE_INTERVAL_SECONDS: int = 3600
+
+    # Coalesced read jobs (get_positions / get_account / get_candles): result
+    # cache, and the in-flight lease, renewed by its holder while the job runs
+    READ_JOB_RESULT_TTL_SECONDS: int = 2
+    READ_JOB_LEASE_SECONDS: int = 5
+
+    # Agent-pushed account/positions snapshot; the agent re-sends at least
+    # every 20 s, so a missing key means the agent has gone quiet
+    ACCOUNT_STATE_TTL_SECONDS: int = 60
+
+    # Tick-driven unrealized P&L engine (the only tick repricing path); it
+    # runs in whichever worker holds the leader lease
+    PNL_ENGINE_ENABLED: bool = True
+    PNL_PUBLISH_INTERVAL_SECONDS: float = 0.5
+    PNL_LEADER_LEASE_SECONDS: int = 5
+
+    # Tick-built candles: ring size per instrument/timeframe, bars requested
+    # in the one-off agent backfill, and how long a seed stays valid for an
+    # instrument that is not ticking
+    CANDLE_BUFFER_SIZE: int = 2000
+    CANDLE_BACKFILL_COUNT: int = 500
+    CANDLE_STALE_SECONDS: int = 30
+
+    # Closed-bar cache: bars per immutable Redis segment, how long closed
+    # segments live, and the TTL of the separately cached forming bar
+    CANDLE_SEGMENT_BARS: int = 500
+    CANDLE_SEGMENT_TTL_SECONDS: int = 7 * 24 * 3600
+    CANDLE_FORMING_TTL_SECONDS: int = 5
+    # Most bars one candle request (count, from/to range or page) may return
+    CANDLE_MAX_PAGE_BARS: int = 5000
+
+    # On-disk candle store (app.services.candle_store); empty disables it.
+    # Mount a volume here to keep history across deploys
+    CANDLE_STORE_DIR: str = "data/candles"
+    CANDLE_STORE_FLUSH_SECONDS: float = 5.0
+
 
 @lru_cache
 def get_settings() -> Settings:
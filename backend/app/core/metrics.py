@@ -0,0 +1,130 @@
+"""
+Prometheus Metrics
+Job pipeline instrumentation exposed on GET /metrics
+"""
+import os
+from datetime import datetime
+from typing import Optional
+from prometheus_client import (
+    CollectorRegistry,
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+)
+
+
+# Agent jobs span milliseconds (long-poll dispatch) to minutes (compile)
+JOB_LATENCY_BUCKETS = (
+    0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800,
+)
+
+JOBS_ENQUEUED = Counter(
+    "forexelite_jobs_enqueued_total",
+    "Jobs inserted into the queue",
+    ["job_type"],
+)
+
+JOBS_DEDUPLICATED = Counter(
+    "forexelite_jobs_deduplicated_total",
+    "Enqueues answered with an existing job for the same idempotency key",
+    ["job_type"],
+)
+
+JOB_ENQUEUE_SECONDS = Histogram(
+    "forexelite_job_enqueue_seconds",
+    "Time to insert a job and publish its wakeup",
+    ["job_type"],
+    buckets=JOB_LATENCY_BUCKETS,
+)
+
+JOB_QUEUE_WAIT_SECONDS = Histogram(
+    "forexelite_job_queue_wait_seconds",
+    "Time from enqueue to agent claim",
+    ["job_type", "lane"],
+    buckets=JOB_LATENCY_BUCKETS,
+)
+
+JOB_EXECUTION_SECONDS = Histogram(
+    "forexelite_job_execution_seconds",
+    "Time from agent claim to reported result",
+    ["job_type", "status"],
+    buckets=JOB_LATENCY_BUCKETS,
+)
+
+JOBS_EXPIRED = Counter(
+    "forexelite_jobs_expired_total",
+    "Jobs expired by the deadline sweeper",
+    ["job_type"],
+)
+
+JOB_QUEUE_DEPTH = Gauge(
+    "forexelite_job_queue_depth",
+    "Open jobs by job_type and status, refreshed by the sweeper",
+    ["job_type", "status"],
+    multiprocess_mode="livemax",
+)
+
+
+def _parse_ts(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _elapsed(start: Optional[str], end: Optional[str]) -> Optional[float]:
+    start_ts, end_ts = _parse_ts(start), _parse_ts(end)
+    if start_ts is None or end_ts is None:
+        return None
+    return max((end_ts - start_ts).total_seconds(), 0.0)
+
+
+def observe_job_claimed(job: dict, lane: str) -> Optional[float]:
+    """Record enqueue -> claim latency from a claimed job row."""
+    waited = _elapsed(job.get("created_at"), job.get("claimed_at"))
+    if waited is not None:
+        JOB_QUEUE_WAIT_SECONDS.labels(
+            job_type=job.get("job_type") or "unknown",
+            lane=lane,
+        ).observe(waited)
+    return waited
+
+
+def observe_job_finished(job: dict) -> Optional[float]:
+    """Record claim -> complete latency from a finished job row."""
+    executed = _elapsed(job.get("claimed_at"), job.get("completed_at"))
+    if executed is not None:
+        JOB_EXECUTION_SECONDS.labels(
+            job_type=job.get("job_type") or "unknown",
+            status=job.get("status") or "unknown",
+        ).observe(executed)
+    return executed
+
+
+def set_queue_depth(rows: list):
+    """Replace the queue depth gauge with rows of {job_type, status, depth}."""
+    JOB_QUEUE_DEPTH.clear()
+    for row in rows:
+        JOB_QUEUE_DEPTH.labels(
+            job_type=row.get("job_type") or "unknown",
+            status=row.get("status") or "unknown",
+        ).set(row.get("depth") or 0)
+
+
+def render_metrics() -> tuple:
+    """
+    Render the metrics exposition.
+
+    Aggregates across uvicorn workers when PROMETHEUS_MULTIPROC_DIR is set.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,14 +1,36 @@
 """
 Redis Client
-Async Redis connection management
+Async Redis connection management and single-holder leases
 """
-from typing import Optional
+import asyncio
+import logging
+from typing import Any, Dict, Optional
 import redis.asyncio as redis
 from app.core.config import get_settings
 
+logger = logging.getLogger(__name__)
+
 
 _redis_client: Optional[redis.Redis] = None
 
+# Extend / release a lease only while the caller still holds it
+_RENEW_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Registered lease scripts, by source; called with an explicit client
+_lease_scripts: Dict[str, Any] = {}
+
 
 async def get_redis() -> redis.Redis:
     """
@@ -36,3 +58,33 @@ async def close_redis():
     if _redis_client:
         await _redis_client.close()
         _redis_client = None
+
+
+def _lease_script(client: redis.Redis, source: str):
+    script = _lease_scripts.get(source)
+    if script is None:
+        script = _lease_scripts[source] = client.register_script(source)
+    return script
+
+
+async def renew_lease(lease_key: str, token: str, seconds: int):
+    """Keep a lease alive until cancelled, or until another holder has it."""
+    client = await get_redis()
+    renew = _lease_script(client, _RENEW_LEASE_SCRIPT)
+
+    while True:
+        await asyncio.sleep(seconds / 3)
+        try:
+            if not await renew(
+                keys=[lease_key], args=[token, seconds * 1000], client=client
+            ):
+                return
+        except Exception as e:
+            logger.warning(f"Lease renewal failed for {lease_key}: {e}")
+
+
+async def release_lease(lease_key: str, token: str):
+    """Drop a lease if `token` still holds it."""
+    client = await get_redis()
+    release = _lease_script(client, _RELEASE_LEASE_SCRIPT)
+    await release(keys=[lease_key], args=[token], client=client)
@@ -4,15 +4,23 @@ Main FastAPI application factory
 """
 
 import asyncio
+import hmac
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, APIRouter, WebSocket
+from typing import Optional
+from fastapi import FastAPI, APIRouter, Header, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response
 from app.core.config import get_settings
 from app.core.logging import setup_logging
 from app.core.auth import verify_supabase_jwt
+from app.core.metrics import render_metrics
 from app.ws.price_stream import ws_manager, handle_price_websocket
+from app.ws.account_stream import account_stream, handle_account_websocket
+from app.services.candle_store import persist_closed_bars
+from app.services.candles import candle_aggregator
+from app.services.pnl_engine import pnl_engine
+from app.services.jobs import job_wakeups, job_results, sweep_expired_jobs
 
 
 # Onboarding gate middleware
@@ -109,17 +117,31 @@ async def lifespan(app: FastAPI):
     setup_logging()
     settings = get_settings()
 
-    # Start Redis subscriber for price streaming
-    task = asyncio.create_task(ws_manager.start_redis_subscriber())
+    # Start Redis subscribers for price and account streaming, candle
+    # aggregation, agent job wakeups and results, plus the expired-job
+    # sweeper, candle store writer and P&L engine
+    tasks = [
+        asyncio.create_task(ws_manager.start_redis_subscriber()),
+        asyncio.create_task(account_stream.start_redis_subscriber()),
+        asyncio.create_task(candle_aggregator.start_redis_subscriber()),
+        asyncio.create_task(job_wakeups.start_redis_subscriber()),
+        asyncio.create_task(job_results.start_redis_subscriber()),
+        asyncio.create_task(sweep_expired_jobs()),
+        asyncio.create_task(persist_closed_bars()),
+    ]
+    if settings.PNL_ENGINE_ENABLED:
+        tasks.append(asyncio.create_task(pnl_engine.run()))
 
     yield
 
-    # Cancel Redis subscriber on shutdown
-    task.cancel()
-    try:
-        await task
-    except asyncio.CancelledError:
-        pass
+    # Cancel Redis subscribers on shutdown
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
 
 
 def create_app() -> FastAPI:
@@ -150,6 +172,19 @@ def create_app() -> FastAPI:
     async def health_check():
         return {"status": "healthy", "version": "1.0.0"}
 
+    # Prometheus metrics endpoint, for scrapers holding METRICS_TOKEN
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics(authorization: Optional[str] = Header(None)):
+        if not settings.METRICS_TOKEN:
+            return Response(status_code=404)
+        if not authorization or not hmac.compare_digest(
+            authorization, f"Bearer {settings.METRICS_TOKEN}"
+        ):
+            return Response(status_code=401)
+
+        body, content_type = render_metrics()
+        return Response(content=body, media_type=content_type)
+
     # Import and include routes
     from app.api.routes import (
         auth,
@@ -188,6 +223,11 @@ def create_app() -> FastAPI:
     async def websocket_prices(websocket: WebSocket, instrument: str, token: str = ""):
         await handle_price_websocket(websocket, instrument, token)
 
+    # WebSocket endpoint for live positions and account state
+    @app.websocket("/ws/account")
+    async def websocket_account(websocket: WebSocket, token: str = ""):
+        await handle_account_websocket(websocket, token)
+
     return app
 
 
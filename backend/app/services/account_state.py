@@ -0,0 +1,115 @@
+"""
+Account State Cache
+Agent-pushed account and positions snapshots, served from Redis and
+diffed for the /ws/account stream
+"""
+
+import json
+import time
+from typing import Optional
+from app.core.config import get_settings
+from app.core.redis import get_redis
+
+
+ACCOUNT_STATE_PREFIX = "account_state:"
+
+# A change to any of these is reported as "modified"; anything else that
+# moves (current_price, pnl) is a P&L update
+POSITION_STRUCTURAL_FIELDS = ("symbol", "side", "volume", "open_price", "sl", "tp")
+
+
+async def store_account_state(
+    user_id: str, agent_id: str, account: dict, positions: list
+) -> float:
+    """
+    Replace a user's cached snapshot and publish it to /ws/account streams.
+
+    The key expires after ACCOUNT_STATE_TTL_SECONDS, so a silent agent falls
+    back to the job path instead of serving stale state indefinitely.
+
+    Returns:
+        The snapshot's updated_at (epoch seconds).
+    """
+    settings = get_settings()
+    updated_at = time.time()
+
+    key = f"{ACCOUNT_STATE_PREFIX}{user_id}"
+    message = json.dumps(
+        {
+            "agent_id": agent_id,
+            "account": account,
+            "positions": positions,
+            "updated_at": updated_at,
+        },
+        separators=(",", ":"),
+    )
+
+    redis = await get_redis()
+    pipe = redis.pipeline(transaction=False)
+    pipe.set(key, message, ex=settings.ACCOUNT_STATE_TTL_SECONDS)
+    pipe.publish(key, message)
+    await pipe.execute()
+
+    return updated_at
+
+
+async def get_account_state(user_id: str) -> Optional[dict]:
+    """Read a user's cached snapshot, or None if missing or Redis is down."""
+    try:
+        redis = await get_redis()
+        cached = await redis.get(f"{ACCOUNT_STATE_PREFIX}{user_id}")
+    except Exception:
+        return None
+
+    return json.loads(cached) if cached else None
+
+
+def diff_account_state(old: Optional[dict], new: dict) -> dict:
+    """
+    Describe how a snapshot changed.
+
+    Returns:
+        {"opened": [position], "modified": [position], "closed": [ticket],
+        "pnl": [{ticket, current_price, pnl}], "account": {changed fields}},
+        with empty entries omitted - an empty dict means nothing changed.
+    """
+    old = old or {}
+    old_positions = {p["ticket"]: p for p in old.get("positions") or []}
+    new_positions = {p["ticket"]: p for p in new.get("positions") or []}
+
+    opened, modified, pnl = [], [], []
+    for ticket, position in new_positions.items():
+        previous = old_positions.get(ticket)
+        if previous is None:
+            opened.append(position)
+        elif any(
+            previous.get(field) != position.get(field)
+            for field in POSITION_STRUCTURAL_FIELDS
+        ):
+            modified.append(position)
+        elif previous != position:
+            pnl.append(
+                {
+                    "ticket": ticket,
+                    "current_price": position.get("current_price"),
+                    "pnl": position.get("pnl"),
+                }
+            )
+
+    closed = [ticket for ticket in old_positions if ticket not in new_positions]
+
+    old_account = old.get("account") or {}
+    account = {
+        field: value
+        for field, value in (new.get("account") or {}).items()
+        if old_account.get(field) != value
+    }
+
+    diff = {
+        "opened": opened,
+        "modified": modified,
+        "closed": closed,
+        "pnl": pnl,
+        "account": account,
+    }
+    return {kind: changes for kind, changes in diff.items() if changes}
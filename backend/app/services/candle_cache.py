@@ -0,0 +1,541 @@
+"""
+Candle Segment Cache
+Closed bars cached in Redis as immutable, time-aligned segments
+
+A segment holds the closed bars of one instrument/timeframe whose open
+time falls in [index * span, (index + 1) * span), span being
+CANDLE_SEGMENT_BARS bars. Segments that end before the forming bar
+never change again and are kept for days; the tail segment expires when
+the forming bar closes. The forming bar is cached on its own with a short
+TTL. Requests for any count (or time range) are assembled from segments,
+then from the on-disk candle store, and only go to the agent when
+neither has them.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+from app.core.config import get_settings
+from app.core.redis import get_redis
+from app.services.candles import (
+    OPEN_TIME,
+    TIMEFRAME_SECONDS,
+    candle_aggregator,
+    decode_candles,
+)
+from app.services.candle_store import get_candle_store, records_to_bars
+from app.services.jobs import run_read_job
+
+logger = logging.getLogger(__name__)
+
+
+CANDLE_SEGMENT_PREFIX = "candles:"
+
+# In-flight agent backfills on this worker:
+# instrument:timeframe:count -> (task, user whose agent it asks)
+_inflight_backfills: Dict[str, Tuple[asyncio.Future, str]] = {}
+
+# Segment reads walk back in batches; empty segments (weekends, holidays)
+# mean a batch can hold fewer bars than its span
+MAX_SEGMENT_BATCHES = 4
+
+# A range with more uncached gaps than this is fetched in one agent job
+MAX_RANGE_GAPS = 3
+
+
+def _segment_key(instrument: str, timeframe: str, index: int) -> str:
+    return f"{CANDLE_SEGMENT_PREFIX}{instrument}:{timeframe}:seg:{index}"
+
+
+def _forming_key(instrument: str, timeframe: str) -> str:
+    return f"{CANDLE_SEGMENT_PREFIX}{instrument}:{timeframe}:forming"
+
+
+def _offset_key(instrument: str) -> str:
+    return f"{CANDLE_SEGMENT_PREFIX}{instrument}:server_offset"
+
+
+def segment_span(timeframe: str) -> int:
+    return TIMEFRAME_SECONDS[timeframe] * get_settings().CANDLE_SEGMENT_BARS
+
+
+def forming_open_time(timeframe: str, server_offset: int, now: Optional[float] = None) -> int:
+    """Open time (broker server epoch) of the bar that is currently forming."""
+    seconds = TIMEFRAME_SECONDS[timeframe]
+    server_now = (now or time.time()) + server_offset
+    return int(server_now // seconds * seconds)
+
+
+async def get_server_offset(instrument: str) -> Optional[int]:
+    """Broker server offset from this worker's aggregator, else from Redis."""
+    if instrument in candle_aggregator.server_offsets:
+        return candle_aggregator.server_offsets[instrument]
+
+    redis = await get_redis()
+    cached = await redis.get(_offset_key(instrument))
+    return int(cached) if cached is not None else None
+
+
+def _set_segments(
+    pipe,
+    instrument: str,
+    timeframe: str,
+    bars: List[list],
+    start: int,
+    end: int,
+    server_offset: int,
+):
+    """
+    Queue every segment that closed bars complete for [start, end) fully
+    cover. A partial segment would poison the cache, so segments that
+    reach outside the range are skipped.
+    """
+    settings = get_settings()
+    span = segment_span(timeframe)
+    forming_at = forming_open_time(timeframe, server_offset)
+    tail_index = (forming_at - 1) // span
+
+    first_index = -(-start // span)
+    last_index = tail_index if end >= forming_at else end // span - 1
+
+    segments = {index: [] for index in range(first_index, last_index + 1)}
+    for bar in bars:
+        index = bar[OPEN_TIME] // span
+        if index in segments:
+            segments[index].append(bar)
+
+    # The tail segment gains a bar each time the forming bar closes
+    closes_at = forming_at + TIMEFRAME_SECONDS[timeframe]
+    tail_ttl = max(int(closes_at - (time.time() + server_offset)), 1)
+    for index, segment in segments.items():
+        ttl = tail_ttl if index == tail_index else settings.CANDLE_SEGMENT_TTL_SECONDS
+        pipe.set(
+            _segment_key(instrument, timeframe, index),
+            json.dumps(segment, separators=(",", ":")),
+            ex=ttl,
+        )
+
+
+async def write_bars(
+    instrument: str,
+    timeframe: str,
+    bars: List[list],
+    server_offset: int,
+    history_exhausted: bool = False,
+):
+    """
+    Store an agent backfill (the latest bars) as segments plus the forming
+    bar. The oldest segment is kept only if the backfill covers it from its
+    start, or the broker has no older history.
+    """
+    if not bars:
+        return
+
+    settings = get_settings()
+    forming_at = forming_open_time(timeframe, server_offset)
+    closed = [bar for bar in bars if bar[OPEN_TIME] < forming_at]
+    forming = bars[-1] if bars[-1][OPEN_TIME] == forming_at else None
+
+    redis = await get_redis()
+    pipe = redis.pipeline(transaction=False)
+    pipe.set(_offset_key(instrument), server_offset, ex=settings.CANDLE_SEGMENT_TTL_SECONDS)
+
+    # "null" records that no bar is forming (market closed)
+    pipe.set(
+        _forming_key(instrument, timeframe),
+        json.dumps(forming),
+        ex=settings.CANDLE_FORMING_TTL_SECONDS,
+    )
+
+    if closed:
+        start = closed[0][OPEN_TIME]
+        if history_exhausted:
+            start -= start % segment_span(timeframe)
+        _set_segments(
+            pipe, instrument, timeframe, closed, start, forming_at, server_offset
+        )
+
+    await pipe.execute()
+
+
+async def write_history(
+    instrument: str,
+    timeframe: str,
+    bars: List[list],
+    start: int,
+    end: int,
+    server_offset: int,
+):
+    """Store closed bars complete for [start, end) as the segments they cover."""
+    redis = await get_redis()
+    pipe = redis.pipeline(transaction=False)
+    _set_segments(pipe, instrument, timeframe, bars, start, end, server_offset)
+    await pipe.execute()
+
+
+async def read_closed_bars(
+    instrument: str,
+    timeframe: str,
+    count: int,
+    server_offset: int,
+    end: Optional[int] = None,
+) -> Optional[List[list]]:
+    """
+    The last `count` closed bars opening before `end` (default: the forming
+    bar), assembled from segments.
+
+    Returns:
+        Bars oldest first, or None if a needed segment is not cached.
+    """
+    settings = get_settings()
+    span = segment_span(timeframe)
+    if end is None:
+        end = forming_open_time(timeframe, server_offset)
+    batch = math.ceil(count / settings.CANDLE_SEGMENT_BARS) + 1
+
+    redis = await get_redis()
+    segments: List[List[list]] = []
+    collected = 0
+    index = (end - 1) // span
+
+    for _ in range(MAX_SEGMENT_BATCHES):
+        indices = list(range(index, index - batch, -1))
+        payloads = await redis.mget(
+            [_segment_key(instrument, timeframe, i) for i in indices]
+        )
+        for payload in payloads:
+            if payload is None:
+                return None
+            segment = [bar for bar in json.loads(payload) if bar[OPEN_TIME] < end]
+            segments.append(segment)
+            collected += len(segment)
+            if collected >= count:
+                bars = [bar for segment in reversed(segments) for bar in segment]
+                return bars[-count:]
+        index -= batch
+
+    return None
+
+
+async def read_range(
+    instrument: str, timeframe: str, start: int, end: int
+) -> Optional[List[list]]:
+    """Closed bars with start <= open time < end, or None if not all cached."""
+    span = segment_span(timeframe)
+    indices = list(range(start // span, (end - 1) // span + 1))
+
+    redis = await get_redis()
+    payloads = await redis.mget(
+        [_segment_key(instrument, timeframe, index) for index in indices]
+    )
+    if any(payload is None for payload in payloads):
+        return None
+
+    return [
+        bar
+        for payload in payloads
+        for bar in json.loads(payload)
+        if start <= bar[OPEN_TIME] < end
+    ]
+
+
+async def read_forming_bar(
+    instrument: str, timeframe: str, server_offset: int
+) -> Tuple[bool, Optional[list]]:
+    """
+    The forming bar: live from this worker's tick buffers when they have
+    it, else the agent's last copy.
+
+    Returns:
+        (known, bar) - known is False when neither source has it; bar is
+        None when no bar is forming (market closed).
+    """
+    forming_at = forming_open_time(timeframe, server_offset)
+    bar = candle_aggregator.forming_bar(instrument, timeframe, forming_at)
+    if bar is not None:
+        return True, bar
+
+    redis = await get_redis()
+    cached = await redis.get(_forming_key(instrument, timeframe))
+    if cached is None:
+        return False, None
+    return True, json.loads(cached)
+
+
+async def fetch_candle_bars(
+    user_id: str, instrument: str, timeframe: str, count: int
+) -> Tuple[List[list], int]:
+    """
+    Latest `count` bars including the forming one: from segments if all are
+    cached, else from the candle store (refilling the segments), otherwise
+    from one (coalesced) agent backfill that refills both.
+
+    Returns:
+        (bars oldest first, broker server offset)
+    """
+    server_offset = await get_server_offset(instrument)
+
+    if server_offset is not None:
+        closed = await read_closed_bars(instrument, timeframe, count, server_offset)
+        known, forming = await read_forming_bar(instrument, timeframe, server_offset)
+        if known and closed is not None:
+            bars = closed + [forming] if forming is not None else closed
+            return bars[-count:], server_offset
+
+        if known:
+            records = await _store(
+                "read_latest",
+                instrument,
+                timeframe,
+                count,
+                forming_open_time(timeframe, server_offset),
+            )
+            if records is not None:
+                closed = records_to_bars(records)
+                bars = closed + [forming] if forming is not None else closed
+                await write_bars(instrument, timeframe, bars, server_offset)
+                return bars[-count:], server_offset
+
+    # Requests are rounded up to whole backfills so that concurrent misses
+    # for nearby counts, from any user, share one fetch
+    step = get_settings().CANDLE_BACKFILL_COUNT
+    backfill = math.ceil(count / step) * step
+    key = f"{instrument}:{timeframe}:{backfill}"
+
+    inflight = _inflight_backfills.get(key)
+    if inflight is None:
+        task = asyncio.ensure_future(
+            _backfill(user_id, instrument, timeframe, backfill)
+        )
+        inflight = _inflight_backfills[key] = (task, user_id)
+        task.add_done_callback(lambda _: _inflight_backfills.pop(key, None))
+
+    # Shield so one disconnecting caller does not cancel the shared fetch
+    task, owner = inflight
+    bars, server_offset = await asyncio.shield(task)
+
+    if not bars and owner != user_id:
+        # Another user's agent did not answer; ask this user's own
+        bars, server_offset = await _backfill(user_id, instrument, timeframe, backfill)
+    return bars[-count:], server_offset
+
+
+async def fetch_candle_range(
+    user_id: str, instrument: str, timeframe: str, start: int, end: int
+) -> Tuple[Optional[List[list]], int, bool]:
+    """
+    Closed bars with start <= open time < end (broker server epoch).
+
+    Served from segments, else from the candle store; the agent is asked
+    (copy_rates_range) only for the chunks the store does not hold, and
+    what it returns is stored for good, so scrolling back through a chart
+    loads each chunk once. Agent answers are recorded as complete only as
+    far back as the agent vouches for (its complete_from), else from the
+    first bar it returned.
+
+    Returns:
+        (bars oldest first, or None if the agent did not answer; broker
+        server offset; whether the bars are known to be the whole range)
+    """
+    server_offset = await get_server_offset(instrument)
+    if server_offset is None:
+        # Learn the offset (and warm the cache) with a regular backfill
+        bars, server_offset = await fetch_candle_bars(user_id, instrument, timeframe, 1)
+        if not bars:
+            return None, server_offset, False
+
+    end = min(end, forming_open_time(timeframe, server_offset))
+    if start >= end:
+        return [], server_offset, True
+
+    bars = await read_range(instrument, timeframe, start, end)
+    if bars is not None:
+        return bars, server_offset, True
+
+    gaps = await _store("missing", instrument, timeframe, start, end)
+    if gaps is None:
+        gaps = [[start, end]]
+    elif len(gaps) > MAX_RANGE_GAPS:
+        gaps = [[gaps[0][0], gaps[-1][1]]]
+
+    fetched: List[list] = []
+    covered_start = start
+    for gap_start, gap_end in gaps:
+        history = await _fetch_history(
+            user_id, instrument, timeframe, {"from": gap_start, "to": gap_end - 1}
+        )
+        if history is None:
+            return None, server_offset, False
+
+        agent_bars, _, complete_from = history
+        chunk = [bar for bar in agent_bars if gap_start <= bar[OPEN_TIME] < gap_end]
+        if complete_from is not None:
+            covered_from = max(gap_start, complete_from)
+        else:
+            covered_from = chunk[0][OPEN_TIME] if chunk else gap_end
+
+        if covered_from > gap_start:
+            covered_start = max(covered_start, covered_from)
+        if covered_from < gap_end:
+            await _store("write", instrument, timeframe, chunk, covered_from, gap_end)
+        fetched += chunk
+
+    complete = covered_start == start
+    if gaps == [[start, end]]:
+        if not complete:
+            return fetched, server_offset, False
+        bars = fetched
+    else:
+        # Only the gaps came from the agent; the rest has to come back
+        # from the store, and without it the answer is partial
+        records = None
+        if covered_start < end:
+            records = await _store("read_range", instrument, timeframe, covered_start, end)
+        if records is None:
+            return fetched, server_offset, False
+        bars = records_to_bars(records)
+
+    await write_history(instrument, timeframe, bars, covered_start, end, server_offset)
+    return bars, server_offset, complete
+
+
+async def fetch_candles_before(
+    user_id: str, instrument: str, timeframe: str, before: int, count: int
+) -> Tuple[Optional[List[list]], int, bool]:
+    """
+    The `count` closed bars opening before `before` - one page of cursor
+    pagination back through history (agent: copy_rates_from).
+
+    Returns:
+        (bars oldest first, or None if the agent did not answer; broker
+        server offset; whether the page is final). A final page with fewer
+        than `count` bars means the broker has no older history; a short
+        page that is not final may fill in on a later request.
+    """
+    server_offset = await get_server_offset(instrument)
+    if server_offset is None:
+        bars, server_offset = await fetch_candle_bars(user_id, instrument, timeframe, 1)
+        if not bars:
+            return None, server_offset, False
+
+    before = min(before, forming_open_time(timeframe, server_offset))
+
+    bars = await read_closed_bars(instrument, timeframe, count, server_offset, before)
+    if bars is not None:
+        return bars, server_offset, True
+
+    records = await _store("read_latest", instrument, timeframe, count, before)
+    if records is not None:
+        return records_to_bars(records), server_offset, True
+
+    history = await _fetch_history(
+        user_id, instrument, timeframe, {"before": before, "count": count}
+    )
+    if history is None:
+        return None, server_offset, False
+
+    bars = [bar for bar in history[0] if bar[OPEN_TIME] < before]
+    # Short is only "no older history" when the agent says so
+    exhausted = len(bars) < count and history[2] is not None
+    if not bars:
+        if exhausted:
+            await _store("write", instrument, timeframe, [], 0, before)
+        return [], server_offset, exhausted
+
+    start = bars[0][OPEN_TIME]
+    await _store("write", instrument, timeframe, bars, 0 if exhausted else start, before)
+    if exhausted:
+        start -= start % segment_span(timeframe)
+    await write_history(instrument, timeframe, bars, start, before, server_offset)
+    return bars, server_offset, exhausted or len(bars) == count
+
+
+async def _fetch_history(
+    user_id: str, instrument: str, timeframe: str, query: dict
+) -> Optional[Tuple[List[list], int, Optional[int]]]:
+    """
+    Run one get_candles agent job, coalesced across users and workers
+    (run_read_job falls back to the caller's own agent if the shared
+    job's agent does not answer).
+
+    Returns:
+        (bars, broker server offset, complete_from), or None if the agent
+        did not answer or no server offset is known. complete_from is where the agent vouches the
+        answer is complete from (0: the start of the broker's history);
+        None means only from its first bar.
+    """
+    params = ":".join(f"{name}={value}" for name, value in sorted(query.items()))
+    result = await run_read_job(
+        user_id,
+        "get_candles",
+        {"symbol": instrument, "timeframe": timeframe, **query},
+        timeout=10,
+        coalesce_key=f"{CANDLE_SEGMENT_PREFIX}{instrument}:{timeframe}:{params}",
+    )
+    if not result or result["status"] != "completed":
+        return None
+
+    output = result.get("output_data") or {}
+    server_offset = output.get("server_offset")
+    if server_offset is None:
+        # The agent has not seen a live tick yet (market closed)
+        server_offset = await get_server_offset(instrument)
+        if server_offset is None:
+            logger.warning(f"No server offset known for {instrument}")
+            return None
+
+    return decode_candles(output), server_offset, output.get("complete_from")
+
+
+async def _backfill(
+    user_id: str, instrument: str, timeframe: str, count: int
+) -> Tuple[List[list], int]:
+    """
+    The latest `count` bars from the agent, written back to the segments
+    and the store by every worker that sees the result (the writes are
+    idempotent).
+    """
+    history = await _fetch_history(user_id, instrument, timeframe, {"count": count})
+    if history is None:
+        return [], 0
+
+    bars, server_offset, complete_from = history
+    history_exhausted = len(bars) < count and complete_from is not None
+    await write_bars(instrument, timeframe, bars, server_offset, history_exhausted)
+
+    # The backfill is complete from its first bar up to the forming one
+    forming_at = forming_open_time(timeframe, server_offset)
+    closed = [bar for bar in bars if bar[OPEN_TIME] < forming_at]
+    if closed:
+        await _store(
+            "write",
+            instrument,
+            timeframe,
+            closed,
+            0 if history_exhausted else None,
+            forming_at,
+        )
+    return bars, server_offset
+
+
+async def _store(method: str, instrument: str, timeframe: str, *args):
+    """
+    Run a CandleStore method off the event loop.
+
+    Returns:
+        Its result, or None if the store is disabled or the call failed.
+    """
+    store = get_candle_store()
+    if store is None:
+        return None
+
+    try:
+        return await asyncio.to_thread(
+            getattr(store, method), instrument, timeframe, *args
+        )
+    except Exception as e:
+        logger.warning(f"Candle store {method} failed for {instrument} {timeframe}: {e}")
+        return None
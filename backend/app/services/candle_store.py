@@ -0,0 +1,283 @@
+"""
+Candle Store
+Append-only columnar candle files on local disk, read through memory maps
+
+Each instrument/timeframe has one file of fixed-size records
+(open_time, open, high, low, close, volume) sorted by open_time, so a
+range read is two binary searches over a memory map and only touches
+the pages it returns. A JSON sidecar lists the [start, end) intervals
+the file is known to hold completely; reads outside them return None so
+callers go to the agent instead of serving a chart with holes.
+
+Agent backfills and bars closed by the candle aggregator are written
+here. Newer bars are appended. Agent bars overwrite existing ones in
+place, and bars older than the tail (a deeper backfill) trigger an
+atomic rewrite. Writers in different workers serialize on a per-file
+flock.
+"""
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import List, Optional
+import numpy as np
+from app.core.config import get_settings
+from app.services.candles import (
+    MAX_PENDING_CLOSED_BARS,
+    OPEN_TIME,
+    TIMEFRAME_SECONDS,
+    candle_aggregator,
+)
+
+logger = logging.getLogger(__name__)
+
+
+BAR_DTYPE = np.dtype(
+    [
+        ("open_time", "<i8"),
+        ("open", "<f8"),
+        ("high", "<f8"),
+        ("low", "<f8"),
+        ("close", "<f8"),
+        ("volume", "<i8"),
+    ]
+)
+
+
+def records_to_bars(records: np.ndarray) -> List[list]:
+    return [list(record) for record in records.tolist()]
+
+
+def _merge_intervals(intervals: List[List[int]]) -> List[List[int]]:
+    merged: List[List[int]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class CandleStore:
+    """Memory-mapped candle files under `root`, one per instrument/timeframe."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, instrument: str, timeframe: str, suffix: str) -> str:
+        return os.path.join(self.root, instrument, f"{timeframe}.{suffix}")
+
+    @contextmanager
+    def _lock(self, instrument: str, timeframe: str):
+        os.makedirs(os.path.join(self.root, instrument), exist_ok=True)
+        with open(self._path(instrument, timeframe, "lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _open(self, instrument: str, timeframe: str, mode: str = "r") -> np.ndarray:
+        """Memory-map the bars file; an empty array if there is none."""
+        path = self._path(instrument, timeframe, "bin")
+        try:
+            # A half-written trailing record (concurrent append) is ignored
+            count = os.path.getsize(path) // BAR_DTYPE.itemsize
+        except FileNotFoundError:
+            count = 0
+
+        if count == 0:
+            return np.empty(0, dtype=BAR_DTYPE)
+        return np.memmap(path, dtype=BAR_DTYPE, mode=mode, shape=(count,))
+
+    def coverage(self, instrument: str, timeframe: str) -> List[List[int]]:
+        """Intervals [start, end) of broker server time held completely."""
+        try:
+            with open(self._path(instrument, timeframe, "json")) as f:
+                return json.load(f)["coverage"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return []
+
+    def _covering(self, instrument: str, timeframe: str, start: int, end: int):
+        for interval in self.coverage(instrument, timeframe):
+            if interval[0] <= start and end <= interval[1]:
+                return interval
+        return None
+
+    def missing(
+        self, instrument: str, timeframe: str, start: int, end: int
+    ) -> List[List[int]]:
+        """Sub-ranges of [start, end) that the file does not hold completely."""
+        gaps = []
+        cursor = start
+        for interval_start, interval_end in self.coverage(instrument, timeframe):
+            if interval_end <= cursor:
+                continue
+            if interval_start >= end:
+                break
+            if interval_start > cursor:
+                gaps.append([cursor, interval_start])
+            cursor = max(cursor, interval_end)
+            if cursor >= end:
+                break
+
+        if cursor < end:
+            gaps.append([cursor, end])
+        return gaps
+
+    def write(
+        self,
+        instrument: str,
+        timeframe: str,
+        bars: List[list],
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        replace: bool = True,
+    ):
+        """
+        Store closed bars that are complete for [start, end).
+
+        Args:
+            bars: Closed bars, oldest first
+            start: Defaults to the first bar's open time; 0 means the
+                broker has no older history
+            end: Defaults to the close of the last bar
+            replace: Overwrite bars already stored (agent bars are
+                authoritative; tick-built ones are not)
+
+        With an explicit range, no bars records that it has none
+        (a weekend, or before the broker's history).
+        """
+        if not bars and (start is None or end is None):
+            return
+
+        records = np.array([tuple(bar) for bar in bars], dtype=BAR_DTYPE)
+        records.sort(order="open_time")
+        times = records["open_time"]
+        if start is None:
+            start = int(times[0])
+        if end is None:
+            end = int(times[-1]) + TIMEFRAME_SECONDS[timeframe]
+
+        with self._lock(instrument, timeframe):
+            path = self._path(instrument, timeframe, "bin")
+            stored = self._open(instrument, timeframe, mode="r+")
+            last = int(stored["open_time"][-1]) if len(stored) else None
+
+            tail = records if last is None else records[times > last]
+            older = records[: len(records) - len(tail)]
+            missing = older[:0]
+
+            if len(older):
+                stored_times = stored["open_time"]
+                index = np.searchsorted(stored_times, older["open_time"])
+                present = stored_times[index] == older["open_time"]
+                if replace and present.any():
+                    stored[index[present]] = older[present]
+                    stored.flush()
+                missing = older[~present]
+
+            if len(missing):
+                merged = np.concatenate([stored, missing, tail])
+                merged.sort(order="open_time")
+                tmp = path + ".tmp"
+                merged.tofile(tmp)
+                os.replace(tmp, path)
+            elif len(tail):
+                with open(path, "ab") as f:
+                    f.write(tail.tobytes())
+
+            # Coverage is published only after the bars it claims are on disk
+            coverage = _merge_intervals(self.coverage(instrument, timeframe) + [[start, end]])
+            sidecar = self._path(instrument, timeframe, "json")
+            with open(sidecar + ".tmp", "w") as f:
+                json.dump({"coverage": coverage}, f)
+            os.replace(sidecar + ".tmp", sidecar)
+
+    def read_range(
+        self, instrument: str, timeframe: str, start: int, end: int
+    ) -> Optional[np.ndarray]:
+        """Bars with start <= open_time < end, or None if not fully stored."""
+        if self._covering(instrument, timeframe, start, end) is None:
+            return None
+
+        bars = self._open(instrument, timeframe)
+        times = bars["open_time"]
+        lo, hi = np.searchsorted(times, [start, end])
+        return np.array(bars[lo:hi])
+
+    def read_latest(
+        self, instrument: str, timeframe: str, count: int, end: int
+    ) -> Optional[np.ndarray]:
+        """The last `count` bars opening before `end`, or None if not fully stored."""
+        interval = self._covering(instrument, timeframe, end - 1, end)
+        if interval is None:
+            return None
+
+        bars = self._open(instrument, timeframe)
+        times = bars["open_time"]
+        hi = int(np.searchsorted(times, end))
+        lo = max(hi - count, 0)
+        if hi == lo or times[lo] < interval[0]:
+            return None
+        if hi - lo < count and interval[0] != 0:
+            return None
+        return np.array(bars[lo:hi])
+
+
+@lru_cache
+def get_candle_store() -> Optional[CandleStore]:
+    """The candle store, or None when CANDLE_STORE_DIR is unset."""
+    root = get_settings().CANDLE_STORE_DIR
+    return CandleStore(root) if root else None
+
+
+async def persist_closed_bars():
+    """
+    Append bars closed by the candle aggregator to the store.
+
+    Bars are collected only while this writer runs. A failed write leaves
+    that bar and the rest of the batch queued for the next flush.
+    """
+    settings = get_settings()
+    store = get_candle_store()
+    if store is None:
+        return
+
+    candle_aggregator.record_closed = True
+    pending: deque = deque(maxlen=MAX_PENDING_CLOSED_BARS)
+
+    while True:
+        try:
+            await asyncio.sleep(settings.CANDLE_STORE_FLUSH_SECONDS)
+            closed = candle_aggregator.closed_bars
+            if closed:
+                candle_aggregator.closed_bars = deque(maxlen=MAX_PENDING_CLOSED_BARS)
+                pending.extend(closed)
+
+            while pending:
+                instrument, timeframe, bar, end = pending[0]
+                await asyncio.to_thread(
+                    store.write,
+                    instrument,
+                    timeframe,
+                    [bar],
+                    bar[OPEN_TIME],
+                    end,
+                    False,
+                )
+                pending.popleft()
+
+        except asyncio.CancelledError:
+            logger.info("Candle store writer cancelled")
+            candle_aggregator.record_closed = False
+            raise
+        except Exception as e:
+            logger.warning(
+                f"Candle store write failed ({len(pending)} bars queued): {e}"
+            )
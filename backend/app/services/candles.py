@@ -0,0 +1,309 @@
+"""
+Candle Aggregator
+Rolling OHLC bars per instrument and timeframe, built from the tick stream
+
+Each instrument keeps one fixed-size ring buffer per timeframe. Buffers
+are seeded once from an agent backfill (get_candles) and then extended by
+every bid on prices:{instrument}, so chart loads are served from memory
+with the forming bar updated live.
+"""
+
+import asyncio
+import base64
+import json
+import logging
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional
+from app.core.config import get_settings
+from app.core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+TIMEFRAME_SECONDS = {
+    "M1": 60,
+    "M5": 300,
+    "M15": 900,
+    "H1": 3600,
+    "H4": 14400,
+    "D1": 86400,
+}
+
+# Bar layout inside a buffer: [open_time, open, high, low, close, volume]
+OPEN_TIME, OPEN, HIGH, LOW, CLOSE, VOLUME = range(6)
+
+# Closed bars waiting for the candle store writer; if it falls this far
+# behind the oldest are dropped (they are just not marked as stored)
+MAX_PENDING_CLOSED_BARS = 50000
+
+
+def candle_to_bar(candle: dict) -> list:
+    """Convert an agent candle to a bar; `ts` is broker server time as epoch."""
+    open_time = candle.get("ts")
+    if open_time is None:
+        open_time = (
+            datetime.fromisoformat(candle["time"]).replace(tzinfo=timezone.utc).timestamp()
+        )
+
+    return [
+        int(open_time),
+        float(candle["open"]),
+        float(candle["high"]),
+        float(candle["low"]),
+        float(candle["close"]),
+        int(candle.get("volume") or 0),
+    ]
+
+
+def decode_candles(output: dict) -> List[list]:
+    """
+    Bars from a get_candles job output: columnar ("t", "o", "h", "l", "c",
+    "v" arrays, optionally zlib+base64 encoded) or rows from older agents.
+    """
+    candles = output.get("candles") or []
+    if output.get("format") != "columnar":
+        return [candle_to_bar(candle) for candle in candles]
+
+    if output.get("encoding") == "zlib":
+        candles = json.loads(zlib.decompress(base64.b64decode(candles)))
+
+    return [
+        [int(t), float(o), float(h), float(l), float(c), int(v)]
+        for t, o, h, l, c, v in zip(
+            candles["t"], candles["o"], candles["h"], candles["l"], candles["c"], candles["v"]
+        )
+    ]
+
+
+def bars_to_columns(bars: List[list]) -> dict:
+    """Compact columnar response body: t (open time, epoch seconds), o, h, l, c, v."""
+    t, o, h, l, c, v = (list(column) for column in zip(*bars)) if bars else ([],) * 6
+    return {"t": t, "o": o, "h": h, "l": l, "c": c, "v": v}
+
+
+def bar_to_candle(bar: list) -> dict:
+    return {
+        "time": datetime.fromtimestamp(bar[OPEN_TIME], timezone.utc)
+        .replace(tzinfo=None)
+        .isoformat(),
+        "open": bar[OPEN],
+        "high": bar[HIGH],
+        "low": bar[LOW],
+        "close": bar[CLOSE],
+        "volume": bar[VOLUME],
+    }
+
+
+class CandleBuffer:
+    """Fixed-size ring of bars for one instrument and timeframe."""
+
+    def __init__(self, seconds: int, size: int):
+        self.seconds = seconds
+        self.bars: deque = deque(maxlen=size)
+        self.seeded_at: Optional[float] = None
+        self.backfilled = 0
+
+    def add_tick(self, ts: float, price: float) -> Optional[list]:
+        """
+        Fold a tick into the forming bar, opening a new bar on a boundary.
+
+        Returns:
+            The bar that just closed, if the tick opened a new one.
+        """
+        open_time = int(ts // self.seconds * self.seconds)
+
+        if self.bars and self.bars[-1][OPEN_TIME] == open_time:
+            bar = self.bars[-1]
+            if price > bar[HIGH]:
+                bar[HIGH] = price
+            elif price < bar[LOW]:
+                bar[LOW] = price
+            bar[CLOSE] = price
+            bar[VOLUME] += 1
+        elif not self.bars or self.bars[-1][OPEN_TIME] < open_time:
+            closed = self.bars[-1] if self.bars else None
+            self.bars.append([open_time, price, price, price, price, 1])
+            return closed
+        # Ticks older than the forming bar are dropped
+        return None
+
+    def seed(self, bars: List[list], requested: int):
+        """
+        Replace history with backfilled bars (`requested` is the count asked of
+        the agent; it may return fewer when history is short).
+
+        Live bars newer than the backfill are kept; a live bar with the same
+        open time as the last backfilled one is merged into it, since the
+        backfill saw its opening ticks and the stream saw the latest.
+        """
+        self.seeded_at = time.time()
+        self.backfilled = requested
+        if not bars:
+            return
+
+        last = bars[-1]
+        live = [bar for bar in self.bars if bar[OPEN_TIME] >= last[OPEN_TIME]]
+        if live and live[0][OPEN_TIME] == last[OPEN_TIME]:
+            forming = live.pop(0)
+            last[HIGH] = max(last[HIGH], forming[HIGH])
+            last[LOW] = min(last[LOW], forming[LOW])
+            last[CLOSE] = forming[CLOSE]
+            last[VOLUME] = max(last[VOLUME], forming[VOLUME])
+
+        self.bars = deque(bars + live, maxlen=self.bars.maxlen)
+
+    def latest(self, count: int) -> List[list]:
+        if count >= len(self.bars):
+            return list(self.bars)
+        return [self.bars[i] for i in range(len(self.bars) - count, len(self.bars))]
+
+
+class CandleAggregator:
+    """Per-instrument candle buffers for every timeframe, fed by prices:*."""
+
+    def __init__(self):
+        self.buffers: Dict[str, Dict[str, CandleBuffer]] = {}
+        self.server_offsets: Dict[str, int] = {}
+        self.last_tick_at: Dict[str, float] = {}
+        # (instrument, timeframe, bar, next bar's open time) for the candle
+        # store; only collected while its writer runs (record_closed)
+        self.record_closed = False
+        self.closed_bars: Deque[tuple] = deque(maxlen=MAX_PENDING_CLOSED_BARS)
+
+    def _instrument_buffers(self, instrument: str) -> Dict[str, CandleBuffer]:
+        buffers = self.buffers.get(instrument)
+        if buffers is None:
+            size = get_settings().CANDLE_BUFFER_SIZE
+            buffers = self.buffers[instrument] = {
+                timeframe: CandleBuffer(seconds, size)
+                for timeframe, seconds in TIMEFRAME_SECONDS.items()
+            }
+        return buffers
+
+    def on_tick(self, instrument: str, bid: float, now: Optional[float] = None):
+        """Update the forming bar of every timeframe (bars are bid-based, as in MT5)."""
+        now = now or time.time()
+        self.last_tick_at[instrument] = now
+
+        # Bars are bucketed in broker server time so D1 opens where MT5's does
+        ts = now + self.server_offsets.get(instrument, 0)
+        for timeframe, buffer in self._instrument_buffers(instrument).items():
+            closed = buffer.add_tick(ts, bid)
+            # Only seeded buffers are gap-free back to a backfill
+            if (
+                closed is not None
+                and buffer.seeded_at is not None
+                and self.record_closed
+            ):
+                self.closed_bars.append(
+                    (instrument, timeframe, list(closed), buffer.bars[-1][OPEN_TIME])
+                )
+
+    def invalidate(self):
+        """Mark every buffer unseeded, e.g. after missing ticks on a reconnect."""
+        for buffers in self.buffers.values():
+            for buffer in buffers.values():
+                buffer.seeded_at = None
+
+    def seed(
+        self,
+        instrument: str,
+        timeframe: str,
+        bars: List[list],
+        requested: int,
+        server_offset: int = 0,
+    ):
+        """Seed one timeframe from an agent backfill of `requested` bars."""
+        buffers = self._instrument_buffers(instrument)
+
+        if self.server_offsets.get(instrument, 0) != server_offset:
+            # Live bars were bucketed with the wrong offset; rebuild from ticks
+            self.server_offsets[instrument] = server_offset
+            for buffer in buffers.values():
+                buffer.bars.clear()
+                buffer.seeded_at = None
+
+        buffers[timeframe].seed([list(bar) for bar in bars], requested)
+
+    def is_fresh(self, instrument: str, timeframe: str, count: int) -> bool:
+        """
+        True if a request can be served from memory: the buffer was seeded
+        with enough bars, and the instrument has ticked (or been seeded)
+        within CANDLE_STALE_SECONDS.
+        """
+        buffer = self.buffers.get(instrument, {}).get(timeframe)
+        if buffer is None or buffer.seeded_at is None:
+            return False
+        if count > max(buffer.backfilled, len(buffer.bars)):
+            return False
+
+        settings = get_settings()
+        last_update = max(self.last_tick_at.get(instrument, 0.0), buffer.seeded_at)
+        return time.time() - last_update < settings.CANDLE_STALE_SECONDS
+
+    def forming_bar(
+        self, instrument: str, timeframe: str, open_time: int
+    ) -> Optional[list]:
+        """The tick-built bar opened at `open_time`, if this worker has one."""
+        buffer = self.buffers.get(instrument, {}).get(timeframe)
+        if buffer and buffer.bars and buffer.bars[-1][OPEN_TIME] == open_time:
+            return list(buffer.bars[-1])
+        return None
+
+    def get(self, instrument: str, timeframe: str, count: int) -> List[list]:
+        """Latest `count` bars, oldest first, including the forming bar."""
+        buffer = self.buffers.get(instrument, {}).get(timeframe)
+        if buffer is None:
+            return []
+        return [list(bar) for bar in buffer.latest(count)]
+
+    async def start_redis_subscriber(self):
+        """Start Redis pub/sub listener with automatic reconnection."""
+        retry_delay = 1  # Start with 1 second
+        max_delay = 30  # Max 30 seconds
+        connected = False
+
+        while True:
+            try:
+                redis = await get_redis()
+                pubsub = redis.pubsub()
+                await pubsub.psubscribe("prices:*")
+
+                # Ticks were missed while disconnected; backfill again
+                if connected:
+                    self.invalidate()
+                connected = True
+
+                # Reset retry delay on successful connection
+                retry_delay = 1
+
+                logger.info("Candle aggregator subscriber connected")
+
+                async for message in pubsub.listen():
+                    if message["type"] == "pmessage":
+                        channel = message.get("channel", "")
+                        if channel.startswith("prices:"):
+                            tick = json.loads(message["data"])
+                            self.on_tick(channel[7:], tick["bid"])
+
+            except asyncio.CancelledError:
+                logger.info("Candle aggregator subscriber cancelled")
+                try:
+                    await pubsub.punsubscribe("prices:*")
+                except Exception:
+                    pass
+                raise
+            except Exception as e:
+                logger.warning(
+                    f"Candle aggregator subscriber error: {e}. Reconnecting in {retry_delay}s..."
+                )
+                await asyncio.sleep(retry_delay)
+                # Exponential backoff
+                retry_delay = min(retry_delay * 2, max_delay)
+
+
+# Singleton instance
+candle_aggregator = CandleAggregator()
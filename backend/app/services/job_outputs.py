@@ -0,0 +1,74 @@
+"""
+Job Output Offload
+Keeps large results of ephemeral read jobs (candles, positions, account)
+out of jobs.output_data. Durable outputs (compile, deploy, trades) always
+stay in the row.
+"""
+
+import json
+import logging
+from typing import Optional
+from app.core.config import get_settings
+from app.core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+JOB_OUTPUT_PREFIX = "jobs:output:"
+OUTPUT_REF_KEY = "$ref"
+
+# Outputs only read by the route awaiting them, never after
+OFFLOAD_JOB_TYPES = {"get_candles", "get_positions", "get_account"}
+
+
+def is_output_ref(output: Optional[dict]) -> bool:
+    """True if output_data is a reference to an offloaded payload."""
+    return isinstance(output, dict) and OUTPUT_REF_KEY in output
+
+
+async def offload_job_output(
+    job_id: str, job_type: Optional[str], output: Optional[dict]
+) -> Optional[dict]:
+    """
+    Store a read job's output above JOB_OUTPUT_INLINE_MAX_BYTES in Redis (with TTL).
+
+    Returns:
+        The output unchanged if small, otherwise a reference of the form
+        {"$ref": "redis", "key": ..., "bytes": ...} to store in the row.
+    """
+    if not output or job_type not in OFFLOAD_JOB_TYPES:
+        return output
+
+    settings = get_settings()
+    payload = json.dumps(output, separators=(",", ":"))
+    if len(payload) <= settings.JOB_OUTPUT_INLINE_MAX_BYTES:
+        return output
+
+    key = f"{JOB_OUTPUT_PREFIX}{job_id}"
+    try:
+        redis = await get_redis()
+        await redis.setex(key, settings.JOB_OUTPUT_TTL_SECONDS, payload)
+    except Exception as e:
+        # Better a fat row than a lost result
+        logger.warning(f"Job output offload failed for job {job_id}: {e}")
+        return output
+
+    return {OUTPUT_REF_KEY: "redis", "key": key, "bytes": len(payload)}
+
+
+async def resolve_job_output(output: Optional[dict]) -> Optional[dict]:
+    """
+    Resolve an offloaded output reference to the stored payload.
+
+    Inline outputs are returned unchanged; a reference whose payload has
+    expired resolves to {"expired": True}.
+    """
+    if not is_output_ref(output):
+        return output
+
+    redis = await get_redis()
+    payload = await redis.get(output["key"])
+    if payload is None:
+        return {"expired": True}
+
+    return json.loads(payload)
@@ -0,0 +1,710 @@
+"""
+Job Queue
+Pluggable job dispatch backends
+
+- PostgresJobQueue: the Supabase `jobs` table and its RPCs (durable record)
+- RedisJobQueue: per-user Redis sorted sets for the hot path, written
+  through to Postgres for audit, with ack / visibility-timeout redelivery
+- InMemoryJobQueue: local stand-in for development and tests without
+  Supabase or Redis
+
+Select with JOB_QUEUE_BACKEND ("postgres", "redis" or "memory").
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from postgrest.exceptions import APIError
+from app.core.config import get_settings
+from app.core.redis import get_redis
+from app.core.supabase import get_supabase_client
+
+logger = logging.getLogger(__name__)
+
+
+# Mirrors job_default_priority() / job_default_ttl() in SQL for backends
+# that do not go through the Postgres insert triggers
+JOB_DEFAULT_PRIORITY = {
+    "trade": 100,
+    "trade_batch": 100,
+    "close_position": 100,
+    "close_positions": 100,
+    "get_positions": 70,
+    "get_account": 70,
+    "get_candles": 50,
+    "deploy": 30,
+    "run": 30,
+    "stop": 30,
+}
+JOB_DEFAULT_TTL_SECONDS = {
+    "trade": 30,
+    "trade_batch": 30,
+    "close_position": 30,
+    "close_positions": 30,
+    "get_positions": 10,
+    "get_account": 10,
+    "get_candles": 15,
+    "deploy": 600,
+    "run": 600,
+    "stop": 600,
+}
+DEFAULT_PRIORITY = 10
+DEFAULT_TTL_SECONDS = 1800
+
+UNIQUE_VIOLATION = "23505"
+
+# Effective priority gains one point per AGING_SECONDS of waiting
+AGING_SECONDS = 10
+
+ARCHIVE_BATCH_SIZE = 5000
+ARCHIVE_MAX_BATCHES = 10
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse_ts(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _is_expired(job: dict, now: Optional[datetime] = None) -> bool:
+    expires_at = _parse_ts(job.get("expires_at"))
+    return expires_at is not None and expires_at <= (now or _now())
+
+
+def _claim_score(job: dict) -> float:
+    """
+    Ascending sort key equivalent to claim_jobs' ordering:
+    priority + age / AGING_SECONDS descending, then created_at ascending.
+    """
+    created_at = _parse_ts(job.get("created_at")) or _now()
+    return created_at.timestamp() - (job.get("priority") or 0) * AGING_SECONDS
+
+
+def _payload_ttl(job: dict) -> int:
+    """Seconds a queued payload is worth keeping: until the job's deadline."""
+    expires_at = _parse_ts(job.get("expires_at"))
+    if expires_at is None:
+        return DEFAULT_TTL_SECONDS
+    return max(int((expires_at - _now()).total_seconds()) + 1, 1)
+
+
+def _first_row(data) -> Optional[dict]:
+    if isinstance(data, list):
+        return data[0] if data else None
+    return data or None
+
+
+class JobQueue(ABC):
+    """Interface every job dispatch backend implements."""
+
+    @abstractmethod
+    async def enqueue(
+        self,
+        user_id: str,
+        job_type: str,
+        input_data: dict,
+        priority: Optional[int] = None,
+        job_id: Optional[str] = None,
+        expires_in: Optional[float] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> Optional[dict]:
+        """
+        Create a pending job. Returns the job row, or None on failure.
+
+        If the user already has a job with `idempotency_key`, that job is
+        returned instead and nothing is enqueued.
+        """
+
+    @abstractmethod
+    async def claim(self, agent_id: str, user_id: str, limit: int) -> List[dict]:
+        """Atomically claim up to `limit` jobs for an agent, in lane order."""
+
+    @abstractmethod
+    async def finish(
+        self,
+        job_id: str,
+        agent_id: str,
+        status: str,
+        output_data: Optional[dict] = None,
+        error_message: Optional[str] = None,
+    ) -> Optional[dict]:
+        """Record (and acknowledge) a job result. Returns the finished row."""
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[dict]:
+        """Read a job's job_type, status, output_data and error_message."""
+
+    @abstractmethod
+    async def expire_stale(self) -> List[dict]:
+        """Expire jobs past their deadline. Returns the expired rows."""
+
+    @abstractmethod
+    async def depth(self) -> List[dict]:
+        """Open jobs as rows of {job_type, status, depth}."""
+
+    @abstractmethod
+    async def archive(self, older_than_days: int) -> int:
+        """Move finished jobs older than N days out of the live queue."""
+
+
+class PostgresJobQueue(JobQueue):
+    """The Supabase `jobs` table, claimed with FOR UPDATE SKIP LOCKED."""
+
+    async def enqueue(
+        self,
+        user_id: str,
+        job_type: str,
+        input_data: dict,
+        priority: Optional[int] = None,
+        job_id: Optional[str] = None,
+        expires_in: Optional[float] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> Optional[dict]:
+        supabase = get_supabase_client()
+
+        job_data = {
+            "user_id": user_id,
+            "job_type": job_type,
+            "input_data": input_data,
+            "status": "pending",
+        }
+        if priority is not None:
+            job_data["priority"] = priority
+        if job_id is not None:
+            job_data["id"] = job_id
+        if expires_in is not None:
+            job_data["expires_at"] = (_now() + timedelta(seconds=expires_in)).isoformat()
+        if idempotency_key is not None:
+            job_data["idempotency_key"] = idempotency_key
+
+        try:
+            response = supabase.table("jobs").insert(job_data).execute()
+        except APIError as e:
+            if idempotency_key is None or e.code != UNIQUE_VIOLATION:
+                raise
+            # Lost the race on jobs_user_idempotency_key_idx - return the winner
+            response = (
+                supabase.table("jobs")
+                .select("*")
+                .eq("user_id", user_id)
+                .eq("idempotency_key", idempotency_key)
+                .execute()
+            )
+
+        return _first_row(response.data)
+
+    async def claim(self, agent_id: str, user_id: str, limit: int) -> List[dict]:
+        supabase = get_supabase_client()
+
+        if limit == 1:
+            response = supabase.rpc(
+                "claim_next_job",
+                {
+                    "p_agent_id": agent_id,
+                },
+            ).execute()
+        else:
+            response = supabase.rpc(
+                "claim_jobs",
+                {
+                    "p_agent_id": agent_id,
+                    "p_limit": limit,
+                },
+            ).execute()
+
+        # RPC returns a SETOF jobs (PostgreSQL) - may be list or single dict
+        jobs = response.data
+        if isinstance(jobs, dict):
+            jobs = [jobs]
+
+        jobs = [job for job in (jobs or []) if job and job.get("id")]
+        # UPDATE ... RETURNING is unordered - restore lane order, oldest first
+        jobs.sort(key=_claim_score)
+        return jobs
+
+    async def finish(
+        self,
+        job_id: str,
+        agent_id: str,
+        status: str,
+        output_data: Optional[dict] = None,
+        error_message: Optional[str] = None,
+    ) -> Optional[dict]:
+        supabase = get_supabase_client()
+
+        response = supabase.rpc(
+            "finish_job",
+            {
+                "p_job_id": job_id,
+                "p_status": status,
+                "p_output_data": output_data,
+                "p_error_message": error_message,
+                "p_agent_id": agent_id,
+            },
+        ).execute()
+
+        return _first_row(response.data)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        supabase = get_supabase_client()
+
+        response = (
+            supabase.table("jobs")
+            .select("job_type, status, output_data, error_message")
+            .eq("id", job_id)
+            .execute()
+        )
+
+        return _first_row(response.data)
+
+    async def expire_stale(self) -> List[dict]:
+        supabase = get_supabase_client()
+        response = supabase.rpc("expire_stale_jobs", {}).execute()
+        return response.data or []
+
+    async def depth(self) -> List[dict]:
+        supabase = get_supabase_client()
+        response = supabase.rpc("job_queue_depth", {}).execute()
+        return response.data or []
+
+    async def archive(self, older_than_days: int) -> int:
+        supabase = get_supabase_client()
+        moved = 0
+
+        # Bounded drain so one sweep never holds the connection for long
+        for _ in range(ARCHIVE_MAX_BATCHES):
+            response = supabase.rpc(
+                "archive_completed_jobs",
+                {
+                    "p_older_than": f"{older_than_days} days",
+                    "p_batch": ARCHIVE_BATCH_SIZE,
+                },
+            ).execute()
+
+            batch = response.data or 0
+            moved += batch
+            if batch < ARCHIVE_BATCH_SIZE:
+                break
+
+        return moved
+
+
+# Atomically move up to ARGV[1] job ids from the pending to the inflight set,
+# scoring inflight entries by their visibility deadline (ARGV[2])
+_CLAIM_SCRIPT = """
+local ids = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #ids == 0 then
+  return ids
+end
+redis.call('ZREM', KEYS[1], unpack(ids))
+for _, id in ipairs(ids) do
+  redis.call('ZADD', KEYS[2], ARGV[2], id)
+end
+return ids
+"""
+
+
+class RedisJobQueue(JobQueue):
+    """
+    Hot queue in Redis with Postgres as the durable record.
+
+    Keys (user id as hash tag so a user's keys share a cluster slot):
+        jobq:{user_id}:pending   ZSET job_id -> claim score
+        jobq:{user_id}:inflight  ZSET job_id -> visibility deadline (epoch)
+        jobq:job:{job_id}        job payload JSON, expiring at the deadline
+        jobq:users               SET of users with queued or in-flight jobs
+
+    Enqueue inserts the Postgres row first (id, defaults and audit), then
+    pushes to Redis. Claims pop from Redis with a Lua script and record the
+    claim in Postgres off the request path. A claimed job that is not
+    acknowledged by finish() within JOB_QUEUE_VISIBILITY_TIMEOUT_SECONDS is
+    redelivered, unless its deadline has passed; expired jobs are left to
+    the Postgres sweeper so a late market order is never replayed.
+    """
+
+    USERS_KEY = "jobq:users"
+
+    def __init__(self, durable: Optional[JobQueue] = None):
+        self.durable = durable or PostgresJobQueue()
+        self._claim_script = None
+
+    @staticmethod
+    def _pending_key(user_id: str) -> str:
+        return f"jobq:{{{user_id}}}:pending"
+
+    @staticmethod
+    def _inflight_key(user_id: str) -> str:
+        return f"jobq:{{{user_id}}}:inflight"
+
+    @staticmethod
+    def _job_key(job_id: str) -> str:
+        return f"jobq:job:{job_id}"
+
+    async def enqueue(
+        self,
+        user_id: str,
+        job_type: str,
+        input_data: dict,
+        priority: Optional[int] = None,
+        job_id: Optional[str] = None,
+        expires_in: Optional[float] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> Optional[dict]:
+        job = await self.durable.enqueue(
+            user_id, job_type, input_data, priority, job_id, expires_in, idempotency_key
+        )
+        if not job:
+            return None
+
+        # An existing job for this idempotency key is already queued
+        if job_id is not None and job["id"] != job_id:
+            return job
+
+        redis = await get_redis()
+        pipe = redis.pipeline(transaction=True)
+        pipe.set(self._job_key(job["id"]), json.dumps(job), ex=_payload_ttl(job))
+        pipe.zadd(self._pending_key(user_id), {job["id"]: _claim_score(job)})
+        pipe.sadd(self.USERS_KEY, user_id)
+        await pipe.execute()
+
+        return job
+
+    async def claim(self, agent_id: str, user_id: str, limit: int) -> List[dict]:
+        settings = get_settings()
+        redis = await get_redis()
+
+        if self._claim_script is None:
+            self._claim_script = redis.register_script(_CLAIM_SCRIPT)
+
+        visible_at = time.time() + settings.JOB_QUEUE_VISIBILITY_TIMEOUT_SECONDS
+        job_ids = await self._claim_script(
+            keys=[self._pending_key(user_id), self._inflight_key(user_id)],
+            args=[limit, visible_at],
+        )
+        if not job_ids:
+            return []
+
+        payloads = await redis.mget([self._job_key(job_id) for job_id in job_ids])
+        now = _now()
+        claimed_at = now.isoformat()
+
+        jobs, expired_ids = [], []
+        for job_id, payload in zip(job_ids, payloads):
+            if not payload:
+                expired_ids.append(job_id)
+                continue
+
+            job = json.loads(payload)
+            if _is_expired(job, now):
+                expired_ids.append(job_id)
+                continue
+
+            job.update(status="claimed", agent_id=agent_id, claimed_at=claimed_at)
+            jobs.append(job)
+
+        if expired_ids:
+            # Dead work is dropped here; the Postgres sweeper expires the rows
+            pipe = redis.pipeline(transaction=False)
+            pipe.zrem(self._inflight_key(user_id), *expired_ids)
+            pipe.delete(*[self._job_key(job_id) for job_id in expired_ids])
+            await pipe.execute()
+
+        if jobs:
+            asyncio.create_task(self._audit_claim(agent_id, jobs, claimed_at))
+
+        return jobs
+
+    async def _audit_claim(self, agent_id: str, jobs: List[dict], claimed_at: str):
+        """Write the claim through to the durable record."""
+        try:
+            supabase = get_supabase_client()
+            await asyncio.to_thread(
+                lambda: supabase.table("jobs")
+                .update(
+                    {
+                        "status": "claimed",
+                        "agent_id": agent_id,
+                        "claimed_at": claimed_at,
+                    }
+                )
+                .in_("id", [job["id"] for job in jobs])
+                .eq("status", "pending")
+                .execute()
+            )
+        except Exception as e:
+            logger.warning(f"Claim audit write failed for agent {agent_id}: {e}")
+
+    async def finish(
+        self,
+        job_id: str,
+        agent_id: str,
+        status: str,
+        output_data: Optional[dict] = None,
+        error_message: Optional[str] = None,
+    ) -> Optional[dict]:
+        job = await self.durable.finish(
+            job_id, agent_id, status, output_data, error_message
+        )
+        if not job:
+            # Rejected (not this agent's claim, or already finished): leave
+            # the payload so a legitimate result or redelivery still works
+            return None
+
+        # Acknowledge: stop redelivery and drop the payload
+        redis = await get_redis()
+        pipe = redis.pipeline(transaction=False)
+        pipe.zrem(self._inflight_key(job["user_id"]), job_id)
+        pipe.delete(self._job_key(job_id))
+        await pipe.execute()
+
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.durable.get(job_id)
+
+    async def requeue_unacked(self) -> int:
+        """
+        Redeliver claimed jobs whose visibility timeout elapsed unacknowledged.
+
+        Also drops pending entries whose payload expired, so users whose
+        agent never claims do not accumulate dead entries.
+        """
+        redis = await get_redis()
+        now = time.time()
+        requeued = 0
+
+        for user_id in await redis.smembers(self.USERS_KEY):
+            pending_key = self._pending_key(user_id)
+            pending_ids = await redis.zrange(pending_key, 0, -1)
+            if pending_ids:
+                payloads = await redis.mget(
+                    [self._job_key(job_id) for job_id in pending_ids]
+                )
+                dead_ids = [
+                    job_id
+                    for job_id, payload in zip(pending_ids, payloads)
+                    if not payload
+                ]
+                if dead_ids:
+                    await redis.zrem(pending_key, *dead_ids)
+
+            inflight_key = self._inflight_key(user_id)
+            stale_ids = await redis.zrangebyscore(inflight_key, "-inf", now)
+
+            for job_id in stale_ids:
+                # ZREM guards against a concurrent finish() or second requeuer
+                if not await redis.zrem(inflight_key, job_id):
+                    continue
+
+                payload = await redis.get(self._job_key(job_id))
+                if not payload or _is_expired(json.loads(payload)):
+                    await redis.delete(self._job_key(job_id))
+                    continue
+
+                job = json.loads(payload)
+                await redis.zadd(pending_key, {job_id: _claim_score(job)})
+                requeued += 1
+
+            if not await redis.exists(pending_key, inflight_key):
+                await redis.srem(self.USERS_KEY, user_id)
+
+        return requeued
+
+    async def expire_stale(self) -> List[dict]:
+        requeued = await self.requeue_unacked()
+        if requeued:
+            logger.info(f"Redelivering {requeued} unacknowledged jobs")
+
+        return await self.durable.expire_stale()
+
+    async def depth(self) -> List[dict]:
+        return await self.durable.depth()
+
+    async def archive(self, older_than_days: int) -> int:
+        return await self.durable.archive(older_than_days)
+
+
+class InMemoryJobQueue(JobQueue):
+    """
+    Process-local stand-in with the Postgres backend's claim ordering and
+    deadlines. finish() does not propagate to other tables.
+    """
+
+    def __init__(self):
+        self.jobs: Dict[str, dict] = {}
+        self._lock = asyncio.Lock()
+
+    async def enqueue(
+        self,
+        user_id: str,
+        job_type: str,
+        input_data: dict,
+        priority: Optional[int] = None,
+        job_id: Optional[str] = None,
+        expires_in: Optional[float] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> Optional[dict]:
+        if idempotency_key is not None:
+            for job in self.jobs.values():
+                if (
+                    job["user_id"] == user_id
+                    and job["idempotency_key"] == idempotency_key
+                ):
+                    return dict(job)
+
+        now = _now()
+        if expires_in is None:
+            expires_in = JOB_DEFAULT_TTL_SECONDS.get(job_type, DEFAULT_TTL_SECONDS)
+
+        job = {
+            "id": job_id or str(uuid.uuid4()),
+            "user_id": user_id,
+            "job_type": job_type,
+            "input_data": input_data,
+            "status": "pending",
+            "priority": priority
+            if priority is not None
+            else JOB_DEFAULT_PRIORITY.get(job_type, DEFAULT_PRIORITY),
+            "output_data": None,
+            "error_message": None,
+            "agent_id": None,
+            "created_at": now.isoformat(),
+            "claimed_at": None,
+            "completed_at": None,
+            "expires_at": (now + timedelta(seconds=expires_in)).isoformat(),
+            "idempotency_key": idempotency_key,
+        }
+        self.jobs[job["id"]] = job
+        return dict(job)
+
+    async def claim(self, agent_id: str, user_id: str, limit: int) -> List[dict]:
+        async with self._lock:
+            now = _now()
+            pending = sorted(
+                (
+                    job
+                    for job in self.jobs.values()
+                    if job["user_id"] == user_id
+                    and job["status"] == "pending"
+                    and not _is_expired(job, now)
+                ),
+                key=_claim_score,
+            )[:limit]
+
+            for job in pending:
+                job.update(
+                    status="claimed", agent_id=agent_id, claimed_at=now.isoformat()
+                )
+
+            return [dict(job) for job in pending]
+
+    async def finish(
+        self,
+        job_id: str,
+        agent_id: str,
+        status: str,
+        output_data: Optional[dict] = None,
+        error_message: Optional[str] = None,
+    ) -> Optional[dict]:
+        job = self.jobs.get(job_id)
+        if (
+            not job
+            or job["status"] not in ("pending", "claimed")
+            or job["agent_id"] != agent_id
+        ):
+            return None
+
+        job.update(
+            status=status,
+            output_data=output_data,
+            error_message=error_message,
+            completed_at=_now().isoformat(),
+        )
+        return dict(job)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        job = self.jobs.get(job_id)
+        if not job:
+            return None
+        return {
+            key: job[key]
+            for key in ("job_type", "status", "output_data", "error_message")
+        }
+
+    async def expire_stale(self) -> List[dict]:
+        now = _now()
+        expired = []
+
+        for job in self.jobs.values():
+            if job["status"] == "pending" and _is_expired(job, now):
+                job.update(
+                    status="expired",
+                    error_message="deadline_exceeded",
+                    completed_at=now.isoformat(),
+                )
+                expired.append(dict(job))
+
+        return expired
+
+    async def depth(self) -> List[dict]:
+        counts: Dict[tuple, int] = {}
+        for job in self.jobs.values():
+            if job["status"] in ("pending", "claimed"):
+                key = (job["job_type"], job["status"])
+                counts[key] = counts.get(key, 0) + 1
+
+        return [
+            {"job_type": job_type, "status": status, "depth": depth}
+            for (job_type, status), depth in counts.items()
+        ]
+
+    async def archive(self, older_than_days: int) -> int:
+        cutoff = _now() - timedelta(days=older_than_days)
+        finished = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job["status"] in ("completed", "failed", "expired", "cancelled")
+            and (_parse_ts(job["completed_at"]) or cutoff) < cutoff
+        ]
+
+        for job_id in finished:
+            del self.jobs[job_id]
+
+        return len(finished)
+
+
+_job_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    """Get the configured job queue backend singleton."""
+    global _job_queue
+
+    if _job_queue is None:
+        backend = get_settings().JOB_QUEUE_BACKEND.lower()
+
+        if backend == "redis":
+            _job_queue = RedisJobQueue()
+        elif backend == "memory":
+            _job_queue = InMemoryJobQueue()
+        elif backend == "postgres":
+            _job_queue = PostgresJobQueue()
+        else:
+            raise ValueError(f"Unknown JOB_QUEUE_BACKEND: {backend}")
+
+    return _job_queue
+
+
+def set_job_queue(queue: Optional[JobQueue]):
+    """Override the job queue backend (None resets to the configured one)."""
+    global _job_queue
+    _job_queue = queue
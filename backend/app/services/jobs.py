@@ -0,0 +1,547 @@
+"""
+Job Service
+Job creation, agent wakeup signalling and job-completion futures
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Optional, Set, Tuple
+from app.core.config import get_settings
+from app.core.metrics import (
+    JOB_ENQUEUE_SECONDS,
+    JOBS_DEDUPLICATED,
+    JOBS_ENQUEUED,
+    JOBS_EXPIRED,
+    set_queue_depth,
+)
+from app.core.redis import get_redis, release_lease, renew_lease
+from app.services.job_outputs import resolve_job_output
+from app.services.job_queue import get_job_queue
+
+logger = logging.getLogger(__name__)
+
+
+JOB_WAKEUP_PREFIX = "jobs:wakeup:"
+JOB_DONE_PREFIX = "jobs:done:"
+READ_JOB_INFLIGHT_PREFIX = "jobs:inflight:"
+READ_JOB_RESULT_PREFIX = "jobs:result:"
+IDEMPOTENCY_PREFIX = "jobs:idem:"
+FINISHED_JOB_STATUSES = ("completed", "failed", "expired")
+
+# Lower bound of each priority lane (mirrors job_priority_lane() in SQL);
+# per job_type defaults live in job_default_priority()
+JOB_PRIORITY_LANES = (
+    (100, "trade"),
+    (70, "interactive"),
+    (50, "market_data"),
+    (30, "deployment"),
+    (0, "housekeeping"),
+)
+
+
+class IdempotencyKeyConflict(ValueError):
+    """An idempotency key was reused for a different request."""
+
+
+def job_payload_hash(job_type: str, input_data: dict) -> str:
+    """Fingerprint of a job request, to tell a retry from a reused key."""
+    canonical = json.dumps(
+        [job_type, input_data], sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+def job_lane(priority: Optional[int]) -> str:
+    """Map a job priority to its lane name."""
+    for floor, lane in JOB_PRIORITY_LANES:
+        if (priority or 0) >= floor:
+            return lane
+    return "housekeeping"
+
+
+async def _reserve_idempotency_key(
+    user_id: str, idempotency_key: str, job_id: str, payload_hash: str
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Bind an idempotency key to `job_id` and the request's payload hash in Redis.
+
+    Returns (job id, payload hash) already bound to the key, or
+    (None, None) if this call won (or Redis is unavailable and the unique
+    index has to decide).
+    """
+    settings = get_settings()
+    key = f"{IDEMPOTENCY_PREFIX}{user_id}:{idempotency_key}"
+
+    try:
+        redis = await get_redis()
+        if await redis.set(
+            key,
+            f"{job_id}:{payload_hash}",
+            nx=True,
+            ex=settings.JOB_IDEMPOTENCY_TTL_SECONDS,
+        ):
+            return None, None
+        existing = await redis.get(key)
+    except Exception as e:
+        logger.warning(f"Idempotency key check failed for user {user_id}: {e}")
+        return None, None
+
+    if not existing:
+        return None, None
+    existing_id, _, existing_hash = existing.partition(":")
+    return existing_id, existing_hash or None
+
+
+async def _release_idempotency_key(user_id: str, idempotency_key: str):
+    try:
+        redis = await get_redis()
+        await redis.delete(f"{IDEMPOTENCY_PREFIX}{user_id}:{idempotency_key}")
+    except Exception:
+        pass
+
+
+async def enqueue_job(
+    user_id: str,
+    job_type: str,
+    input_data: dict,
+    priority: Optional[int] = None,
+    job_id: Optional[str] = None,
+    expires_in: Optional[float] = None,
+    idempotency_key: Optional[str] = None,
+    verify_payload: bool = False,
+) -> Optional[dict]:
+    """
+    Enqueue a pending job and wake any agent long-polling for this user.
+
+    `priority` and `expires_in` (seconds) override the per job_type
+    defaults; `job_id` lets callers publish the id before the job exists.
+
+    With `idempotency_key`, a repeat submission by the same user returns the
+    original job marked `"replayed": True` instead of enqueuing another.
+    Redis answers most repeats; jobs_user_idempotency_key_idx is the
+    durable guarantee. With `verify_payload`, a repeat whose job_type or
+    input differs from the original raises IdempotencyKeyConflict.
+
+    Returns:
+        The inserted (or original) job row, or None if the insert returned
+        nothing.
+    """
+    if idempotency_key is not None:
+        job_id = job_id or str(uuid.uuid4())
+        payload_hash = job_payload_hash(job_type, input_data)
+        existing_id, existing_hash = await _reserve_idempotency_key(
+            user_id, idempotency_key, job_id, payload_hash
+        )
+        if existing_id:
+            if verify_payload and existing_hash not in (None, payload_hash):
+                raise IdempotencyKeyConflict(idempotency_key)
+            JOBS_DEDUPLICATED.labels(job_type=job_type).inc()
+            return {"id": existing_id, "job_type": job_type, "replayed": True}
+
+    with JOB_ENQUEUE_SECONDS.labels(job_type=job_type).time():
+        try:
+            job = await get_job_queue().enqueue(
+                user_id,
+                job_type,
+                input_data,
+                priority,
+                job_id,
+                expires_in,
+                idempotency_key,
+            )
+        except Exception:
+            if idempotency_key is not None:
+                await _release_idempotency_key(user_id, idempotency_key)
+            raise
+
+        if not job:
+            if idempotency_key is not None:
+                await _release_idempotency_key(user_id, idempotency_key)
+            return None
+
+        if idempotency_key is not None and job["id"] != job_id:
+            if verify_payload and "input_data" in job and job_payload_hash(
+                job.get("job_type"), job["input_data"]
+            ) != payload_hash:
+                raise IdempotencyKeyConflict(idempotency_key)
+            JOBS_DEDUPLICATED.labels(job_type=job_type).inc()
+            return {**job, "replayed": True}
+
+        JOBS_ENQUEUED.labels(job_type=job_type).inc()
+
+        try:
+            redis = await get_redis()
+            await redis.publish(f"{JOB_WAKEUP_PREFIX}{user_id}", job["id"])
+        except Exception as e:
+            # Agents still pick the job up when their long-poll times out
+            logger.warning(f"Job wakeup publish failed for user {user_id}: {e}")
+
+    return job
+
+
+class JobWakeupListener:
+    """Fans Redis job wakeup signals out to parked agent long-polls."""
+
+    def __init__(self):
+        self.waiters: Dict[str, Set[asyncio.Event]] = {}
+
+    def register(self, user_id: str) -> asyncio.Event:
+        """Register a waiter for a user's job wakeups."""
+        event = asyncio.Event()
+        self.waiters.setdefault(user_id, set()).add(event)
+        return event
+
+    def unregister(self, user_id: str, event: asyncio.Event):
+        """Remove a waiter."""
+        if user_id in self.waiters:
+            self.waiters[user_id].discard(event)
+
+            if not self.waiters[user_id]:
+                del self.waiters[user_id]
+
+    def notify(self, user_id: str):
+        """Wake every waiter parked for a user."""
+        for event in self.waiters.get(user_id, ()):
+            event.set()
+
+    async def start_redis_subscriber(self):
+        """Start Redis pub/sub listener with automatic reconnection."""
+        retry_delay = 1
+        max_delay = 30
+
+        while True:
+            try:
+                redis = await get_redis()
+                pubsub = redis.pubsub()
+                await pubsub.psubscribe(f"{JOB_WAKEUP_PREFIX}*")
+
+                retry_delay = 1
+                logger.info("Job wakeup subscriber connected")
+
+                async for message in pubsub.listen():
+                    if message["type"] == "pmessage":
+                        channel = message.get("channel", "")
+                        if channel.startswith(JOB_WAKEUP_PREFIX):
+                            self.notify(channel[len(JOB_WAKEUP_PREFIX):])
+
+            except asyncio.CancelledError:
+                logger.info("Job wakeup subscriber cancelled")
+                try:
+                    await pubsub.punsubscribe(f"{JOB_WAKEUP_PREFIX}*")
+                except Exception:
+                    pass
+                raise
+            except Exception as e:
+                logger.warning(
+                    f"Job wakeup subscriber error: {e}. Reconnecting in {retry_delay}s..."
+                )
+                # Parked long-polls re-check the queue rather than miss a job
+                for user_id in list(self.waiters):
+                    self.notify(user_id)
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, max_delay)
+
+
+async def publish_job_result(
+    job_id: str,
+    status: str,
+    output_data: Optional[dict] = None,
+    error_message: Optional[str] = None,
+):
+    """Announce a finished job to every worker awaiting it."""
+    try:
+        redis = await get_redis()
+        await redis.publish(
+            f"{JOB_DONE_PREFIX}{job_id}",
+            json.dumps(
+                {
+                    "status": status,
+                    "output_data": output_data,
+                    "error_message": error_message,
+                }
+            ),
+        )
+    except Exception as e:
+        # Waiters fall back to a final row read when their timeout expires
+        logger.warning(f"Job result publish failed for job {job_id}: {e}")
+
+
+async def _read_finished_job(job_id: str) -> Optional[dict]:
+    """Read a job, returning it only once the agent has reported."""
+    job = await get_job_queue().get(job_id)
+
+    if job and job["status"] in FINISHED_JOB_STATUSES:
+        return job
+
+    return None
+
+
+class JobResultWaiter:
+    """Resolves in-process futures when any worker publishes a job result."""
+
+    def __init__(self):
+        self.futures: Dict[str, Set[asyncio.Future]] = {}
+
+    def resolve(self, job_id: str, result: dict):
+        """Resolve every future waiting on a job."""
+        for future in self.futures.pop(job_id, ()):
+            if not future.done():
+                future.set_result(result)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        """
+        Wait for a job to finish.
+
+        Returns:
+            {"status", "output_data", "error_message"} once the agent reports,
+            or None if the job is still unfinished after `timeout` seconds.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.futures.setdefault(job_id, set()).add(future)
+
+        try:
+            # The agent may have reported before the future was registered
+            result = await _read_finished_job(job_id)
+
+            if not result:
+                try:
+                    result = await asyncio.wait_for(future, timeout=timeout)
+                except asyncio.TimeoutError:
+                    # Covers a result published while Redis was unavailable
+                    result = await _read_finished_job(job_id)
+
+            if result:
+                # Offloaded outputs are fetched only by whoever reads them
+                result = {
+                    **result,
+                    "output_data": await resolve_job_output(result.get("output_data")),
+                }
+
+            return result
+        finally:
+            waiters = self.futures.get(job_id)
+            if waiters is not None:
+                waiters.discard(future)
+                if not waiters:
+                    del self.futures[job_id]
+
+    async def start_redis_subscriber(self):
+        """Start Redis pub/sub listener with automatic reconnection."""
+        retry_delay = 1
+        max_delay = 30
+
+        while True:
+            try:
+                redis = await get_redis()
+                pubsub = redis.pubsub()
+                await pubsub.psubscribe(f"{JOB_DONE_PREFIX}*")
+
+                retry_delay = 1
+                logger.info("Job result subscriber connected")
+
+                async for message in pubsub.listen():
+                    if message["type"] == "pmessage":
+                        channel = message.get("channel", "")
+                        if channel.startswith(JOB_DONE_PREFIX):
+                            self.resolve(
+                                channel[len(JOB_DONE_PREFIX):],
+                                json.loads(message["data"]),
+                            )
+
+            except asyncio.CancelledError:
+                logger.info("Job result subscriber cancelled")
+                try:
+                    await pubsub.punsubscribe(f"{JOB_DONE_PREFIX}*")
+                except Exception:
+                    pass
+                raise
+            except Exception as e:
+                logger.warning(
+                    f"Job result subscriber error: {e}. Reconnecting in {retry_delay}s..."
+                )
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, max_delay)
+
+
+def job_age(job: dict) -> Optional[float]:
+    """Seconds since a job was enqueued, or None."""
+    created_at = job.get("created_at")
+    if not created_at:
+        return None
+
+    created = datetime.fromisoformat(created_at.replace("Z", "+00:00"))
+    return (datetime.now(timezone.utc) - created).total_seconds()
+
+
+def job_expires_in(job: dict) -> Optional[float]:
+    """Seconds until a job's deadline (negative once passed), or None."""
+    expires_at = job.get("expires_at")
+    if not expires_at:
+        return None
+
+    deadline = datetime.fromisoformat(expires_at.replace("Z", "+00:00"))
+    return (deadline - datetime.now(timezone.utc)).total_seconds()
+
+
+async def sweep_expired_jobs():
+    """
+    Periodically expire dead jobs and resolve anyone still waiting on them.
+
+    Also samples open-job counts for the queue depth metric and, every
+    JOB_ARCHIVE_INTERVAL_SECONDS, archives finished jobs older than
+    JOB_ARCHIVE_AFTER_DAYS.
+    """
+    settings = get_settings()
+    loop = asyncio.get_running_loop()
+    next_archive_at = loop.time()
+
+    while True:
+        try:
+            await asyncio.sleep(settings.JOB_SWEEP_INTERVAL_SECONDS)
+
+            queue = get_job_queue()
+            expired = await queue.expire_stale()
+
+            for job in expired:
+                JOBS_EXPIRED.labels(job_type=job.get("job_type") or "unknown").inc()
+                await publish_job_result(
+                    job["id"], "expired", None, job.get("error_message")
+                )
+
+            if expired:
+                logger.info(f"Expired {len(expired)} stale jobs")
+
+            set_queue_depth(await queue.depth())
+
+            if loop.time() >= next_archive_at:
+                next_archive_at = loop.time() + settings.JOB_ARCHIVE_INTERVAL_SECONDS
+                archived = await queue.archive(settings.JOB_ARCHIVE_AFTER_DAYS)
+                if archived:
+                    logger.info(f"Archived {archived} finished jobs")
+
+        except asyncio.CancelledError:
+            logger.info("Job sweeper cancelled")
+            raise
+        except Exception as e:
+            logger.warning(f"Job sweep failed: {e}")
+
+
+# Singleton instances
+job_wakeups = JobWakeupListener()
+job_results = JobResultWaiter()
+
+
+# In-flight coalesced reads on this worker: coalescing key -> shared task
+_inflight_reads: Dict[str, asyncio.Future] = {}
+
+
+def read_job_key(user_id: str, job_type: str, input_data: dict) -> str:
+    """Coalescing key for a read job: same user, type and input."""
+    canonical = json.dumps(input_data, sort_keys=True, separators=(",", ":"))
+    digest = hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+    return f"{user_id}:{job_type}:{digest}"
+
+
+async def _run_coalesced_read(
+    key: str,
+    user_id: str,
+    job_type: str,
+    input_data: dict,
+    timeout: float,
+) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Returns:
+        (result, user whose agent ran the job - None when this worker
+        followed another worker's job or served a cached result)
+    """
+    settings = get_settings()
+    redis = await get_redis()
+
+    cached = await redis.get(f"{READ_JOB_RESULT_PREFIX}{key}")
+    if cached:
+        return json.loads(cached), None
+
+    # Lease the in-flight slot across workers; the job id is published
+    # before the insert so followers can wait on it immediately
+    inflight_key = f"{READ_JOB_INFLIGHT_PREFIX}{key}"
+    job_id = str(uuid.uuid4())
+    lease = settings.READ_JOB_LEASE_SECONDS
+
+    while not await redis.set(inflight_key, job_id, nx=True, ex=lease):
+        leader_job_id = await redis.get(inflight_key)
+        if leader_job_id:
+            return await job_results.wait(leader_job_id, timeout), None
+        # The leader released between SET NX and GET: try to lead again
+        # rather than running without the lease
+
+    # Renewed while the job is pending, so a slow agent does not let a
+    # second fetch start; a crashed leader's lease lapses within `lease`
+    renewal = asyncio.create_task(renew_lease(inflight_key, job_id, lease))
+
+    try:
+        job = await enqueue_job(user_id, job_type, input_data, job_id=job_id)
+        if not job:
+            return None, user_id
+
+        result = await job_results.wait(job_id, timeout)
+
+        if result and result["status"] == "completed":
+            await redis.setex(
+                f"{READ_JOB_RESULT_PREFIX}{key}",
+                settings.READ_JOB_RESULT_TTL_SECONDS,
+                json.dumps(result),
+            )
+
+        return result, user_id
+    finally:
+        renewal.cancel()
+        await release_lease(inflight_key, job_id)
+
+
+async def run_read_job(
+    user_id: str,
+    job_type: str,
+    input_data: dict,
+    timeout: float,
+    coalesce_key: Optional[str] = None,
+) -> Optional[dict]:
+    """
+    Run a read-only agent job with single-flight coalescing.
+
+    Concurrent identical requests (same user, job_type and input, or the
+    same `coalesce_key` when the caller knows results are interchangeable)
+    share one job, on this worker via a shared task and across workers via
+    a renewing Redis lease. Completed results are cached for
+    READ_JOB_RESULT_TTL_SECONDS to absorb bursts.
+
+    A `coalesce_key` job runs on the first caller's agent. If that agent
+    does not complete it, other users' callers retry once on their own.
+
+    Returns:
+        The job result as from JobResultWaiter.wait, or None on timeout.
+    """
+    key = coalesce_key or read_job_key(user_id, job_type, input_data)
+
+    task = _inflight_reads.get(key)
+    if task is None:
+        task = asyncio.ensure_future(
+            _run_coalesced_read(key, user_id, job_type, input_data, timeout)
+        )
+        _inflight_reads[key] = task
+        task.add_done_callback(lambda _: _inflight_reads.pop(key, None))
+
+    # Shield so one disconnecting caller does not cancel the shared fetch
+    result, ran_for = await asyncio.shield(task)
+
+    if coalesce_key is None or ran_for == user_id:
+        return result
+    if result is not None and result["status"] == "completed":
+        return result
+
+    # The shared job went to another user's agent, which is offline or
+    # could not serve it; ask the caller's own agent instead
+    return await run_read_job(user_id, job_type, input_data, timeout)
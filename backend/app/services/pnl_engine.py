@@ -0,0 +1,326 @@
+"""
+Unrealized P&L Engine
+Vectorized mark-to-market of every open position on the price tick stream
+
+Open positions come from agent-pushed account snapshots and are grouped
+per symbol into NumPy arrays. A tick re-marks every position in its
+symbol in one pass and folds the result into per-user totals with
+np.bincount; aggregates are published on pnl:{user_id} at most every
+PNL_PUBLISH_INTERVAL_SECONDS.
+
+Every worker starts the engine, but it only runs in the one holding the
+leader lease, so each tick is marked and published once per deployment.
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+from app.core.config import get_settings
+from app.core.redis import get_redis, release_lease, renew_lease
+from app.services.account_state import ACCOUNT_STATE_PREFIX
+
+logger = logging.getLogger(__name__)
+
+
+PNL_PREFIX = "pnl:"
+PNL_LEADER_KEY = "pnl_engine:leader"
+
+# (side, volume, open_price, contract_size, conversion, offset)
+PositionRow = Tuple[float, float, float, float, float, float]
+
+
+def position_row(position: dict) -> Optional[PositionRow]:
+    """
+    Convert an agent position into engine columns.
+
+    `conversion` (quote to account currency) is derived from the agent's
+    pnl_per_price; `offset` anchors the model to the agent's reported P&L
+    at its current_price, absorbing rounding and conversion drift.
+    Returns None for positions that cannot be marked.
+    """
+    try:
+        side = 1.0 if position["side"] == "buy" else -1.0
+        volume = float(position["volume"])
+        open_price = float(position["open_price"])
+        current_price = float(position["current_price"])
+        pnl = float(position["pnl"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    pnl_per_price = position.get("pnl_per_price")
+    contract_size = position.get("contract_size") or (
+        pnl_per_price / volume if pnl_per_price and volume else None
+    )
+    if not contract_size or not volume:
+        return None
+
+    conversion = pnl_per_price / (volume * contract_size) if pnl_per_price else 1.0
+    exposure = volume * contract_size * conversion
+    offset = pnl - side * (current_price - open_price) * exposure
+
+    return (side, volume, open_price, float(contract_size), conversion, offset)
+
+
+class SymbolBook:
+    """Open positions in one symbol across all users, as parallel arrays."""
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.rows: Dict[str, List[PositionRow]] = {}
+        self.users: List[str] = []
+        self.dirty = True
+        self._set_columns([])
+
+    def set_user_positions(self, user_id: str, rows: List[PositionRow]):
+        """Replace a user's positions; arrays are rebuilt on the next tick."""
+        if rows:
+            self.rows[user_id] = rows
+        else:
+            self.rows.pop(user_id, None)
+        self.dirty = True
+
+    def _set_columns(self, flat: List[tuple]):
+        columns = np.array(flat, dtype=np.float64).reshape(-1, 7).T
+        self.user_index = columns[0].astype(np.intp)
+        (
+            self.side,
+            self.volume,
+            self.open_price,
+            self.contract_size,
+            self.conversion,
+            self.offset,
+        ) = columns[1:]
+        self.exposure = self.volume * self.contract_size * self.conversion
+        self.pnl = self.offset.copy()
+
+    def _rebuild(self):
+        self.users = list(self.rows)
+        self._set_columns(
+            [
+                (index, *row)
+                for index, user_id in enumerate(self.users)
+                for row in self.rows[user_id]
+            ]
+        )
+        self.dirty = False
+
+    def mark(self, bid: float, ask: float) -> Dict[str, float]:
+        """
+        Re-mark every position at a tick (longs at bid, shorts at ask).
+
+        Returns:
+            Unrealized P&L per user for this symbol.
+        """
+        if self.dirty:
+            self._rebuild()
+        if not self.users:
+            return {}
+
+        mark = np.where(self.side > 0, bid, ask)
+        self.pnl = self.side * (mark - self.open_price) * self.exposure + self.offset
+        totals = np.bincount(self.user_index, weights=self.pnl, minlength=len(self.users))
+        return dict(zip(self.users, totals.tolist()))
+
+
+class PnLEngine:
+    """Holds every user's open positions and publishes throttled P&L aggregates."""
+
+    def __init__(self):
+        self.books: Dict[str, SymbolBook] = {}
+        self.user_symbols: Dict[str, Set[str]] = {}
+        self.user_pnl: Dict[str, Dict[str, float]] = {}
+        self.balances: Dict[str, float] = {}
+        self.dirty_users: Set[str] = set()
+
+    def update_positions(self, user_id: str, state: dict):
+        """Load a user's positions from an agent snapshot."""
+        by_symbol: Dict[str, List[PositionRow]] = {}
+        reported: Dict[str, float] = {}
+        for position in state.get("positions") or []:
+            row = position_row(position)
+            if row is None:
+                continue
+            symbol = position["symbol"]
+            by_symbol.setdefault(symbol, []).append(row)
+            reported[symbol] = reported.get(symbol, 0.0) + float(position["pnl"])
+
+        for symbol in self.user_symbols.get(user_id, set()) - by_symbol.keys():
+            book = self.books[symbol]
+            book.set_user_positions(user_id, [])
+            if not book.rows:
+                del self.books[symbol]
+
+        for symbol, rows in by_symbol.items():
+            book = self.books.get(symbol)
+            if book is None:
+                book = self.books[symbol] = SymbolBook(symbol)
+            book.set_user_positions(user_id, rows)
+
+        self.user_symbols[user_id] = set(by_symbol)
+        self.user_pnl[user_id] = reported
+        self.balances[user_id] = float((state.get("account") or {}).get("balance", 0.0))
+        self.dirty_users.add(user_id)
+
+    def on_tick(self, symbol: str, bid: float, ask: float):
+        """Re-mark every position in `symbol` in one vectorized pass."""
+        book = self.books.get(symbol)
+        if book is None:
+            return
+
+        for user_id, total in book.mark(bid, ask).items():
+            self.user_pnl[user_id][symbol] = total
+            self.dirty_users.add(user_id)
+
+    def aggregate(self, user_id: str) -> dict:
+        """Unrealized P&L, equity estimate and per-symbol breakdown for a user."""
+        by_symbol = self.user_pnl.get(user_id, {})
+        unrealized = sum(by_symbol.values())
+        return {
+            "unrealized_pnl": round(unrealized, 2),
+            "equity": round(self.balances.get(user_id, 0.0) + unrealized, 2),
+            "by_symbol": {symbol: round(pnl, 2) for symbol, pnl in by_symbol.items()},
+            "ts": time.time(),
+        }
+
+    async def publish_aggregates(self):
+        """Publish aggregates for users whose P&L moved, at a throttled rate."""
+        settings = get_settings()
+
+        while True:
+            try:
+                await asyncio.sleep(settings.PNL_PUBLISH_INTERVAL_SECONDS)
+                if not self.dirty_users:
+                    continue
+
+                users, self.dirty_users = self.dirty_users, set()
+                redis = await get_redis()
+                pipe = redis.pipeline(transaction=False)
+                for user_id in users:
+                    message = json.dumps(self.aggregate(user_id), separators=(",", ":"))
+                    pipe.set(
+                        f"{PNL_PREFIX}{user_id}",
+                        message,
+                        ex=settings.ACCOUNT_STATE_TTL_SECONDS,
+                    )
+                    pipe.publish(f"{PNL_PREFIX}{user_id}", message)
+
+                    # Users without open positions get one final zero, then drop out
+                    if not self.user_symbols.get(user_id):
+                        self._forget(user_id)
+                await pipe.execute()
+
+            except asyncio.CancelledError:
+                logger.info("P&L publisher cancelled")
+                raise
+            except Exception as e:
+                logger.warning(f"P&L publish failed: {e}")
+
+    async def run(self):
+        """
+        Compete for the leader lease and run the engine while holding it.
+
+        The lease is renewed like a coalesced read's; a crashed leader's
+        lapses within PNL_LEADER_LEASE_SECONDS and another worker takes
+        over, loading positions from the agents' next state pushes.
+        """
+        settings = get_settings()
+        lease = settings.PNL_LEADER_LEASE_SECONDS
+        token = str(uuid.uuid4())
+
+        while True:
+            try:
+                redis = await get_redis()
+                if not await redis.set(PNL_LEADER_KEY, token, nx=True, ex=lease):
+                    await asyncio.sleep(lease / 3)
+                    continue
+
+                logger.info("P&L engine leader elected")
+                tasks = [
+                    asyncio.create_task(self.start_redis_subscriber()),
+                    asyncio.create_task(self.publish_aggregates()),
+                ]
+                try:
+                    # Returns once another worker holds the lease
+                    await renew_lease(PNL_LEADER_KEY, token, lease)
+                    logger.warning("P&L engine lost its leader lease")
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    self._reset()
+                    await release_lease(PNL_LEADER_KEY, token)
+
+            except asyncio.CancelledError:
+                logger.info("P&L engine cancelled")
+                raise
+            except Exception as e:
+                logger.warning(f"P&L engine leader election failed: {e}")
+                await asyncio.sleep(lease)
+
+    def _reset(self):
+        """Drop all state; a new leader rebuilds it from fresh snapshots."""
+        self.books.clear()
+        self.user_symbols.clear()
+        self.user_pnl.clear()
+        self.balances.clear()
+        self.dirty_users.clear()
+
+    def _forget(self, user_id: str):
+        self.user_symbols.pop(user_id, None)
+        self.user_pnl.pop(user_id, None)
+        self.balances.pop(user_id, None)
+
+    async def start_redis_subscriber(self):
+        """Start Redis pub/sub listener with automatic reconnection."""
+        retry_delay = 1  # Start with 1 second
+        max_delay = 30  # Max 30 seconds
+        patterns = (f"{ACCOUNT_STATE_PREFIX}*", "prices:*")
+
+        while True:
+            try:
+                redis = await get_redis()
+                pubsub = redis.pubsub()
+                await pubsub.psubscribe(*patterns)
+
+                # Reset retry delay on successful connection
+                retry_delay = 1
+
+                logger.info("P&L engine subscriber connected")
+
+                async for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+
+                    channel = message.get("channel", "")
+                    if channel.startswith("prices:"):
+                        if channel[7:] in self.books:
+                            tick = json.loads(message["data"])
+                            self.on_tick(channel[7:], tick["bid"], tick["ask"])
+                    elif channel.startswith(ACCOUNT_STATE_PREFIX):
+                        self.update_positions(
+                            channel[len(ACCOUNT_STATE_PREFIX):],
+                            json.loads(message["data"]),
+                        )
+
+            except asyncio.CancelledError:
+                logger.info("P&L engine subscriber cancelled")
+                try:
+                    await pubsub.punsubscribe(*patterns)
+                except Exception:
+                    pass
+                raise
+            except Exception as e:
+                logger.warning(
+                    f"P&L engine subscriber error: {e}. Reconnecting in {retry_delay}s..."
+                )
+                await asyncio.sleep(retry_delay)
+                # Exponential backoff
+                retry_delay = min(retry_delay * 2, max_delay)
+
+
+# Singleton instance
+pnl_engine = PnLEngine()
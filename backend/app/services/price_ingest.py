@@ -0,0 +1,118 @@
+"""
+Price Ingest Service
+Fast path for agent price pushes: raw body -> tick tuples -> Redis
+"""
+
+import json
+import math
+from datetime import datetime, timezone
+from typing import List, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+if orjson is not None:
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+else:
+    _loads = json.loads
+
+    def _dumps(obj) -> str:
+        return json.dumps(obj, separators=(",", ":"))
+
+
+# (instrument, bid, ask)
+Tick = Tuple[str, float, float]
+
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack")
+MAX_INSTRUMENT_LENGTH = 32
+
+
+class PriceIngestError(ValueError):
+    """Raised when a price payload cannot be decoded."""
+
+
+def decode_price_payload(body: bytes, content_type: str = "") -> Tuple[List[Tick], int]:
+    """
+    Decode an agent price push into tick tuples.
+
+    Accepts either the agent's flat shape ``{"EURUSD": {"bid": .., "ask": ..}}``
+    or the legacy ``{"instrument": {...}}`` envelope, as JSON or msgpack.
+    Ticks with non-finite, non-positive or crossed prices are dropped.
+
+    Returns:
+        (ticks, rejected_count)
+    """
+    try:
+        if content_type.startswith(MSGPACK_CONTENT_TYPES):
+            if msgpack is None:
+                raise PriceIngestError("msgpack payloads are not supported")
+            payload = msgpack.unpackb(body, raw=False)
+        else:
+            payload = _loads(body)
+    except PriceIngestError:
+        raise
+    except Exception as e:
+        raise PriceIngestError("Malformed price payload") from e
+
+    if not isinstance(payload, dict):
+        raise PriceIngestError("Price payload must be an object")
+
+    instruments = payload.get("instrument")
+    if not isinstance(instruments, dict):
+        instruments = payload
+
+    ticks: List[Tick] = []
+    rejected = 0
+    isfinite = math.isfinite
+
+    for instrument, quote in instruments.items():
+        # msgpack maps can have int/bytes keys; never a valid instrument
+        if not isinstance(instrument, str):
+            raise PriceIngestError("Instrument names must be strings")
+
+        try:
+            bid = float(quote["bid"])
+            ask = float(quote["ask"])
+        except (TypeError, KeyError, ValueError):
+            rejected += 1
+            continue
+
+        if (
+            not isfinite(bid)
+            or not isfinite(ask)
+            or bid <= 0.0
+            or ask < bid
+            or len(instrument) > MAX_INSTRUMENT_LENGTH
+        ):
+            rejected += 1
+            continue
+
+        ticks.append((instrument, bid, ask))
+
+    return ticks, rejected
+
+
+async def write_ticks(redis, ticks: List[Tick]) -> int:
+    """Store and publish a batch of ticks in a single Redis round trip."""
+    if not ticks:
+        return 0
+
+    ts = datetime.now(timezone.utc).isoformat()
+    pipe = redis.pipeline(transaction=False)
+
+    for instrument, bid, ask in ticks:
+        message = _dumps({"bid": bid, "ask": ask, "ts": ts})
+        pipe.set(f"prices:{instrument}", message)
+        pipe.publish(f"prices:{instrument}", message)
+
+    await pipe.execute()
+    return len(ticks)
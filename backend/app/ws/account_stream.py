@@ -0,0 +1,186 @@
+"""
+WebSocket Account Streaming
+Per-user positions/account snapshot on connect, then incremental diffs
+"""
+
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+from fastapi import WebSocket
+from app.core.auth import verify_supabase_jwt
+from app.core.redis import get_redis
+from app.services.account_state import (
+    ACCOUNT_STATE_PREFIX,
+    diff_account_state,
+    get_account_state,
+)
+from app.services.pnl_engine import PNL_PREFIX
+from app.ws.price_stream import WebSocketManager
+import json
+
+logger = logging.getLogger(__name__)
+
+
+HeldMessage = Tuple[float, str, dict]
+
+
+class AccountStreamManager(WebSocketManager):
+    """
+    Manages /ws/account connections, keyed by user_id.
+
+    Keeps the last snapshot for each connected user. Agent pushes are
+    diffed against it. Between pushes, P&L moves come from the P&L engine
+    (the one place ticks are marked), whose per-user aggregates are
+    forwarded as "pnl_summary" messages.
+
+    A connection joins in two steps: messages for it are held while its
+    snapshot is read and sent, then only those newer than the snapshot
+    are replayed, so a client never sees a diff before its snapshot.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.states: Dict[str, dict] = {}
+        # user_id -> joining connection -> held (time, type, data) messages
+        self.joining: Dict[str, Dict[WebSocket, List[HeldMessage]]] = {}
+
+    def _watched(self, user_id: str) -> bool:
+        return user_id in self.connections or user_id in self.joining
+
+    def disconnect(self, websocket: WebSocket, user_id: str):
+        """Remove a connection; drop the user's snapshot with the last one."""
+        super().disconnect(websocket, user_id)
+
+        if not self._watched(user_id):
+            self.states.pop(user_id, None)
+
+    async def join(self, websocket: WebSocket, user_id: str):
+        """Accept a connection, send its snapshot, then start streaming to it."""
+        await websocket.accept()
+        held = self.joining.setdefault(user_id, {})[websocket] = []
+
+        try:
+            # The subscriber may have applied a newer state during the read
+            state = await get_account_state(user_id)
+            current = self.states.get(user_id)
+            if state is None or (
+                current is not None
+                and current.get("updated_at", 0) >= state.get("updated_at", 0)
+            ):
+                state = current
+            else:
+                self.states[user_id] = state
+
+            await websocket.send_text(json.dumps({"type": "snapshot", "data": state}))
+
+            since = state.get("updated_at", 0) if state else None
+            while held:
+                at, message_type, data = held.pop(0)
+                if since is None or at > since:
+                    await websocket.send_text(
+                        json.dumps({"type": message_type, "data": data})
+                    )
+
+            # No await since the last check: nothing can be held and lost
+            self.connections.setdefault(user_id, set()).add(websocket)
+        finally:
+            joining = self.joining.get(user_id, {})
+            joining.pop(websocket, None)
+            if not joining:
+                self.joining.pop(user_id, None)
+
+    async def _deliver(
+        self, user_id: str, at: Optional[float], message_type: str, data: dict
+    ):
+        """Broadcast to streaming connections; hold for joining ones."""
+        for held in self.joining.get(user_id, {}).values():
+            held.append((at or 0, message_type, data))
+        await self.broadcast(user_id, data, message_type)
+
+    async def apply_state(self, user_id: str, state: dict):
+        """Diff an agent-pushed snapshot against the last one and broadcast."""
+        if not self._watched(user_id):
+            return
+
+        diff = diff_account_state(self.states.get(user_id), state)
+        self.states[user_id] = state
+
+        if diff:
+            await self._deliver(user_id, state.get("updated_at"), "diff", diff)
+
+    async def start_redis_subscriber(self):
+        """Start Redis pub/sub listener with automatic reconnection."""
+        retry_delay = 1  # Start with 1 second
+        max_delay = 30  # Max 30 seconds
+        patterns = (f"{ACCOUNT_STATE_PREFIX}*", f"{PNL_PREFIX}*")
+
+        while True:
+            try:
+                redis = await get_redis()
+                pubsub = redis.pubsub()
+                await pubsub.psubscribe(*patterns)
+
+                # Reset retry delay on successful connection
+                retry_delay = 1
+
+                logger.info(
+                    "Account stream subscriber connected, listening for state updates..."
+                )
+
+                async for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+
+                    channel = message.get("channel", "")
+                    if channel.startswith(ACCOUNT_STATE_PREFIX):
+                        await self.apply_state(
+                            channel[len(ACCOUNT_STATE_PREFIX):],
+                            json.loads(message["data"]),
+                        )
+                    elif channel.startswith(PNL_PREFIX):
+                        # Aggregates from the P&L engine, throttled upstream
+                        user_id = channel[len(PNL_PREFIX):]
+                        if self._watched(user_id):
+                            summary = json.loads(message["data"])
+                            await self._deliver(
+                                user_id, summary.get("ts"), "pnl_summary", summary
+                            )
+
+            except asyncio.CancelledError:
+                logger.info("Account stream subscriber cancelled")
+                try:
+                    await pubsub.punsubscribe(*patterns)
+                except Exception:
+                    pass
+                raise
+            except Exception as e:
+                logger.warning(
+                    f"Account stream subscriber error: {e}. Reconnecting in {retry_delay}s..."
+                )
+                await asyncio.sleep(retry_delay)
+                # Exponential backoff
+                retry_delay = min(retry_delay * 2, max_delay)
+
+
+# Singleton instance
+account_stream = AccountStreamManager()
+
+
+async def handle_account_websocket(websocket: WebSocket, token: str):
+    """Handle WebSocket connection for the account stream."""
+    # Verify JWT token
+    try:
+        user_id = verify_supabase_jwt(token).sub
+    except Exception:
+        await websocket.close(code=4001)
+        return
+
+    # Keep connection alive while the shared subscriber delivers via broadcast
+    try:
+        await account_stream.join(websocket, user_id)
+        while True:
+            await websocket.receive_text()
+    except Exception:
+        pass
+    finally:
+        account_stream.disconnect(websocket, user_id)
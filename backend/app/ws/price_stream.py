@@ -37,10 +37,10 @@ class WebSocketManager:
             if not self.connections[instrument]:
                 del self.connections[instrument]
 
-    async def broadcast(self, instrument: str, data: dict):
+    async def broadcast(self, instrument: str, data: dict, message_type: str = "tick"):
         """Broadcast price data to all connections for an instrument."""
         if instrument in self.connections:
-            message = json.dumps({"type": "tick", "data": data})
+            message = json.dumps({"type": message_type, "data": data})
 
             # Copy set to avoid modification during iteration
             for websocket in list(self.connections[instrument]):
@@ -0,0 +1,86 @@
+"""
+Candle Store Microbenchmark
+Cost of a chart-sized range read against the size of the candle file
+
+Writes a synthetic M1 history into app.services.candle_store under a
+temporary directory, then compares CandleStore.read_range (binary search
+over a memory map) with loading the whole file and slicing it. Reads hit
+the page cache, so this measures CPU and memory traffic, not disk.
+
+Usage (from backend/):
+    python -m benchmarks.candle_store_bench [--bars 2000000] [--window 500] [--reads 2000]
+"""
+
+import argparse
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from app.services.candle_store import BAR_DTYPE, CandleStore
+
+
+def build_store(root: str, bars: int) -> CandleStore:
+    store = CandleStore(root)
+    start = 1_600_000_000 // 60 * 60
+    chunk = 100_000
+
+    for offset in range(0, bars, chunk):
+        times = start + 60 * np.arange(offset, min(offset + chunk, bars))
+        store.write(
+            "EURUSD",
+            "M1",
+            [[int(t), 1.08, 1.081, 1.079, 1.0805, 10] for t in times],
+            start=start if offset == 0 else None,
+        )
+
+    return store
+
+
+def full_load(path: str, start: int, end: int) -> np.ndarray:
+    bars = np.fromfile(path, dtype=BAR_DTYPE)
+    lo, hi = np.searchsorted(bars["open_time"], [start, end])
+    return bars[lo:hi]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--bars", type=int, default=2_000_000)
+    parser.add_argument("--window", type=int, default=500)
+    parser.add_argument("--reads", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        store = build_store(root, args.bars)
+        path = store._path("EURUSD", "M1", "bin")
+        first = int(store.coverage("EURUSD", "M1")[0][0])
+        rng = random.Random(7)
+        windows = [
+            (t, t + 60 * args.window)
+            for t in (
+                first + 60 * rng.randrange(args.bars - args.window)
+                for _ in range(args.reads)
+            )
+        ]
+
+        start, end = windows[0]
+        assert np.array_equal(
+            store.read_range("EURUSD", "M1", start, end), full_load(path, start, end)
+        )
+
+        size_mb = args.bars * BAR_DTYPE.itemsize / 1e6
+        print(f"{args.bars} bars ({size_mb:.0f} MB), {args.window}-bar window")
+        for name, fn, reads in (
+            ("full load", lambda s, e: full_load(path, s, e), max(args.reads // 100, 5)),
+            ("mmap", lambda s, e: store.read_range("EURUSD", "M1", s, e), args.reads),
+        ):
+            began = time.perf_counter()
+            for s, e in windows[:reads]:
+                fn(s, e)
+            elapsed = time.perf_counter() - began
+            print(f"  {name:<10} {elapsed / reads * 1e3:10.3f} ms/read")
+
+
+if __name__ == "__main__":
+    main()
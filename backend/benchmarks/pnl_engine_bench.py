@@ -0,0 +1,87 @@
+"""
+P&L Engine Microbenchmark
+Per-tick CPU cost of re-marking every open position in a symbol
+
+Loads synthetic positions for many users into app.services.pnl_engine and
+compares a per-position Python loop against the vectorized SymbolBook.mark
+pass. Redis I/O and publishing are excluded.
+
+Usage (from backend/):
+    python -m benchmarks.pnl_engine_bench [--users 1000] [--positions 5] [--ticks 2000]
+"""
+
+import argparse
+import random
+import time
+
+from app.services.pnl_engine import PnLEngine
+
+
+def build_engine(users: int, positions: int) -> PnLEngine:
+    engine = PnLEngine()
+    rng = random.Random(7)
+
+    for u in range(users):
+        engine.update_positions(
+            f"user-{u}",
+            {
+                "account": {"balance": 10000.0},
+                "positions": [
+                    {
+                        "ticket": f"{u}-{p}",
+                        "symbol": "EURUSD",
+                        "side": rng.choice(("buy", "sell")),
+                        "volume": rng.choice((0.01, 0.1, 1.0)),
+                        "open_price": 1.08 + rng.uniform(-0.01, 0.01),
+                        "current_price": 1.08,
+                        "pnl": 0.0,
+                        "contract_size": 100000.0,
+                        "pnl_per_price": None,
+                    }
+                    for p in range(positions)
+                ],
+            },
+        )
+
+    return engine
+
+
+def python_loop(book, bid: float, ask: float) -> dict:
+    totals = {}
+    for user_id, rows in book.rows.items():
+        total = 0.0
+        for side, volume, open_price, contract_size, conversion, offset in rows:
+            mark = bid if side > 0 else ask
+            total += side * (mark - open_price) * volume * contract_size * conversion + offset
+        totals[user_id] = total
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--positions", type=int, default=5)
+    parser.add_argument("--ticks", type=int, default=2000)
+    args = parser.parse_args()
+
+    engine = build_engine(args.users, args.positions)
+    book = engine.books["EURUSD"]
+
+    vectorized = book.mark(1.0850, 1.0852)
+    looped = python_loop(book, 1.0850, 1.0852)
+    assert all(abs(vectorized[u] - looped[u]) < 1e-6 for u in looped)
+
+    print(f"{args.users * args.positions} positions across {args.users} users")
+    for name, fn in (
+        ("python", lambda bid: python_loop(book, bid, bid + 0.0002)),
+        ("numpy", lambda bid: book.mark(bid, bid + 0.0002)),
+    ):
+        start = time.process_time()
+        for i in range(args.ticks):
+            fn(1.0850 + (i % 10) * 0.00001)
+        cpu = time.process_time() - start
+        print(f"  {name:<10} {cpu / args.ticks * 1e6:10.2f} us CPU/tick")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Price Ingest Microbenchmark
+Per-request CPU cost of decoding an agent price push
+
+Compares the previous pydantic path (model construction + per-instrument
+dicts + json.dumps) against the raw-body fast path in
+app.services.price_ingest. Redis I/O is excluded; only decode/validate
+and message encoding are measured.
+
+Usage (from backend/):
+    python -m benchmarks.price_ingest_bench [--instruments 6] [--iterations 20000]
+"""
+
+import argparse
+import json
+import time
+import timeit
+from datetime import datetime, timezone
+
+from pydantic import BaseModel
+
+from app.services.price_ingest import _dumps, decode_price_payload
+
+
+class LegacyPriceUpdateRequest(BaseModel):
+    instrument: dict
+
+
+def build_body(instruments: int) -> bytes:
+    prices = {
+        f"SYM{i:03d}": {
+            "bid": 1.08450 + i * 0.0001,
+            "ask": 1.08470 + i * 0.0001,
+            "time": datetime.now().isoformat(),
+        }
+        for i in range(instruments)
+    }
+    return json.dumps({"instrument": prices}).encode("utf-8")
+
+
+def legacy_path(body: bytes) -> int:
+    request = LegacyPriceUpdateRequest(**json.loads(body))
+    count = 0
+    for instrument, data in request.instrument.items():
+        price_data = {
+            "bid": data.get("bid"),
+            "ask": data.get("ask"),
+            "ts": datetime.now(timezone.utc).isoformat(),
+        }
+        json.dumps(price_data)
+        json.dumps(price_data)
+        count += 1
+    return count
+
+
+def fast_path(body: bytes) -> int:
+    ticks, _ = decode_price_payload(body, "application/json")
+    ts = datetime.now(timezone.utc).isoformat()
+    for _, bid, ask in ticks:
+        _dumps({"bid": bid, "ask": ask, "ts": ts})
+    return len(ticks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--instruments", type=int, default=6)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    body = build_body(args.instruments)
+    assert legacy_path(body) == fast_path(body) == args.instruments
+
+    print(f"{args.instruments} instruments/request, {args.iterations} iterations")
+    for name, fn in (("pydantic", legacy_path), ("fast path", fast_path)):
+        start = time.process_time()
+        timeit.timeit(lambda: fn(body), number=args.iterations)
+        cpu = time.process_time() - start
+        print(f"  {name:<10} {cpu / args.iterations * 1e6:8.2f} us CPU/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+-- Batch Job Claiming
+-- claim_jobs claims up to p_limit pending jobs for the agent's user in one
+-- statement so a burst of jobs reaches the agent in a single round trip
+
+CREATE OR REPLACE FUNCTION claim_jobs(p_agent_id UUID, p_limit INT DEFAULT 10)
+RETURNS SETOF jobs
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_user_id UUID;
+BEGIN
+  SELECT user_id INTO v_user_id FROM mt5_agents WHERE id = p_agent_id;
+
+  RETURN QUERY
+  UPDATE jobs
+  SET    status     = 'claimed',
+         agent_id   = p_agent_id,
+         claimed_at = NOW()
+  WHERE  id IN (
+    SELECT id FROM jobs
+    WHERE  user_id = v_user_id
+      AND  status  = 'pending'
+    ORDER BY created_at ASC
+    FOR UPDATE SKIP LOCKED
+    LIMIT GREATEST(p_limit, 1)
+  )
+  RETURNING *;
+END;
+$$;
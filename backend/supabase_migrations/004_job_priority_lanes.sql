@@ -0,0 +1,112 @@
+-- Job Priority Lanes
+-- Trades preempt reads, reads preempt deployment and compile housekeeping.
+-- Claims serve the highest effective priority first; waiting jobs gain one
+-- point every 10 seconds so low-priority lanes cannot starve.
+
+-- Addition 1 — Priority column with per job_type defaults
+ALTER TABLE jobs
+  ADD COLUMN IF NOT EXISTS priority SMALLINT;
+
+CREATE OR REPLACE FUNCTION job_default_priority(p_job_type TEXT)
+RETURNS SMALLINT
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT (CASE p_job_type
+    WHEN 'trade'          THEN 100
+    WHEN 'close_position' THEN 100
+    WHEN 'get_positions'  THEN 70
+    WHEN 'get_account'    THEN 70
+    WHEN 'get_candles'    THEN 50
+    WHEN 'deploy'         THEN 30
+    WHEN 'run'            THEN 30
+    WHEN 'stop'           THEN 30
+    ELSE 10
+  END)::SMALLINT;
+$$;
+
+CREATE OR REPLACE FUNCTION job_priority_lane(p_priority SMALLINT)
+RETURNS TEXT
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT CASE
+    WHEN p_priority >= 100 THEN 'trade'
+    WHEN p_priority >= 70  THEN 'interactive'
+    WHEN p_priority >= 50  THEN 'market_data'
+    WHEN p_priority >= 30  THEN 'deployment'
+    ELSE 'housekeeping'
+  END;
+$$;
+
+CREATE OR REPLACE FUNCTION jobs_set_default_priority()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  NEW.priority := COALESCE(NEW.priority, job_default_priority(NEW.job_type));
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS jobs_default_priority ON jobs;
+CREATE TRIGGER jobs_default_priority
+  BEFORE INSERT ON jobs
+  FOR EACH ROW EXECUTE FUNCTION jobs_set_default_priority();
+
+UPDATE jobs SET priority = job_default_priority(job_type) WHERE priority IS NULL;
+
+ALTER TABLE jobs ALTER COLUMN priority SET NOT NULL;
+
+-- Addition 2 — Claim functions ordered by effective (aged) priority
+CREATE OR REPLACE FUNCTION claim_next_job(p_agent_id UUID)
+RETURNS SETOF jobs
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  RETURN QUERY SELECT * FROM claim_jobs(p_agent_id, 1);
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION claim_jobs(p_agent_id UUID, p_limit INT DEFAULT 10)
+RETURNS SETOF jobs
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_user_id UUID;
+BEGIN
+  SELECT user_id INTO v_user_id FROM mt5_agents WHERE id = p_agent_id;
+
+  RETURN QUERY
+  UPDATE jobs
+  SET    status     = 'claimed',
+         agent_id   = p_agent_id,
+         claimed_at = NOW()
+  WHERE  id IN (
+    SELECT id FROM jobs
+    WHERE  user_id = v_user_id
+      AND  status  = 'pending'
+    ORDER BY priority + EXTRACT(EPOCH FROM (NOW() - created_at)) / 10 DESC,
+             created_at ASC
+    FOR UPDATE SKIP LOCKED
+    LIMIT GREATEST(p_limit, 1)
+  )
+  RETURNING *;
+END;
+$$;
+
+-- Addition 3 — Queue latency per lane (enqueue -> claim, last hour)
+CREATE OR REPLACE VIEW job_lane_latency AS
+SELECT
+  job_priority_lane(priority)                                       AS lane,
+  COUNT(*)                                                          AS claimed_jobs,
+  AVG(EXTRACT(EPOCH FROM (claimed_at - created_at)))                AS avg_wait_seconds,
+  PERCENTILE_CONT(0.5) WITHIN GROUP (
+    ORDER BY EXTRACT(EPOCH FROM (claimed_at - created_at)))         AS p50_wait_seconds,
+  PERCENTILE_CONT(0.95) WITHIN GROUP (
+    ORDER BY EXTRACT(EPOCH FROM (claimed_at - created_at)))         AS p95_wait_seconds,
+  MAX(EXTRACT(EPOCH FROM (claimed_at - created_at)))                AS max_wait_seconds
+FROM  jobs
+WHERE claimed_at IS NOT NULL
+  AND claimed_at > NOW() - INTERVAL '1 hour'
+GROUP BY job_priority_lane(priority);
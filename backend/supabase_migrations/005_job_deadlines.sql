@@ -0,0 +1,136 @@
+-- Job Deadlines
+-- Every job carries an expires_at deadline (per job_type default). Claims
+-- skip expired jobs, agents skip jobs whose deadline passed after claim,
+-- and expire_stale_jobs() sweeps dead work out of the queue.
+
+-- Addition 1 — expires_at column and status values
+ALTER TABLE jobs
+  ADD COLUMN IF NOT EXISTS expires_at TIMESTAMPTZ;
+
+ALTER TABLE jobs DROP CONSTRAINT IF EXISTS jobs_status_check;
+ALTER TABLE jobs ADD CONSTRAINT jobs_status_check
+  CHECK (status IN (
+    'pending','claimed','running','completed','failed','cancelled','expired'
+  ));
+
+-- Addition 2 — Default deadline per job_type
+-- Interactive reads only matter while the route is still waiting (5-10 s);
+-- market orders must never fill minutes late; EA work may queue longer.
+CREATE OR REPLACE FUNCTION job_default_ttl(p_job_type TEXT)
+RETURNS INTERVAL
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT CASE p_job_type
+    WHEN 'trade'          THEN INTERVAL '30 seconds'
+    WHEN 'close_position' THEN INTERVAL '30 seconds'
+    WHEN 'get_positions'  THEN INTERVAL '10 seconds'
+    WHEN 'get_account'    THEN INTERVAL '10 seconds'
+    WHEN 'get_candles'    THEN INTERVAL '15 seconds'
+    WHEN 'deploy'         THEN INTERVAL '10 minutes'
+    WHEN 'run'            THEN INTERVAL '10 minutes'
+    WHEN 'stop'           THEN INTERVAL '10 minutes'
+    ELSE INTERVAL '30 minutes'
+  END;
+$$;
+
+CREATE OR REPLACE FUNCTION jobs_set_default_deadline()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  NEW.expires_at := COALESCE(NEW.expires_at, NOW() + job_default_ttl(NEW.job_type));
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS jobs_default_deadline ON jobs;
+CREATE TRIGGER jobs_default_deadline
+  BEFORE INSERT ON jobs
+  FOR EACH ROW EXECUTE FUNCTION jobs_set_default_deadline();
+
+-- Addition 3 — Claims skip expired jobs
+CREATE OR REPLACE FUNCTION claim_jobs(p_agent_id UUID, p_limit INT DEFAULT 10)
+RETURNS SETOF jobs
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_user_id UUID;
+BEGIN
+  SELECT user_id INTO v_user_id FROM mt5_agents WHERE id = p_agent_id;
+
+  RETURN QUERY
+  UPDATE jobs
+  SET    status     = 'claimed',
+         agent_id   = p_agent_id,
+         claimed_at = NOW()
+  WHERE  id IN (
+    SELECT id FROM jobs
+    WHERE  user_id = v_user_id
+      AND  status  = 'pending'
+      AND  (expires_at IS NULL OR expires_at > NOW())
+    ORDER BY priority + EXTRACT(EPOCH FROM (NOW() - created_at)) / 10 DESC,
+             created_at ASC
+    FOR UPDATE SKIP LOCKED
+    LIMIT GREATEST(p_limit, 1)
+  )
+  RETURNING *;
+END;
+$$;
+
+-- Addition 4 — Sweeper
+-- Pending jobs expire at their deadline; claimed jobs get a grace period
+-- in case the agent is still executing, then are treated as abandoned.
+CREATE OR REPLACE FUNCTION expire_stale_jobs(p_claimed_grace INTERVAL DEFAULT INTERVAL '5 minutes')
+RETURNS SETOF jobs
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  RETURN QUERY
+  WITH expired AS (
+    UPDATE jobs
+    SET    status        = 'expired',
+           error_message = 'deadline_exceeded',
+           completed_at  = NOW()
+    WHERE  id IN (
+      SELECT id FROM jobs
+      WHERE  expires_at IS NOT NULL
+        AND  (
+               (status = 'pending' AND expires_at <= NOW())
+            OR (status = 'claimed' AND expires_at + p_claimed_grace <= NOW())
+        )
+      FOR UPDATE SKIP LOCKED
+    )
+    RETURNING *
+  ),
+  signals AS (
+    UPDATE tv_signals
+    SET    status        = 'failed',
+           error_message = 'deadline_exceeded',
+           resolved_at   = NOW()
+    FROM   expired
+    WHERE  expired.job_type = 'trade'
+      AND  tv_signals.id = (expired.input_data->>'signal_id')::UUID
+      AND  tv_signals.status = 'pending'
+  ),
+  versions AS (
+    UPDATE ea_versions
+    SET    status = 'failed'
+    FROM   expired
+    WHERE  expired.job_type = 'compile'
+      AND  ea_versions.id = (expired.input_data->>'version_id')::UUID
+  ),
+  deployments AS (
+    UPDATE ea_deployments
+    SET    status = 'error'
+    FROM   expired
+    WHERE  expired.job_type IN ('deploy', 'run', 'stop')
+      AND  ea_deployments.id = (expired.input_data->>'deployment_id')::UUID
+  )
+  SELECT * FROM expired;
+END;
+$$;
+
+CREATE INDEX IF NOT EXISTS jobs_open_expires_at_idx
+  ON jobs (expires_at)
+  WHERE status IN ('pending', 'claimed');
@@ -0,0 +1,66 @@
+-- finish_job PostgreSQL Function
+-- Records a job result and applies the job_type specific propagation
+-- (ea_versions / ea_deployments / tv_signals) atomically in one round trip.
+-- Returns the finished job row for notification fan-out.
+
+CREATE OR REPLACE FUNCTION finish_job(
+  p_job_id        UUID,
+  p_status        TEXT,
+  p_output_data   JSONB DEFAULT NULL,
+  p_error_message TEXT  DEFAULT NULL,
+  p_agent_id      UUID  DEFAULT NULL
+)
+RETURNS SETOF jobs
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_job jobs%ROWTYPE;
+BEGIN
+  UPDATE jobs
+  SET    status        = p_status,
+         output_data   = p_output_data,
+         error_message = p_error_message,
+         completed_at  = NOW()
+  WHERE  id = p_job_id
+    -- A duplicate or late result must not rewrite a finished job
+    AND  status IN ('pending', 'claimed')
+    -- Only the claiming agent, or (for a claim not yet recorded here)
+    -- an agent of the job's owner
+    AND  (p_agent_id IS NULL
+          OR agent_id = p_agent_id
+          OR (agent_id IS NULL
+              AND user_id = (SELECT user_id FROM mt5_agents WHERE id = p_agent_id)))
+  RETURNING * INTO v_job;
+
+  IF NOT FOUND THEN
+    RETURN;
+  END IF;
+
+  IF v_job.job_type = 'compile' THEN
+    UPDATE ea_versions
+    SET    status = CASE WHEN p_status = 'completed' THEN 'compiled' ELSE 'failed' END
+    WHERE  id = (v_job.input_data->>'version_id')::UUID;
+
+  ELSIF v_job.job_type IN ('deploy', 'run', 'stop') THEN
+    UPDATE ea_deployments
+    SET    status = CASE v_job.job_type
+                      WHEN 'deploy' THEN
+                        CASE WHEN p_status = 'completed' THEN 'running' ELSE 'error' END
+                      WHEN 'run'  THEN 'running'
+                      WHEN 'stop' THEN 'stopped'
+                    END
+    WHERE  id = (v_job.input_data->>'deployment_id')::UUID;
+
+  ELSIF v_job.job_type = 'trade' AND v_job.input_data ? 'signal_id' THEN
+    UPDATE tv_signals
+    SET    status          = CASE WHEN p_status = 'completed' THEN 'executed' ELSE 'failed' END,
+           fill_price      = (p_output_data->>'fill_price')::NUMERIC,
+           broker_order_id = p_output_data->>'order_id',
+           error_message   = p_error_message,
+           resolved_at     = NOW()
+    WHERE  id = (v_job.input_data->>'signal_id')::UUID;
+  END IF;
+
+  RETURN NEXT v_job;
+END;
+$$;
@@ -0,0 +1,14 @@
+-- Job Queue Depth
+-- Open jobs by job_type and status, sampled by the backend sweeper for the
+-- forexelite_job_queue_depth metric
+
+CREATE OR REPLACE FUNCTION job_queue_depth()
+RETURNS TABLE (job_type TEXT, status TEXT, depth BIGINT)
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT job_type::TEXT, status::TEXT, COUNT(*)
+  FROM   jobs
+  WHERE  status IN ('pending', 'claimed')
+  GROUP BY job_type, status;
+$$;
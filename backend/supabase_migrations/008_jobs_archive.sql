@@ -0,0 +1,95 @@
+-- Jobs Live / Archive Split
+-- `jobs` holds only live and recently finished work. Finished jobs older
+-- than N days move to `jobs_archive`, range-partitioned by month on
+-- created_at, so claim and log queries stay flat as history grows.
+--
+-- jobs_archive is created LIKE jobs; later ALTERs to jobs must be applied
+-- to jobs_archive as well (archive_completed_jobs copies SELECT *).
+
+-- Addition 1 — Partial indexes on the live table
+CREATE INDEX IF NOT EXISTS jobs_pending_claim_idx
+  ON jobs (user_id, priority DESC, created_at)
+  WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS jobs_deployment_logs_idx
+  ON jobs (user_id, (input_data->>'deployment_id'), created_at DESC)
+  WHERE input_data ? 'deployment_id';
+
+CREATE INDEX IF NOT EXISTS jobs_finished_completed_at_idx
+  ON jobs (completed_at)
+  WHERE status IN ('completed', 'failed', 'expired', 'cancelled');
+
+-- Addition 2 — Monthly partitioned archive
+CREATE TABLE IF NOT EXISTS jobs_archive (
+  LIKE jobs INCLUDING DEFAULTS,
+  archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE INDEX IF NOT EXISTS jobs_archive_deployment_logs_idx
+  ON jobs_archive (user_id, (input_data->>'deployment_id'), created_at DESC)
+  WHERE input_data ? 'deployment_id';
+
+ALTER TABLE jobs_archive ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "Users read own archived jobs" ON jobs_archive;
+CREATE POLICY "Users read own archived jobs"
+  ON jobs_archive FOR SELECT USING (auth.uid() = user_id);
+
+CREATE OR REPLACE FUNCTION ensure_jobs_archive_partition(p_month TIMESTAMPTZ)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_start DATE := date_trunc('month', p_month)::DATE;
+  v_name  TEXT := 'jobs_archive_' || to_char(v_start, 'YYYY_MM');
+BEGIN
+  EXECUTE format(
+    'CREATE TABLE IF NOT EXISTS %I PARTITION OF jobs_archive
+       FOR VALUES FROM (%L) TO (%L)',
+    v_name, v_start, (v_start + INTERVAL '1 month')::DATE
+  );
+END;
+$$;
+
+-- Addition 3 — Archival
+-- Moves up to p_batch finished jobs older than p_older_than in one
+-- statement; call repeatedly until it returns 0 to drain a backlog.
+CREATE OR REPLACE FUNCTION archive_completed_jobs(
+  p_older_than INTERVAL DEFAULT INTERVAL '7 days',
+  p_batch      INT      DEFAULT 5000
+)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_month TIMESTAMPTZ;
+  v_moved INT;
+BEGIN
+  FOR v_month IN
+    SELECT DISTINCT date_trunc('month', created_at)
+    FROM   jobs
+    WHERE  status IN ('completed', 'failed', 'expired', 'cancelled')
+      AND  completed_at < NOW() - p_older_than
+  LOOP
+    PERFORM ensure_jobs_archive_partition(v_month);
+  END LOOP;
+
+  WITH moved AS (
+    DELETE FROM jobs
+    WHERE  id IN (
+      SELECT id FROM jobs
+      WHERE  status IN ('completed', 'failed', 'expired', 'cancelled')
+        AND  completed_at < NOW() - p_older_than
+      ORDER BY completed_at
+      LIMIT  p_batch
+      FOR UPDATE SKIP LOCKED
+    )
+    RETURNING *
+  )
+  INSERT INTO jobs_archive
+  SELECT moved.*, NOW() FROM moved;
+
+  GET DIAGNOSTICS v_moved = ROW_COUNT;
+  RETURN v_moved;
+END;
+$$;
@@ -0,0 +1,59 @@
+-- Job Idempotency Keys
+-- A client-supplied Idempotency-Key (or a key derived from a TradingView
+-- alert) is stored on the job. The partial unique index is the durable
+-- guarantee; the backend checks Redis first so retries rarely reach it.
+
+-- Addition 1 — idempotency_key on live and archived jobs
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+ALTER TABLE jobs_archive ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_user_idempotency_key_idx
+  ON jobs (user_id, idempotency_key)
+  WHERE idempotency_key IS NOT NULL;
+
+-- Addition 2 — Copy archived rows by column name
+-- jobs_archive now has archived_at before idempotency_key, so the
+-- positional SELECT moved.*, NOW() from 008 no longer lines up.
+CREATE OR REPLACE FUNCTION archive_completed_jobs(
+  p_older_than INTERVAL DEFAULT INTERVAL '7 days',
+  p_batch      INT      DEFAULT 5000
+)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_month TIMESTAMPTZ;
+  v_moved INT;
+BEGIN
+  FOR v_month IN
+    SELECT DISTINCT date_trunc('month', created_at)
+    FROM   jobs
+    WHERE  status IN ('completed', 'failed', 'expired', 'cancelled')
+      AND  completed_at < NOW() - p_older_than
+  LOOP
+    PERFORM ensure_jobs_archive_partition(v_month);
+  END LOOP;
+
+  WITH moved AS (
+    DELETE FROM jobs
+    WHERE  id IN (
+      SELECT id FROM jobs
+      WHERE  status IN ('completed', 'failed', 'expired', 'cancelled')
+        AND  completed_at < NOW() - p_older_than
+      ORDER BY completed_at
+      LIMIT  p_batch
+      FOR UPDATE SKIP LOCKED
+    )
+    RETURNING *
+  )
+  INSERT INTO jobs_archive
+  SELECT (jsonb_populate_record(
+           NULL::jobs_archive,
+           to_jsonb(moved) || jsonb_build_object('archived_at', NOW())
+         )).*
+  FROM moved;
+
+  GET DIAGNOSTICS v_moved = ROW_COUNT;
+  RETURN v_moved;
+END;
+$$;
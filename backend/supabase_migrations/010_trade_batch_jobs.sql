@@ -0,0 +1,50 @@
+-- Trade Batch Jobs
+-- `trade_batch` carries a basket of market orders that the agent sends
+-- back-to-back in one claim. It shares the trade lane and deadline.
+
+-- Addition 1 — job_type value
+ALTER TABLE jobs DROP CONSTRAINT IF EXISTS jobs_job_type_check;
+ALTER TABLE jobs ADD CONSTRAINT jobs_job_type_check
+  CHECK (job_type IN (
+    'compile','deploy','run','stop','trade','trade_batch',
+    'get_positions','get_account','get_candles','close_position'
+  ));
+
+-- Addition 2 — Priority and deadline defaults
+CREATE OR REPLACE FUNCTION job_default_priority(p_job_type TEXT)
+RETURNS SMALLINT
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT (CASE p_job_type
+    WHEN 'trade'          THEN 100
+    WHEN 'trade_batch'    THEN 100
+    WHEN 'close_position' THEN 100
+    WHEN 'get_positions'  THEN 70
+    WHEN 'get_account'    THEN 70
+    WHEN 'get_candles'    THEN 50
+    WHEN 'deploy'         THEN 30
+    WHEN 'run'            THEN 30
+    WHEN 'stop'           THEN 30
+    ELSE 10
+  END)::SMALLINT;
+$$;
+
+CREATE OR REPLACE FUNCTION job_default_ttl(p_job_type TEXT)
+RETURNS INTERVAL
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT CASE p_job_type
+    WHEN 'trade'          THEN INTERVAL '30 seconds'
+    WHEN 'trade_batch'    THEN INTERVAL '30 seconds'
+    WHEN 'close_position' THEN INTERVAL '30 seconds'
+    WHEN 'get_positions'  THEN INTERVAL '10 seconds'
+    WHEN 'get_account'    THEN INTERVAL '10 seconds'
+    WHEN 'get_candles'    THEN INTERVAL '15 seconds'
+    WHEN 'deploy'         THEN INTERVAL '10 minutes'
+    WHEN 'run'            THEN INTERVAL '10 minutes'
+    WHEN 'stop'           THEN INTERVAL '10 minutes'
+    ELSE INTERVAL '30 minutes'
+  END;
+$$;
@@ -0,0 +1,9 @@
+-- Agent Deletion
+-- DELETE /agents/{id} removes the mt5_agents row after revoking it. Jobs
+-- keep their history with the agent reference cleared instead of
+-- blocking the delete.
+
+-- Addition 1 — jobs.agent_id no longer blocks deleting an agent
+ALTER TABLE jobs DROP CONSTRAINT IF EXISTS jobs_agent_id_fkey;
+ALTER TABLE jobs ADD CONSTRAINT jobs_agent_id_fkey
+  FOREIGN KEY (agent_id) REFERENCES mt5_agents(id) ON DELETE SET NULL;
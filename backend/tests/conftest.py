@@ -0,0 +1,28 @@
+"""
+Shared fixtures: an in-process Redis and job queue in place of the real
+backends, so services run end to end without Redis or Supabase.
+"""
+
+import fakeredis
+import pytest
+import app.core.redis as redis_module
+from app.services.job_queue import InMemoryJobQueue, set_job_queue
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    """A fresh fake Redis behind app.core.redis.get_redis."""
+    client = fakeredis.FakeAsyncRedis(
+        server=fakeredis.FakeServer(), decode_responses=True
+    )
+    monkeypatch.setattr(redis_module, "_redis_client", client)
+    return client
+
+
+@pytest.fixture
+def job_queue():
+    """The in-memory job queue as the configured backend."""
+    queue = InMemoryJobQueue()
+    set_job_queue(queue)
+    yield queue
+    set_job_queue(None)
@@ -0,0 +1,83 @@
+"""Idempotency keys on enqueue_job: replay, conflict and the durable fallback."""
+
+import fakeredis
+import pytest
+import app.core.redis as redis_module
+from app.services.jobs import IdempotencyKeyConflict, enqueue_job
+
+ORDER = {"symbol": "EURUSD", "side": "buy", "volume": 0.1}
+
+
+@pytest.mark.asyncio
+async def test_repeat_submission_replays_the_original_job(redis, job_queue):
+    first = await enqueue_job("user-1", "trade", ORDER, idempotency_key="k1")
+    again = await enqueue_job("user-1", "trade", ORDER, idempotency_key="k1")
+
+    assert again["id"] == first["id"]
+    assert again["replayed"] is True
+    assert "replayed" not in first
+    assert len(job_queue.jobs) == 1
+
+
+@pytest.mark.asyncio
+async def test_keys_are_scoped_per_user(redis, job_queue):
+    first = await enqueue_job("user-1", "trade", ORDER, idempotency_key="k1")
+    other = await enqueue_job("user-2", "trade", ORDER, idempotency_key="k1")
+
+    assert other["id"] != first["id"]
+    assert len(job_queue.jobs) == 2
+
+
+@pytest.mark.asyncio
+async def test_reused_key_with_another_payload_conflicts(redis, job_queue):
+    await enqueue_job("user-1", "trade", ORDER, idempotency_key="k1")
+
+    with pytest.raises(IdempotencyKeyConflict):
+        await enqueue_job(
+            "user-1",
+            "trade",
+            {**ORDER, "volume": 1.0},
+            idempotency_key="k1",
+            verify_payload=True,
+        )
+    assert len(job_queue.jobs) == 1
+
+
+@pytest.mark.asyncio
+async def test_same_payload_with_verification_replays(redis, job_queue):
+    first = await enqueue_job(
+        "user-1", "trade", ORDER, idempotency_key="k1", verify_payload=True
+    )
+    again = await enqueue_job(
+        "user-1", "trade", ORDER, idempotency_key="k1", verify_payload=True
+    )
+
+    assert again["id"] == first["id"]
+    assert again["replayed"] is True
+
+
+@pytest.mark.asyncio
+async def test_queue_deduplicates_when_redis_is_down(monkeypatch, job_queue):
+    server = fakeredis.FakeServer()
+    server.connected = False
+    monkeypatch.setattr(
+        redis_module,
+        "_redis_client",
+        fakeredis.FakeAsyncRedis(server=server, decode_responses=True),
+    )
+
+    first = await enqueue_job("user-1", "trade", ORDER, idempotency_key="k1")
+    again = await enqueue_job("user-1", "trade", ORDER, idempotency_key="k1")
+
+    assert again["id"] == first["id"]
+    assert again["replayed"] is True
+    assert len(job_queue.jobs) == 1
+
+    with pytest.raises(IdempotencyKeyConflict):
+        await enqueue_job(
+            "user-1",
+            "trade",
+            {**ORDER, "side": "sell"},
+            idempotency_key="k1",
+            verify_payload=True,
+        )
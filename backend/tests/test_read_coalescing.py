@@ -0,0 +1,93 @@
+"""Single-flight read jobs: concurrent identical reads share one agent job."""
+
+import asyncio
+import pytest
+from app.services.jobs import job_results, run_read_job
+
+ACCOUNT = {"balance": 1000.0, "equity": 1010.0}
+
+
+async def serve(job_queue, user_id: str, agent_id: str, output: dict) -> list:
+    """Play the agent: claim the user's next jobs and report them done."""
+    while True:
+        jobs = await job_queue.claim(agent_id, user_id, 10)
+        if jobs:
+            break
+        await asyncio.sleep(0.01)
+
+    for job in jobs:
+        finished = await job_queue.finish(job["id"], agent_id, "completed", output)
+        # As the job result subscriber does on every worker
+        job_results.resolve(
+            job["id"],
+            {
+                "status": finished["status"],
+                "output_data": finished["output_data"],
+                "error_message": finished["error_message"],
+            },
+        )
+    return jobs
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_reads_share_one_job(redis, job_queue):
+    agent = asyncio.create_task(serve(job_queue, "user-1", "agent-1", ACCOUNT))
+    results = await asyncio.gather(
+        *(run_read_job("user-1", "get_account", {}, timeout=5) for _ in range(3))
+    )
+
+    assert len(await agent) == 1
+    assert len(job_queue.jobs) == 1
+    assert all(result["output_data"] == ACCOUNT for result in results)
+
+
+@pytest.mark.asyncio
+async def test_recent_result_is_served_without_a_job(redis, job_queue):
+    agent = asyncio.create_task(serve(job_queue, "user-1", "agent-1", ACCOUNT))
+    await run_read_job("user-1", "get_account", {}, timeout=5)
+    await agent
+
+    result = await run_read_job("user-1", "get_account", {}, timeout=5)
+
+    assert result["output_data"] == ACCOUNT
+    assert len(job_queue.jobs) == 1
+
+
+@pytest.mark.asyncio
+async def test_different_inputs_are_not_coalesced(redis, job_queue):
+    async def agent():
+        return await serve(job_queue, "user-1", "agent-1", ACCOUNT) + await serve(
+            job_queue, "user-1", "agent-1", ACCOUNT
+        )
+
+    served = asyncio.create_task(agent())
+    await asyncio.gather(
+        run_read_job("user-1", "get_candles", {"symbol": "EURUSD"}, timeout=5),
+        run_read_job("user-1", "get_candles", {"symbol": "GBPUSD"}, timeout=5),
+    )
+
+    assert len(await served) == 2
+    assert len(job_queue.jobs) == 2
+
+
+@pytest.mark.asyncio
+async def test_shared_read_falls_back_to_the_callers_agent(redis, job_queue):
+    # user-1 leads the shared fetch but has no agent online
+    leader = asyncio.create_task(
+        run_read_job(
+            "user-1", "get_candles", {"symbol": "EURUSD"}, timeout=0.2,
+            coalesce_key="candles:EURUSD",
+        )
+    )
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(
+        run_read_job(
+            "user-2", "get_candles", {"symbol": "EURUSD"}, timeout=5,
+            coalesce_key="candles:EURUSD",
+        )
+    )
+    agent = asyncio.create_task(serve(job_queue, "user-2", "agent-2", ACCOUNT))
+
+    assert await leader is None
+    assert (await follower)["output_data"] == ACCOUNT
+    assert [job["user_id"] for job in await agent] == ["user-2"]
@@ -17,6 +17,26 @@ interface Candle {
   close: number;
 }
 
+// Columnar candles as served by /trading/candles (t: open time, epoch seconds)
+interface CandleColumns {
+  t: number[];
+  o: number[];
+  h: number[];
+  l: number[];
+  c: number[];
+  v: number[];
+}
+
+function columnsToCandles(columns: CandleColumns): Candle[] {
+  return columns.t.map((t, i) => ({
+    time: new Date(t * 1000).toISOString().slice(0, 19),
+    open: columns.o[i],
+    high: columns.h[i],
+    low: columns.l[i],
+    close: columns.c[i],
+  }));
+}
+
 interface OrderRequest {
   side: "BUY" | "SELL";
   symbol: string;
@@ -46,9 +66,9 @@ export default function TradingPage() {
   const { data: candles = [], isLoading: candlesLoading } = useQuery<Candle[]>({
     queryKey: ["candles", symbol, timeframe],
     queryFn: async () => {
-      const res = await apiGet<Candle[]>(`/api/v1/trading/candles/${symbol}?timeframe=${timeframe}&count=200`);
+      const res = await apiGet<CandleColumns>(`/api/v1/trading/candles/${symbol}?timeframe=${timeframe}&count=200`);
       if (res.error) throw new Error(res.error.detail);
-      return res.data || [];
+      return res.data ? columnsToCandles(res.data) : [];
     },
     refetchInterval: 30000,
   });
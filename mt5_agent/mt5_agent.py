@@ -11,13 +11,18 @@ Usage:
 """
 
 import argparse
+import base64
+import hashlib
 import json
 import logging
 import os
 import sys
 import time
 import threading
-from datetime import datetime
+import zlib
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Any, Optional
 
@@ -32,6 +37,27 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+JOB_LONG_POLL_SECONDS = 25
+JOB_BATCH_SIZE = 10
+READ_ONLY_JOB_TYPES = {"get_positions", "get_account", "get_candles"}
+# Results of state-changing jobs kept to answer redeliveries without re-executing
+EXECUTED_JOB_CACHE_SIZE = 1000
+TRADE_HISTORY_LOOKBACK = timedelta(days=1)
+# Account/positions snapshots are diffed this often and re-sent at least
+# every keepalive so the backend cache does not expire while idle
+ACCOUNT_STATE_POLL_SECONDS = 1
+ACCOUNT_STATE_KEEPALIVE_SECONDS = 20
+# Candle payloads above this are zlib-compressed (matches the backend's
+# inline job output limit)
+CANDLE_COMPRESS_MIN_BYTES = 8192
+# Broker server offsets are whole half hours within +-14h of UTC
+SERVER_OFFSET_STEP_SECONDS = 1800
+SERVER_OFFSET_MAX_SECONDS = 14 * 3600
+
+
+class AgentRevoked(Exception):
+    """The backend revoked this agent; it must be paired again."""
+
 
 class MT5Agent:
     """MT5 Agent - bridges MetaTrader 5 to ForexElite Pro backend."""
@@ -42,10 +68,13 @@ class MT5Agent:
         self.api_url = api_url.rstrip("/")
         self.headers = {
             "X-Agent-Id": agent_id,
-            "X-Agent-Key": agent_key,
             "Content-Type": "application/json",
         }
+        self.session_token: Optional[str] = None
+        self.session_expires_at = 0
+        self._session_lock = threading.Lock()
         self.running = False
+        self.revoked = False
         self.mt5_connected = False
         self.subscribed_symbols = [
             "EURUSD",
@@ -56,18 +85,71 @@ class MT5Agent:
             "USDCAD",
         ]
         self.jobs_processed = 0
+        # Broker server time minus UTC, learned from live ticks (None until one arrives)
+        self.server_offset: Optional[int] = None
+        self.last_tick_msc: dict = {}
+        # Only jobs enqueued before this moment can have run in a previous process
+        self.started_at = time.monotonic()
+        self.executed_jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self.state_changed = threading.Event()
+        self.job_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="job")
+
+    def _stop_revoked(self, reason: str):
+        """Stop every loop; the pairing key is no longer accepted."""
+        logger.error(f"{reason} - please re-pair your agent")
+        self.revoked = True
+        self.running = False
+        raise AgentRevoked(reason)
+
+    def _open_session(self) -> None:
+        """Exchange the pairing key for a short-lived session token."""
+        if self.revoked:
+            raise AgentRevoked("Agent revoked")
+
+        response = requests.post(
+            f"{self.api_url}/agents/{self.agent_id}/session",
+            headers={**self.headers, "X-Agent-Key": self.agent_key},
+            timeout=30,
+        )
+        if response.status_code in (401, 404):
+            self._stop_revoked("Pairing key rejected")
+        response.raise_for_status()
+
+        data = response.json()
+        self.session_token = data["session_token"]
+        self.session_expires_at = data["expires_at"]
+        logger.info("Agent session opened")
+
+    def _session_headers(self, force_refresh: bool = False) -> dict:
+        """Return request headers, renewing the session shortly before it expires."""
+        with self._session_lock:
+            if (
+                force_refresh
+                or not self.session_token
+                or time.time() > self.session_expires_at - 60
+            ):
+                self._open_session()
+            return {**self.headers, "X-Agent-Session": self.session_token}
 
     def _api_request(self, method: str, endpoint: str, **kwargs) -> requests.Response:
         """Make authenticated API request with exponential backoff."""
         url = f"{self.api_url}{endpoint}"
         backoff = 5
+        refreshed = False
 
         while True:
             try:
-                response = requests.request(method, url, headers=self.headers, **kwargs)
+                headers = self._session_headers()
+                response = requests.request(method, url, headers=headers, **kwargs)
                 if response.status_code == 401:
-                    logger.error("Invalid pairing key - please re-pair your agent")
-                    sys.exit(1)
+                    detail = _error_detail(response)
+                    if detail == "Agent session revoked" or refreshed:
+                        # Do not re-pair: revocation also invalidates the key
+                        self._stop_revoked(detail or "Agent session rejected")
+                    # Session expired - re-authenticate once with the pairing key
+                    self._session_headers(force_refresh=True)
+                    refreshed = True
+                    continue
                 return response
             except requests.exceptions.RequestException as e:
                 logger.warning(f"API request failed: {e}, retrying in {backoff}s")
@@ -115,6 +197,7 @@ class MT5Agent:
             for symbol in self.subscribed_symbols:
                 tick = mt5.symbol_info_tick(symbol)
                 if tick:
+                    self._observe_tick(symbol, tick)
                     prices[symbol] = {
                         "bid": float(tick.bid),
                         "ask": float(tick.ask),
@@ -131,6 +214,61 @@ class MT5Agent:
 
             time.sleep(1)
 
+    def _observe_tick(self, symbol: str, tick):
+        """
+        Learn the server offset from a tick that arrived since the last
+        poll. The last tick of a closed market is hours old and would give
+        a wrong offset, so a tick is only used once it is seen to change.
+        """
+        previous = self.last_tick_msc.get(symbol)
+        self.last_tick_msc[symbol] = tick.time_msc
+        if previous is None or tick.time_msc == previous:
+            return
+
+        offset = round((tick.time - time.time()) / SERVER_OFFSET_STEP_SECONDS)
+        offset *= SERVER_OFFSET_STEP_SECONDS
+        if abs(offset) <= SERVER_OFFSET_MAX_SECONDS:
+            self.server_offset = offset
+
+    def push_account_state(self):
+        """
+        Push account and positions snapshots whenever they change.
+
+        Snapshots are hashed every ACCOUNT_STATE_POLL_SECONDS and sent only
+        when the hash differs, plus a keepalive; trade and close jobs wake the
+        loop immediately so fills show up without waiting for the next poll.
+        """
+        last_hash = None
+        last_sent = 0.0
+
+        while self.running:
+            self.state_changed.wait(ACCOUNT_STATE_POLL_SECONDS)
+            self.state_changed.clear()
+
+            if not self.mt5_connected:
+                continue
+
+            try:
+                snapshot = {
+                    "account": self._account_snapshot(),
+                    "positions": self._positions_snapshot(),
+                }
+                digest = hashlib.sha1(
+                    json.dumps(snapshot, sort_keys=True).encode("utf-8")
+                ).hexdigest()
+
+                now = time.monotonic()
+                keepalive_due = now - last_sent >= ACCOUNT_STATE_KEEPALIVE_SECONDS
+                if digest == last_hash and not keepalive_due:
+                    continue
+
+                self._api_request(
+                    "POST", f"/agents/{self.agent_id}/state", json=snapshot
+                )
+                last_hash, last_sent = digest, now
+            except Exception as e:
+                logger.debug(f"Account state push failed: {e}")
+
     def send_heartbeat(self):
         """Send heartbeat with system metrics every 5 minutes."""
         while self.running:
@@ -169,44 +307,148 @@ class MT5Agent:
             time.sleep(300)
 
     def poll_jobs(self):
-        """Poll for and execute jobs every 30 seconds."""
+        """Long-poll for job batches; the backend parks the request until one is enqueued."""
         while self.running:
             try:
                 response = self._api_request(
-                    "GET", f"/agents/{self.agent_id}/jobs/next"
+                    "GET",
+                    f"/agents/{self.agent_id}/jobs/batch",
+                    params={"limit": JOB_BATCH_SIZE, "wait": JOB_LONG_POLL_SECONDS},
+                    timeout=JOB_LONG_POLL_SECONDS + 15,
                 )
                 if response.status_code == 204:
-                    time.sleep(30)
                     continue
-
-                job = response.json()
-                logger.info(f"Job claimed: {job.get('job_type')} (id: {job.get('id')})")
-
-                result = self._execute_job(job)
-                self.jobs_processed += 1
-
-                self._api_request(
-                    "POST",
-                    f"/agents/{self.agent_id}/jobs/{job['id']}/result",
-                    json=result,
+                response.raise_for_status()
+
+                jobs = response.json().get("jobs", [])
+                received_at = time.monotonic()
+                for job in jobs:
+                    # expires_in is relative, so local clock skew does not matter
+                    if job.get("expires_in") is not None:
+                        job["deadline"] = received_at + job["expires_in"]
+                    if job.get("age") is not None:
+                        job["enqueued_at"] = received_at - job["age"]
+                logger.info(
+                    f"Jobs claimed: {', '.join(j.get('job_type') or '?' for j in jobs)}"
                 )
-                logger.info(f"Job result posted: {result.get('status')}")
+
+                self._execute_batch(jobs)
+                self.jobs_processed += len(jobs)
 
             except Exception as e:
                 logger.warning(f"Job poll failed: {e}")
+                time.sleep(5)
+
+    def _execute_batch(self, jobs: list):
+        """
+        Execute a claimed batch, posting results as soon as they are ready;
+        reads that finish together go back in one call.
+
+        Read-only jobs run concurrently on the worker pool; everything else
+        (trades, closes, compile/deploy) runs sequentially in claim order,
+        itself on the pool so a slow trade does not hold back reads.
+        """
+        sequential = [
+            job for job in jobs if job.get("job_type") not in READ_ONLY_JOB_TYPES
+        ]
+        chain = self.job_pool.submit(self._execute_sequential, sequential)
 
-            time.sleep(30)
+        read_futures = {
+            self.job_pool.submit(self._execute_job, job): job
+            for job in jobs
+            if job.get("job_type") in READ_ONLY_JOB_TYPES
+        }
+        pending = set(read_futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            self._post_results(
+                [(read_futures[future], future.result()) for future in done]
+            )
+
+        chain.result()
+
+    def _execute_sequential(self, jobs: list):
+        for job in jobs:
+            result = self._execute_job(job)
+            self.state_changed.set()
+            self._post_results([(job, result)])
+
+    def _post_results(self, results: list):
+        """Post (job, result) pairs in one call to the batch results endpoint."""
+        self._api_request(
+            "POST",
+            f"/agents/{self.agent_id}/jobs/results",
+            json={
+                "results": [
+                    {"job_id": job["job_id"], **self._result_payload(result)}
+                    for job, result in results
+                ]
+            },
+        )
+        for job, result in results:
+            logger.info(f"Job result posted: {job['job_id']} ({result.get('status')})")
+
+    @staticmethod
+    def _result_payload(result: dict) -> dict:
+        """Shape an execution result as the backend's JobResultRequest."""
+        output = {
+            k: v for k, v in result.items() if k not in ("status", "error_message")
+        }
+        return {
+            "status": result.get("status", "failed"),
+            "output_data": output or None,
+            "error_message": result.get("error_message"),
+        }
 
     def _execute_job(self, job: dict) -> dict:
-        """Execute a job based on job_type."""
+        """
+        Execute a job based on job_type.
+
+        A state-changing job that was already executed (the backend
+        redelivered it, or posting its result failed) is answered from
+        executed_jobs instead of running again.
+        """
+        job_id = job.get("job_id")
+        job_type = job.get("job_type")
+
+        if job_type not in READ_ONLY_JOB_TYPES and job_id in self.executed_jobs:
+            logger.info(f"Replaying result for duplicate job: {job_type} (id: {job_id})")
+            return self.executed_jobs[job_id]
+
+        result = self._run_job(job)
+
+        if job_type not in READ_ONLY_JOB_TYPES and result.get("status") != "expired":
+            self.executed_jobs[job_id] = result
+            while len(self.executed_jobs) > EXECUTED_JOB_CACHE_SIZE:
+                self.executed_jobs.popitem(last=False)
+
+        return result
+
+    def _run_job(self, job: dict) -> dict:
         job_type = job.get("job_type")
         input_data = job.get("input_data", {})
 
+        deadline = job.get("deadline")
+        if deadline is not None and time.monotonic() >= deadline:
+            logger.info(f"Skipping expired job: {job_type} (id: {job.get('job_id')})")
+            return {"status": "expired", "error_message": "deadline_exceeded"}
+
+        # executed_jobs covers this process; history only a previous one
+        check_history = self._predates_start(job)
+
         try:
             if job_type == "trade":
-                return self._execute_trade(input_data)
+                return self._execute_trade(
+                    input_data, job.get("job_id"), check_history=check_history
+                )
+            elif job_type == "trade_batch":
+                return self._execute_trade_batch(
+                    input_data, job.get("job_id"), deadline, check_history
+                )
             elif job_type == "close_position":
                 return self._close_position(input_data)
+            elif job_type == "close_positions":
+                return self._close_positions(input_data, deadline)
             elif job_type == "get_positions":
                 return self._get_positions()
             elif job_type == "get_account":
@@ -230,8 +472,94 @@ class MT5Agent:
             logger.exception(f"Job execution failed: {e}")
             return {"status": "failed", "error_message": str(e)}
 
-    def _execute_trade(self, data: dict) -> dict:
-        """Execute a trade order."""
+    @staticmethod
+    def _order_comment(job_id: Optional[str], leg: Optional[int] = None) -> str:
+        """Tag orders with their job id (MT5 comments are capped at 31 chars)."""
+        if not job_id:
+            return "ForexElite Pro"
+        if leg is not None:
+            return f"FEP:{job_id.replace('-', '')[:20]}:{leg}"
+        return f"FEP:{job_id.replace('-', '')[:24]}"
+
+    def _predates_start(self, job: dict) -> bool:
+        """True if the job may have been executed before this process started."""
+        enqueued_at = job.get("enqueued_at")
+        return enqueued_at is None or enqueued_at <= self.started_at
+
+    def _find_executed_trade(self, comment: str) -> Optional[dict]:
+        """Look for a recent deal already placed for this job, e.g. before a restart."""
+        now = datetime.now()
+        deals = mt5.history_deals_get(
+            now - TRADE_HISTORY_LOOKBACK, now + timedelta(hours=1)
+        )
+        for deal in deals or ():
+            if deal.comment == comment:
+                return {
+                    "status": "completed",
+                    "fill_price": float(deal.price),
+                    "ticket": deal.order,
+                    "order_id": str(deal.order),
+                }
+        return None
+
+    def _execute_trade_batch(
+        self,
+        data: dict,
+        job_id: Optional[str],
+        deadline: Optional[float] = None,
+        check_history: bool = True,
+    ) -> dict:
+        """
+        Send a basket of market orders back-to-back.
+
+        Each leg is tagged and reported separately; legs not yet sent when the
+        job deadline passes are reported as expired rather than filled late.
+        """
+        legs = []
+        for index, order in enumerate(data.get("orders", [])):
+            if deadline is not None and time.monotonic() >= deadline:
+                legs.append({"status": "expired", "error_message": "deadline_exceeded"})
+                continue
+
+            try:
+                legs.append(
+                    self._execute_trade(
+                        order,
+                        job_id,
+                        self._order_comment(job_id, index),
+                        check_history,
+                    )
+                )
+            except Exception as e:
+                logger.exception(f"Batch order {index} failed: {e}")
+                legs.append({"status": "failed", "error_message": str(e)})
+
+        filled = sum(1 for leg in legs if leg["status"] == "completed")
+        if not filled:
+            return {
+                "status": "failed",
+                "error_message": "No orders filled",
+                "orders": legs,
+                "filled": 0,
+            }
+
+        return {"status": "completed", "orders": legs, "filled": filled}
+
+    def _execute_trade(
+        self,
+        data: dict,
+        job_id: Optional[str] = None,
+        comment: Optional[str] = None,
+        check_history: bool = True,
+    ) -> dict:
+        """Execute a trade order at most once per job."""
+        comment = comment or self._order_comment(job_id)
+        if job_id and check_history:
+            existing = self._find_executed_trade(comment)
+            if existing:
+                logger.info(f"Trade already executed for job {job_id}, not resending")
+                return existing
+
         symbol = data["symbol"]
         side = data["side"]
         volume = data["volume"]
@@ -253,7 +581,7 @@ class MT5Agent:
             "price": price,
             "deviation": 20,
             "magic": 234000,
-            "comment": "ForexElite Pro",
+            "comment": comment,
             "type_time": mt5.ORDER_TIME_GTC,
             "type_filling": mt5.ORDER_FILLING_IOC,
         }
@@ -284,21 +612,72 @@ class MT5Agent:
 
     def _close_position(self, data: dict) -> dict:
         """Close a position."""
-        ticket = data["ticket"]
+        ticket = int(data["ticket"])
         positions = mt5.positions_get(ticket=ticket)
         if not positions:
             return {"status": "failed", "error_message": f"Position {ticket} not found"}
 
-        pos = positions[0]
+        return self._send_close(positions[0])
+
+    def _close_positions(self, data: dict, deadline: Optional[float] = None) -> dict:
+        """
+        Close every open position matching symbol / side / magic.
+
+        Matches are taken from one positions_get snapshot and closed
+        back-to-back; once the deadline passes the rest are reported as
+        expired.
+        """
+        symbol = data.get("symbol")
+        side = data.get("side")
+        magic = data.get("magic")
+
+        positions = mt5.positions_get(symbol=symbol) if symbol else mt5.positions_get()
+        matches = [
+            pos
+            for pos in positions or ()
+            if (side is None or (pos.type == 0) == (side == "buy"))
+            and (magic is None or pos.magic == magic)
+        ]
+
+        legs = []
+        for pos in matches:
+            leg = {
+                "ticket": pos.ticket,
+                "symbol": pos.symbol,
+                "side": "buy" if pos.type == 0 else "sell",
+                "volume": pos.volume,
+            }
+            if deadline is not None and time.monotonic() >= deadline:
+                leg.update(status="expired", error_message="deadline_exceeded")
+            else:
+                try:
+                    leg.update(self._send_close(pos))
+                except Exception as e:
+                    logger.exception(f"Close of {pos.ticket} failed: {e}")
+                    leg.update(status="failed", error_message=str(e))
+            legs.append(leg)
+
+        closed = [leg for leg in legs if leg["status"] == "completed"]
+        output = {
+            "positions": legs,
+            "closed": len(closed),
+            "total_pnl": sum(leg.get("pnl") or 0.0 for leg in closed),
+        }
+        if legs and not closed:
+            return {"status": "failed", "error_message": "No positions closed", **output}
+
+        return {"status": "completed", **output}
+
+    def _send_close(self, pos) -> dict:
+        """Send the opposite deal for an open position."""
+        tick = mt5.symbol_info_tick(pos.symbol)
         close_request = {
             "action": mt5.TRADE_ACTION_DEAL,
             "symbol": pos.symbol,
             "volume": pos.volume,
             "type": mt5.ORDER_TYPE_SELL if pos.type == 0 else mt5.ORDER_TYPE_BUY,
-            "position": ticket,
-            "price": mt5.symbol_info_tick(pos.symbol).ask
-            if pos.type == 0
-            else mt5.symbol_info_tick(pos.symbol).bid,
+            "position": pos.ticket,
+            "price": tick.bid if pos.type == 0 else tick.ask,
             "deviation": 20,
             "magic": 234000,
             "comment": "ForexElite Pro close",
@@ -313,20 +692,39 @@ class MT5Agent:
                 "error_message": f"Close failed: {result.retcode}",
             }
 
+        # OrderSendResult has no profit; read it from the closing deal
+        deals = mt5.history_deals_get(ticket=result.deal) if result.deal else None
+        pnl = deals[0].profit if deals else pos.profit
+
         return {
             "status": "completed",
             "closed_price": float(result.price),
-            "pnl": float(result.profit),
+            "pnl": float(pnl),
         }
 
     def _get_positions(self) -> dict:
         """Get all open positions."""
+        return {"status": "completed", "positions": self._positions_snapshot()}
+
+    def _get_account(self) -> dict:
+        """Get account info."""
+        return {"status": "completed", **self._account_snapshot()}
+
+    def _positions_snapshot(self) -> list:
         positions = mt5.positions_get()
         if not positions:
-            return {"status": "completed", "positions": []}
+            return []
 
         result = []
         for pos in positions:
+            # Account-currency P&L per 1.0 price move, so the backend can
+            # re-mark P&L from ticks between snapshots
+            info = mt5.symbol_info(pos.symbol)
+            pnl_per_price = (
+                float(info.trade_tick_value / info.trade_tick_size * pos.volume)
+                if info and info.trade_tick_size
+                else None
+            )
             result.append(
                 {
                     "id": str(pos.ticket),
@@ -339,16 +737,16 @@ class MT5Agent:
                     "sl": float(pos.sl) if pos.sl else None,
                     "tp": float(pos.tp) if pos.tp else None,
                     "pnl": float(pos.profit),
+                    "pnl_per_price": pnl_per_price,
+                    "contract_size": float(info.trade_contract_size) if info else None,
                 }
             )
 
-        return {"status": "completed", "positions": result}
+        return result
 
-    def _get_account(self) -> dict:
-        """Get account info."""
+    def _account_snapshot(self) -> dict:
         info = mt5.account_info()
         return {
-            "status": "completed",
             "balance": float(info.balance),
             "equity": float(info.equity),
             "margin_used": float(info.margin),
@@ -358,7 +756,11 @@ class MT5Agent:
         }
 
     def _get_candles(self, data: dict) -> dict:
-        """Get OHLCV candles."""
+        """
+        Get OHLCV candles: the latest `count`, the bars opening in
+        [from, to] (copy_rates_range), or the `count` bars opening before
+        `before` (copy_rates_from). Times are broker server epoch seconds.
+        """
         symbol = data["symbol"]
         timeframe_map = {
             "M1": mt5.TIMEFRAME_M1,
@@ -371,27 +773,80 @@ class MT5Agent:
         timeframe = timeframe_map.get(data.get("timeframe", "H1"), mt5.TIMEFRAME_H1)
         count = data.get("count", 200)
 
-        rates = mt5.copy_rates_from_pos(symbol, timeframe, 0, count)
+        if "from" in data:
+            start = int(data["from"])
+            rates = mt5.copy_rates_range(symbol, timeframe, start, int(data["to"]))
+        elif "before" in data:
+            rates = mt5.copy_rates_from(symbol, timeframe, int(data["before"]) - 1, count)
+        else:
+            rates = mt5.copy_rates_from_pos(symbol, timeframe, 0, count)
+
         if rates is None:
             return {
                 "status": "failed",
                 "error_message": f"Failed to get candles for {symbol}",
             }
 
-        candles = []
-        for r in rates:
-            candles.append(
-                {
-                    "time": datetime.fromtimestamp(r[0]).isoformat(),
-                    "open": float(r[1]),
-                    "high": float(r[2]),
-                    "low": float(r[3]),
-                    "close": float(r[4]),
-                    "volume": int(r[5]),
-                }
-            )
+        # Where the answer is known complete from, when it says more than
+        # "from its first bar": a short page or range may just be history
+        # the terminal has not loaded
+        complete_from = None
+        if "from" in data:
+            # Terminal history is contiguous, so a bar before the range
+            # means nothing inside it is missing
+            older = mt5.copy_rates_from(symbol, timeframe, start - 1, 1)
+            if older is not None and len(older):
+                complete_from = start
+            else:
+                complete_from = self._history_start(symbol, timeframe)
+        elif len(rates) < count:
+            complete_from = self._history_start(symbol, timeframe)
+
+        return {
+            "status": "completed",
+            **self._candle_columns(rates),
+            # None until a live tick has been seen; the backend keeps its own
+            "server_offset": self.server_offset,
+            "complete_from": complete_from,
+        }
+
+    @staticmethod
+    def _history_start(symbol: str, timeframe: int) -> Optional[int]:
+        """
+        0 if the terminal holds the whole series - fewer bars than its
+        "Max bars in chart" cap, so nothing older is cut off - else None.
+        """
+        info = mt5.terminal_info()
+        if info is None:
+            return None
+        capped = mt5.copy_rates_from_pos(symbol, timeframe, info.maxbars - 1, 1)
+        return None if capped is not None and len(capped) else 0
+
+    @staticmethod
+    def _candle_columns(rates) -> dict:
+        """
+        Columnar candles straight from the MT5 rates array: open times as
+        broker server epoch seconds, then OHLC and tick volume. Payloads
+        above CANDLE_COMPRESS_MIN_BYTES are sent zlib-compressed (base64).
+        """
+        columns = {
+            "t": rates["time"].tolist(),
+            "o": rates["open"].tolist(),
+            "h": rates["high"].tolist(),
+            "l": rates["low"].tolist(),
+            "c": rates["close"].tolist(),
+            "v": rates["tick_volume"].tolist(),
+        }
 
-        return {"status": "completed", "candles": candles}
+        payload = json.dumps(columns, separators=(",", ":")).encode("utf-8")
+        if len(payload) <= CANDLE_COMPRESS_MIN_BYTES:
+            return {"format": "columnar", "candles": columns}
+
+        return {
+            "format": "columnar",
+            "encoding": "zlib",
+            "candles": base64.b64encode(zlib.compress(payload)).decode("ascii"),
+        }
 
     def _compile_ea(self, data: dict) -> dict:
         """Compile EA from source."""
@@ -488,6 +943,7 @@ class MT5Agent:
             sys.exit(1)
 
         threading.Thread(target=self.push_prices, daemon=True).start()
+        threading.Thread(target=self.push_account_state, daemon=True).start()
         threading.Thread(target=self.send_heartbeat, daemon=True).start()
         threading.Thread(target=self.poll_jobs, daemon=True).start()
 
@@ -502,8 +958,20 @@ class MT5Agent:
                 time.sleep(10)
         except KeyboardInterrupt:
             logger.info("Shutting down...")
-            self.running = False
-            mt5.shutdown()
+
+        self.running = False
+        self.job_pool.shutdown(wait=False)
+        mt5.shutdown()
+        if self.revoked:
+            sys.exit(1)
+
+
+def _error_detail(response: requests.Response) -> Optional[str]:
+    """FastAPI error detail of a response, if it has one."""
+    try:
+        return response.json().get("detail")
+    except ValueError:
+        return None
 
 
 def load_config() -> tuple: